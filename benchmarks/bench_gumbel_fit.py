@@ -0,0 +1,79 @@
+## NOTE! This script is meant to be run through the terminal, from the repository root:
+## python3 benchmarks/bench_gumbel_fit.py --sizes 1000,100000,1000000,10000000
+
+# Benchmarks the Gumbel fit methods of fit_gumbel() on Gumbel distributed scores of several sizes, like the
+# normalized scores of an all against all run. The fitted parameters are compared with the true ones and
+# with those of the full maximum likelihood fit, and the p-value step is timed for each size.
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import scipy.stats as stats
+
+sys.path.append(os.path.abspath(""))
+
+from scripts.statistical_analysis import calculate_gumbel_p_values
+from scripts.statistical_analysis import fit_gumbel
+from scripts.statistical_analysis import gumbel_goodness_of_fit
+
+# Parameters close to those of the normalized scores of a typical run
+MU = 0.12
+BETA = 0.045
+
+
+def benchmark_gumbel_fit(size, methods, seed=0, scipy_max_size=1_000_000):
+    """Fits size Gumbel distributed scores with each method.
+
+    Returns:
+        list: Rows (size, method, seconds, mu, beta, and their error relative to the "mle" fit).
+    """
+    scores = stats.gumbel_r.rvs(loc=MU, scale=BETA, size=size, random_state=np.random.default_rng(seed))
+    rows = []
+    for method in methods:
+        # The generic fit of scipy is slow on large sets
+        if method == "scipy" and size > scipy_max_size:
+            continue
+        start = time.perf_counter()
+        mu, beta = fit_gumbel(scores, method)
+        rows.append({"size": size, "method": method, "seconds": time.perf_counter() - start, "mu": mu, "beta": beta})
+
+    reference = next((row for row in rows if row["method"] == "mle"), None)
+    for row in rows:
+        if reference is not None:
+            row["mu_error"] = abs(row["mu"] - reference["mu"]) / reference["beta"]
+            row["beta_error"] = abs(row["beta"] - reference["beta"]) / reference["beta"]
+
+    start = time.perf_counter()
+    goodness_of_fit = gumbel_goodness_of_fit(scores, (rows[-1]["mu"], rows[-1]["beta"]))
+    goodness_of_fit_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    calculate_gumbel_p_values(scores, (rows[-1]["mu"], rows[-1]["beta"]), "fdr_bh")
+    rows.append({"size": size, "method": "goodness_of_fit", "seconds": goodness_of_fit_seconds, "ks_statistic": goodness_of_fit["ks_statistic"]})
+    rows.append({"size": size, "method": "p_values", "seconds": time.perf_counter() - start})
+    return rows
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmarks the Gumbel fit methods on synthetic scores of several sizes.")
+    parser.add_argument("--sizes", default="1000,100000,1000000", help="Comma separated numbers of scores. Default: 1000,100000,1000000")
+    parser.add_argument("--methods", default="scipy,mle,subsample,binned", help="Comma separated fit methods. Default: scipy,mle,subsample,binned")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0")
+    parser.add_argument("--output", default="benchmarks/results", help="Directory for the results table. Default: benchmarks/results")
+    args = parser.parse_args()
+
+    os.makedirs(args.output, exist_ok=True)
+
+    results = []
+    for size in [int(size) for size in args.sizes.split(",")]:
+        for row in benchmark_gumbel_fit(size, args.methods.split(","), args.seed):
+            results.append(row)
+            errors = f"  mu error {row['mu_error']:.2e}  beta error {row['beta_error']:.2e}" if "mu_error" in row else ""
+            print(f"{size:>10} {row['method']:<16} {row['seconds']:8.4f} s{errors}")
+
+    pd.DataFrame(results).to_csv(os.path.join(args.output, "gumbel_fit_benchmarks.csv"), index=False)
+    print(f"Results written to {args.output}")
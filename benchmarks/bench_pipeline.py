@@ -0,0 +1,166 @@
+## NOTE! This script is meant to be run through the terminal, from the repository root:
+## python3 benchmarks/bench_pipeline.py --scales 0.5,1,2 --threads 1,2,4
+
+# Benchmarks the full pipeline (chromosearch.main) on synthetic data (see synthetic_data.py) at several input
+# sizes and thread counts. Per-stage times come from the run report of each run. The recall of the planted
+# homologs is reported too, so that a faster configuration can be checked for finding the same proteins.
+# Runs from the genome need Prodigal, runs with the blastp candidate search need BLAST.
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+sys.path.append(os.path.abspath(""))
+sys.path.append(os.path.abspath("benchmarks"))
+
+from synthetic_data import database_families
+from synthetic_data import generate_dataset
+from chromosearch import main
+from scripts.sequence_store import SequenceStore
+
+
+def planted_homolog_names(dataset, proteins_path):
+    """Maps the protein names in a run to the planted homologs, by sequence (Prodigal renames the proteins)."""
+    planted = {sequence: name for name, sequence in SequenceStore.from_fasta(dataset["proteome"]) if name in dataset["homologs"]}
+    return {
+        name: planted[sequence.rstrip("*")]
+        for name, sequence in SequenceStore.from_fasta(proteins_path)
+        if sequence.rstrip("*") in planted
+    }
+
+
+def recall(dataset, final_results, proteins_path, significance=0.05):
+    """Fraction of the planted homologs whose best hit is in the family of their database entry.
+
+    Returns:
+        tuple: (recall of the best hits, recall of the best hits with a corrected p-value below significance).
+    """
+    families = database_families(dataset["database"])
+    planted = planted_homolog_names(dataset, proteins_path)
+    found = final_results[final_results["Genome_entry_id"].isin(planted)]
+    correct = found[
+        [
+            families.get(hit) == families[dataset["homologs"][planted[protein]]]
+            for protein, hit in zip(found["Genome_entry_id"], found["Database_hit_id"])
+        ]
+    ]
+    n_homologs = max(1, len(dataset["homologs"]))
+    return len(correct) / n_homologs, (correct["Corrected_pvalues"] < significance).sum() / n_homologs
+
+
+def benchmark_pipeline(dataset, work_dir, name, threads, from_genome=False, **pipeline_options):
+    """Runs the pipeline once on a dataset from generate_dataset().
+
+    Returns:
+        dict: Wall time, recall and the seconds of each stage.
+    """
+    start = time.perf_counter()
+    final_results = main(
+        fasta_path=dataset["genome"] if from_genome else dataset["proteome"],
+        output_path=work_dir,
+        gene=name,
+        database=dataset["database"],
+        process=from_genome,
+        threads=threads,
+        skip_checks=True,
+        checkpoints=False,
+        sw_cache=None,
+        sequence_store_dir=None,
+        db_cache_dir=os.path.join(work_dir, "blast_db_cache"),
+        kmer_index_dir=os.path.join(work_dir, "kmer_index"),
+        **pipeline_options,
+    )
+    wall = time.perf_counter() - start
+
+    output_dir = os.path.join(work_dir, name)
+    proteins_path = os.path.join(output_dir, f"output_{name}_DNAtoProtein.fasta") if from_genome else dataset["proteome"]
+    best_hit_recall, significant_recall = recall(dataset, final_results, proteins_path)
+
+    with open(os.path.join(output_dir, f"chromosearch_{name}_run_report.json"), "r") as f:
+        report = json.load(f)
+
+    return {
+        "seconds": wall,
+        "best_hit_recall": best_hit_recall,
+        "significant_recall": significant_recall,
+        **{f"{stage['stage']}_seconds": stage["wall_s"] for stage in report["stages"]},
+    }
+
+
+def plot_pipeline_scaling(results, path):
+    """Plots the wall time against the scale (one curve per thread count) and against the thread count (one per scale)."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, (size_axis, threads_axis) = plt.subplots(1, 2, figsize=(12, 5))
+    for threads, threads_results in results.groupby("threads"):
+        threads_results = threads_results.sort_values("scale")
+        size_axis.plot(threads_results["scale"], threads_results["seconds"], marker="o", label=f"{threads} threads")
+    for scale, scale_results in results.groupby("scale"):
+        scale_results = scale_results.sort_values("threads")
+        threads_axis.plot(scale_results["threads"], scale_results["seconds"], marker="o", label=f"scale {scale}")
+
+    size_axis.set_xlabel("scale")
+    threads_axis.set_xlabel("threads")
+    for axis in (size_axis, threads_axis):
+        axis.set_ylabel("seconds")
+        axis.set_xscale("log")
+        axis.set_yscale("log")
+        axis.legend(fontsize="small")
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmarks the full pipeline on synthetic data at several input sizes and thread counts."
+    )
+    parser.add_argument("--scales", default="0.25,0.5,1", help="Comma separated dataset scales, see synthetic_data.py. Default: 0.25,0.5,1")
+    parser.add_argument("--threads", default="1,2", help="Comma separated thread counts. Default: 1,2")
+    parser.add_argument("--from-genome", action="store_true", help="Start from the synthetic genome and run Prodigal, instead of from the proteome")
+    parser.add_argument("--candidate-search", default="blastp", choices=["blastp", "kmer"], help="Candidate search of the pipeline. Default: blastp")
+    parser.add_argument("--engine", default="biopython", choices=["biopython", "numpy"], help="Smith-Waterman scoring engine. Default: biopython")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0")
+    parser.add_argument("--output", default="benchmarks/results", help="Directory for the results table and scaling plot. Default: benchmarks/results")
+    args = parser.parse_args()
+
+    scales = [float(scale) for scale in args.scales.split(",")]
+    threads = [int(thread_count) for thread_count in args.threads.split(",")]
+    os.makedirs(args.output, exist_ok=True)
+    output = os.path.abspath(args.output)
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        # The pipeline keeps its temporary files and log in the working directory
+        os.chdir(work_dir)
+        for scale in scales:
+            dataset = generate_dataset(os.path.join(work_dir, f"data_{scale}"), scale, args.seed)
+            for thread_count in threads:
+                row = benchmark_pipeline(
+                    dataset,
+                    work_dir,
+                    f"scale{scale}_threads{thread_count}",
+                    thread_count,
+                    from_genome=args.from_genome,
+                    candidate_search=args.candidate_search,
+                    sw_engine=args.engine,
+                )
+                results.append(dict(row, scale=scale, threads=thread_count))
+                print(
+                    f"scale {scale:<6} threads {thread_count:<3} {row['seconds']:8.2f} s  "
+                    f"recall {row['best_hit_recall']:.2f} (significant {row['significant_recall']:.2f})"
+                )
+
+    results = pd.DataFrame(results)
+    results.to_csv(os.path.join(output, "pipeline_benchmarks.csv"), index=False)
+    plot_pipeline_scaling(results, os.path.join(output, "pipeline_scaling.png"))
+    print(f"Results and scaling curves written to {output}")
@@ -0,0 +1,188 @@
+## NOTE! This script is meant to be run through the terminal, from the repository root:
+## python3 benchmarks/bench_stages.py --scales 0.5,1,2 --threads 1,2,4
+
+# Benchmarks each pipeline stage on its own on synthetic data (see synthetic_data.py), at several input
+# sizes, and the Smith-Waterman alignment at several thread counts. The measurements are written as a CSV
+# table and as scaling curves (time and throughput against input size and thread count).
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(""))
+sys.path.append(os.path.abspath("benchmarks"))
+
+from synthetic_data import generate_dataset
+from scripts.characterize_proteins import calculate_mass_length
+from scripts.characterize_proteins import dereplicate_highest_score
+from scripts.protein_search import BLAST_COLUMNS
+from scripts.protein_sequence_obtainer import name_and_sequence_pair
+from scripts.sequence_store import SequenceStore
+from scripts.smith_waterman import sequence_pairs_smith_waterman
+from scripts.smith_waterman import smith_waterman_alignment
+from scripts.sorter import csv_sorter
+from scripts.statistical_analysis import statistics_calculation
+from scripts.statistics_plots import plot_statistics
+
+
+def synthetic_hits(proteome, database, truth, decoys_per_protein=5, seed=0):
+    """blastp-like hit table: the planted database entry of each homolog, plus random decoy entries per protein."""
+    rng = random.Random(seed)
+    database_names = database.names
+    rows = []
+    for name in proteome.names:
+        targets = rng.sample(database_names, min(decoys_per_protein, len(database_names)))
+        if name in truth:
+            targets.append(truth[name])
+        for target in targets:
+            evalue = rng.uniform(1e-30, 1e-5) if target == truth.get(name) else rng.uniform(1e-4, 0.05)
+            rows.append([name, target, 30.0, 100, 60, 5, 1, 100, 1, 100, evalue, 50.0])
+    return pd.DataFrame(rows, columns=BLAST_COLUMNS)
+
+
+def timed(function):
+    """Runs function once, returns (result, seconds)."""
+    start = time.perf_counter()
+    result = function()
+    return result, time.perf_counter() - start
+
+
+def benchmark_stages(dataset, work_dir, engine="biopython", sw_sample=2000, seed=0):
+    """Runs each stage once on a dataset from generate_dataset().
+
+    Returns:
+        list: Rows (stage, items, unit, seconds).
+    """
+    rows = []
+
+    def record(stage, items, unit, seconds):
+        rows.append({"stage": stage, "items": items, "unit": unit, "seconds": seconds})
+
+    # FASTA parsing, in residues per second
+    proteome, seconds = timed(lambda: SequenceStore.from_fasta(dataset["proteome"]))
+    database, database_seconds = timed(lambda: SequenceStore.from_fasta(dataset["database"]))
+    record("fasta_parsing", int(proteome.offsets[-1] + database.offsets[-1]), "residues", seconds + database_seconds)
+
+    hits = synthetic_hits(proteome, database, dataset["homologs"], seed=seed)
+
+    # Pair building, for the blastp hits and for all against all
+    pairs, seconds = timed(lambda: name_and_sequence_pair(proteome, hits, database, blastpsw=True))
+    record("pair_building", len(pairs), "pairs", seconds)
+    all_pairs, seconds = timed(lambda: name_and_sequence_pair(proteome, hits, database, blastpsw=False))
+    record("pair_building_all_vs_all", len(all_pairs), "pairs", seconds)
+
+    # Smith-Waterman scoring of a sample of the pairs, in this process
+    sample = pairs.materialize(np.arange(min(sw_sample, len(pairs))))
+    _, seconds = timed(lambda: sequence_pairs_smith_waterman(3, -1, -10, -4, True, sample, engine=engine))
+    record(f"sequence_pairs_smith_waterman_{engine}", len(sample), "pairs", seconds)
+
+    # Alignment of all hit pairs, giving the table the later stages work on
+    alignments = smith_waterman_alignment(None, pairs, "benchmark", threads=1, engine=engine)
+
+    # Sorting, from a CSV file to a CSV file as csv_sorter() does
+    hits_path = os.path.join(work_dir, "output_benchmark_protein_search.csv")
+    hits.to_csv(hits_path, index=False)
+    _, seconds = timed(lambda: csv_sorter(hits_path, "benchmark", work_dir, "evalue", "sorted_pBLAST", cut_off_value=0.05))
+    record("csv_sorter", len(hits), "rows", seconds)
+
+    # Characterization of the dereplicated hits
+    dereplicated = dereplicate_highest_score(alignments.sort_values("Score", ascending=False))
+    characterized, seconds = timed(lambda: calculate_mass_length(proteome, dereplicated, hits))
+    record("calculate_mass_length", len(dereplicated), "hits", seconds)
+
+    # Statistics, and the plots rendered in worker processes
+    (statistics, gumbel_params), seconds = timed(lambda: statistics_calculation(characterized.copy(), "fdr_bh"))
+    record("statistics_calculation", len(characterized), "hits", seconds)
+    statistics_dir = os.path.join(work_dir, "statistics") + os.sep
+    os.makedirs(statistics_dir, exist_ok=True)
+    plots, seconds = timed(lambda: plot_statistics(statistics["Normalized_score"].to_numpy(), gumbel_params, statistics_dir))
+    record("plot_statistics", plots, "plots", seconds)
+
+    return rows
+
+
+def benchmark_sw_threads(dataset, threads, engine="biopython", seed=0):
+    """Times smith_waterman_alignment() of the hit pairs of a dataset at each thread count.
+
+    Returns:
+        list: Rows (stage, threads, items, unit, seconds).
+    """
+    proteome = SequenceStore.from_fasta(dataset["proteome"])
+    database = SequenceStore.from_fasta(dataset["database"])
+    pairs = name_and_sequence_pair(proteome, synthetic_hits(proteome, database, dataset["homologs"], seed=seed), database)
+
+    rows = []
+    for thread_count in threads:
+        _, seconds = timed(lambda: smith_waterman_alignment(None, pairs, "benchmark", threads=thread_count, engine=engine))
+        rows.append({"stage": f"smith_waterman_alignment_{engine}", "threads": thread_count, "items": len(pairs), "unit": "pairs", "seconds": seconds})
+    return rows
+
+
+def plot_scaling(results, x, path):
+    """Plots seconds and throughput of each stage against column x of the results, one curve per stage."""
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, (time_axis, throughput_axis) = plt.subplots(1, 2, figsize=(12, 5))
+    for stage, stage_results in results.groupby("stage"):
+        stage_results = stage_results.sort_values(x)
+        time_axis.plot(stage_results[x], stage_results["seconds"], marker="o", label=stage)
+        throughput_axis.plot(stage_results[x], stage_results["throughput"], marker="o", label=stage)
+
+    for axis, label in ((time_axis, "seconds"), (throughput_axis, "items per second")):
+        axis.set_xlabel(x)
+        axis.set_ylabel(label)
+        axis.set_xscale("log")
+        axis.set_yscale("log")
+    time_axis.legend(fontsize="small")
+    fig.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmarks each pipeline stage on synthetic data at several input sizes and thread counts."
+    )
+    parser.add_argument("--scales", default="0.25,0.5,1,2", help="Comma separated dataset scales, see synthetic_data.py. Default: 0.25,0.5,1,2")
+    parser.add_argument("--threads", default="1,2,4", help="Comma separated thread counts for the Smith-Waterman alignment, run on the largest scale. Default: 1,2,4")
+    parser.add_argument("--engine", default="biopython", choices=["biopython", "numpy"], help="Smith-Waterman scoring engine. Default: biopython")
+    parser.add_argument("--sw-sample", type=int, default=2000, help="Pairs scored by sequence_pairs_smith_waterman(). Default: 2000")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0")
+    parser.add_argument("--output", default="benchmarks/results", help="Directory for the results table and scaling plots. Default: benchmarks/results")
+    args = parser.parse_args()
+
+    scales = [float(scale) for scale in args.scales.split(",")]
+    threads = [int(thread_count) for thread_count in args.threads.split(",")]
+    os.makedirs(args.output, exist_ok=True)
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in scales:
+            scale_dir = os.path.join(work_dir, f"scale_{scale}")
+            dataset = generate_dataset(scale_dir, scale, args.seed)
+            for row in benchmark_stages(dataset, scale_dir, args.engine, args.sw_sample, args.seed):
+                results.append(dict(row, scale=scale, threads=1))
+                print(f"scale {scale:<6} {row['stage']:<42} {row['seconds']:8.3f} s  {row['items'] / row['seconds']:12.1f} {row['unit']}/s")
+
+        for row in benchmark_sw_threads(dataset, threads, args.engine, args.seed):
+            results.append(dict(row, scale=scales[-1]))
+            print(f"threads {row['threads']:<4} {row['stage']:<42} {row['seconds']:8.3f} s  {row['items'] / row['seconds']:12.1f} {row['unit']}/s")
+
+    results = pd.DataFrame(results)
+    results["throughput"] = results["items"] / results["seconds"]
+    results.to_csv(os.path.join(args.output, "stage_benchmarks.csv"), index=False)
+
+    stage_results = results[~results["stage"].str.startswith("smith_waterman_alignment")]
+    plot_scaling(stage_results, "scale", os.path.join(args.output, "stage_scaling_size.png"))
+    plot_scaling(results[results["stage"].str.startswith("smith_waterman_alignment")], "threads", os.path.join(args.output, "stage_scaling_threads.png"))
+    print(f"Results and scaling curves written to {args.output}")
@@ -0,0 +1,84 @@
+## NOTE! This script is meant to be run through the terminal, from the repository root:
+## python3 benchmarks/bench_startup.py --repeats 10
+
+# Benchmarks the fixed startup cost of a run, which dominates with many short jobs: the interpreter start
+# and imports of chromosearch.py (measured as `chromosearch.py -h` in a fresh interpreter), and the
+# requirement check with and without its stamp file. The target is below TARGET_SECONDS for the start with a
+# stamped requirement check. Prodigal and BLAST are only found when they are in PATH; without them the
+# requirement check fails and its measurements are skipped.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.abspath(""))
+
+# Cold start target: interpreter, imports and argument parsing plus a stamped requirement check
+TARGET_SECONDS = 0.75
+
+
+def median_seconds(command, repeats):
+    """Median wall time of a command run repeats times in a fresh process."""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def check_seconds(stamp_dir, candidate_search, repeats):
+    """Median wall time of check_requirements() in a fresh process, the first run writes the stamp.
+
+    Returns:
+        float: The median, None when the check fails (e.g. blastp or Prodigal not in PATH).
+    """
+    code = (
+        "import sys; sys.path.insert(0, '.');"
+        "from chromosearch import pipeline_requirements;"
+        "from scripts.initialization_scripts import check_requirements;"
+        "import time; start = time.perf_counter();"
+        f"check_requirements(pipeline_requirements({candidate_search!r}), {stamp_dir!r});"
+        "print(time.perf_counter() - start)"
+    )
+    times = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+        if result.returncode != 0:
+            return None
+        times.append(float(result.stdout.split()[-1]))
+    return statistics.median(times)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmarks the startup time of chromosearch.py.")
+    parser.add_argument("--repeats", type=int, default=10, help="Runs per measurement, the median is reported. Default: 10")
+    parser.add_argument("--candidate-search", default="blastp", choices=["blastp", "kmer"], help="Candidate search whose requirements are checked. Default: blastp")
+    args = parser.parse_args()
+
+    results = {
+        "python -c pass": median_seconds([sys.executable, "-c", "pass"], args.repeats),
+        "import chromosearch": median_seconds([sys.executable, "-c", "import chromosearch"], args.repeats),
+        "chromosearch.py -h": median_seconds([sys.executable, "chromosearch.py", "-h"], args.repeats),
+    }
+
+    with tempfile.TemporaryDirectory() as stamp_dir:
+        if check_seconds(stamp_dir, args.candidate_search, 1) is None:
+            print("Requirement check failed (are Prodigal and BLAST in PATH?), skipping its measurements")
+        else:
+            results["check_requirements, no stamp"] = check_seconds(None, args.candidate_search, args.repeats)
+            results["check_requirements, stamped"] = check_seconds(stamp_dir, args.candidate_search, args.repeats)
+
+    for name, seconds in results.items():
+        print(f"{name:<32} {seconds:8.3f} s")
+
+    if "check_requirements, stamped" not in results:
+        sys.exit(0)
+
+    cold_start = results["chromosearch.py -h"] + results["check_requirements, stamped"]
+    print(f"{'cold start, stamped check':<32} {cold_start:8.3f} s  (target {TARGET_SECONDS} s: {'met' if cold_start <= TARGET_SECONDS else 'missed'})")
@@ -0,0 +1,110 @@
+## NOTE! This script is meant to be run through the terminal, from the repository root:
+## python3 benchmarks/bench_sw_dispatch.py
+
+import argparse
+import os
+import pickle
+import random
+import resource
+import sys
+import time
+import concurrent.futures as futures
+from functools import partial
+
+import numpy as np
+
+sys.path.append(os.path.abspath(""))
+
+from scripts.protein_sequence_obtainer import SequencePairs
+from scripts.sequence_store import SequenceStore
+from scripts.sequence_store import attach_sequence_store
+from scripts.sequence_store import shared_sequence_store
+from scripts.smith_waterman import schedule_sequence_pairs
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+
+def random_store(rng, n_sequences, prefix, min_length=50, max_length=600):
+    return SequenceStore.from_records(
+        [
+            (f"{prefix}{number}", "".join(rng.choice(AMINO_ACIDS) for _ in range(rng.randint(min_length, max_length))))
+            for number in range(n_sequences)
+        ]
+    )
+
+
+def touch_sequence_pairs(sequence_pairs):
+    """Stand-in for the alignment of pickled sequence pairs: reads every residue."""
+    return np.array([len(seq1) + len(seq2) for (_, seq1), (_, seq2) in sequence_pairs], dtype=float)
+
+
+def touch_index_pairs(queries, targets, index_pairs):
+    """Stand-in for the alignment of index pairs into shared stores: reads every residue."""
+    queries = attach_sequence_store(queries)
+    targets = attach_sequence_store(targets)
+    return np.array(
+        [len(queries.sequence(query)) + len(targets.sequence(target)) for query, target in index_pairs.tolist()],
+        dtype=float,
+    )
+
+
+def worker_task(function, payload):
+    """Runs a task and reports the peak resident memory of the worker in MB."""
+    function(payload)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def dispatch(tasks, function, workers):
+    """Runs the tasks in a fresh pool, returning (pickled MB, pickling seconds, wall seconds, max worker peak RSS MB)."""
+    start = time.perf_counter()
+    pickled = sum(len(pickle.dumps((function, task))) for task in tasks)
+    pickling = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with futures.ProcessPoolExecutor(max_workers=workers) as ex:
+        peak_rss = max(ex.map(partial(worker_task, function), tasks))
+    return pickled / 1024**2, pickling, time.perf_counter() - start, peak_rss
+
+
+def benchmark_sw_dispatch(n_queries=200, n_targets=2000, workers=2, seed=0):
+    """Compares handing the Smith-Waterman workers pickled sequences against index pairs into shared stores.
+
+    The workers only read the sequences of their pairs, so the measurements show the cost of getting the
+    sequences to the workers, not of aligning them.
+
+    Returns:
+        dict: (pickled MB, pickling s, wall s, max worker peak RSS MB) per approach.
+    """
+    rng = random.Random(seed)
+    sequence_pairs = SequencePairs(random_store(rng, n_queries, "q"), random_store(rng, n_targets, "t"))
+    tasks = list(schedule_sequence_pairs(sequence_pairs, workers))
+
+    results = {}
+    results["pickled sequence pairs"] = dispatch(
+        [sequence_pairs.materialize(task) for task in tasks], touch_sequence_pairs, workers
+    )
+    with shared_sequence_store(sequence_pairs.queries) as queries, shared_sequence_store(sequence_pairs.targets) as targets:
+        results["index pairs, shared stores"] = dispatch(
+            [np.column_stack(sequence_pairs.table_indices(task)) for task in tasks],
+            partial(touch_index_pairs, queries, targets),
+            workers,
+        )
+    return results
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Serialization cost and worker memory of the ways to hand sequence pairs to the Smith-Waterman workers."
+    )
+    parser.add_argument("--queries", type=int, default=200, help="Number of query sequences. Default: 200")
+    parser.add_argument("--targets", type=int, default=2000, help="Number of database sequences, all pairs are dispatched. Default: 2000")
+    parser.add_argument("--workers", type=int, default=2, help="Number of worker processes. Default: 2")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0")
+    args = parser.parse_args()
+
+    results = benchmark_sw_dispatch(args.queries, args.targets, args.workers, args.seed)
+
+    print(f"{args.queries * args.targets} pairs, {args.workers} workers")
+    for approach, (pickled, pickling, wall, peak_rss) in results.items():
+        print(f"{approach:<28} pickled {pickled:9.1f} MB in {pickling:6.2f} s  wall {wall:6.2f} s  worker peak RSS {peak_rss:7.1f} MB")
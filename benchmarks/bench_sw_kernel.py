@@ -0,0 +1,155 @@
+## NOTE! This script is meant to be run through the terminal, from the repository root:
+## python3 benchmarks/bench_sw_kernel.py
+
+# Before measuring, the scores of the NumPy engine are checked against PairwiseAligner in local mode for
+# several scoring settings (see check_sw_kernel()), and the script exits with an error if any differ.
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.abspath(""))
+
+from Bio.Align import PairwiseAligner
+from Bio.Align import substitution_matrices
+
+from scripts.smith_waterman_numpy import scoring_table
+from scripts.smith_waterman_numpy import smith_waterman_score
+from scripts.smith_waterman_numpy import smith_waterman_scores_one_to_many
+
+AMINO_ACIDS = "ACDEFGHIKLMNPQRSTVWY"
+
+# (substitution matrix, match, mismatch, gap_open, gap_extend) checked by check_sw_kernel(): BLOSUM62 and
+# plain match/mismatch scores, gap_open equal to gap_extend, and non-integer scores (float64 DP)
+CHECK_SETTINGS = [
+    ("BLOSUM62", 3, -1, -10, -4),
+    ("BLOSUM62", 3, -1, -11, -1),
+    ("BLOSUM62", 3, -1, -5, -5),
+    (None, 3, -1, -10, -4),
+    (None, 2, -3, -4, -4),
+    (None, 1.5, -0.5, -2.5, -0.75),
+]
+
+
+def random_protein(rng, length):
+    return "".join(rng.choice(AMINO_ACIDS) for _ in range(length))
+
+
+def measure(function, n_pairs):
+    """Runs function once and returns the throughput in pairs per second."""
+    start = time.perf_counter()
+    function()
+    return n_pairs / (time.perf_counter() - start)
+
+
+def check_sw_kernel(n_targets=40, block_size=8, seed=0):
+    """Compares the scores of the NumPy engine with PairwiseAligner(mode="local").score for CHECK_SETTINGS.
+
+    The targets have lengths from 1 to 300 residues, so that the blocks of block_size are padded, and one
+    holds selenocysteine (U), outside of the BLOSUM62 alphabet: PairwiseAligner raises for it with BLOSUM62,
+    where the NumPy engine gives NaN.
+
+    Returns:
+        list: (settings, target number, PairwiseAligner score, NumPy engine score) of the differing pairs.
+    """
+    rng = random.Random(seed)
+    query = random_protein(rng, 120)
+    targets = [random_protein(rng, rng.randint(1, 300)) for _ in range(n_targets)]
+    # A homolog of the query, so that the scores are not all close to zero
+    targets[1] = query[10:60] + random_protein(rng, 5) + query[70:110]
+    targets[2] = targets[2][:20] + "U" + targets[2][21:]
+
+    differences = []
+    for settings in CHECK_SETTINGS:
+        matrix_name, match, mismatch, gap_open, gap_extend = settings
+        aligner = PairwiseAligner(mode="local")
+        if matrix_name is not None:
+            aligner.substitution_matrix = substitution_matrices.load(matrix_name)
+        else:
+            aligner.match_score = match
+            aligner.mismatch_score = mismatch
+        aligner.open_gap_score = gap_open
+        aligner.extend_gap_score = gap_extend
+        table, valid = scoring_table(match, mismatch, aligner.substitution_matrix)
+
+        batched = smith_waterman_scores_one_to_many(query, targets, table, gap_open, gap_extend, valid, block_size)
+        for number, target in enumerate(targets):
+            try:
+                expected = aligner.score(query, target)
+            except ValueError:
+                expected = math.nan
+            try:
+                single = smith_waterman_score(query, target, table, gap_open, gap_extend, valid)
+            except ValueError:
+                single = math.nan
+            for score in (float(batched[number]), single):
+                if not (score == expected or (math.isnan(score) and math.isnan(expected))):
+                    differences.append((settings, number, expected, score))
+    return differences
+
+
+def benchmark_sw_kernel(n_targets=256, query_length=350, min_length=50, max_length=600, block_size=64, seed=0):
+    """Measures the throughput of one query against n_targets database sequences for each way of scoring them.
+
+    Returns:
+        dict: Pairs per second per method.
+    """
+    rng = random.Random(seed)
+    query = random_protein(rng, query_length)
+    targets = [random_protein(rng, rng.randint(min_length, max_length)) for _ in range(n_targets)]
+
+    blosum62 = substitution_matrices.load("BLOSUM62")
+    aligner = PairwiseAligner()
+    aligner.mode = "local"
+    aligner.substitution_matrix = blosum62
+    aligner.open_gap_score = -10
+    aligner.extend_gap_score = -4
+    table, valid = scoring_table(3, -1, blosum62)
+
+    return {
+        "biopython align()[0].score (previous per-pair loop)": measure(
+            lambda: [aligner.align(query, target)[0].score for target in targets], n_targets
+        ),
+        "biopython score()": measure(
+            lambda: [aligner.score(query, target) for target in targets], n_targets
+        ),
+        "numpy per pair": measure(
+            lambda: [smith_waterman_score(query, target, table, -10, -4, valid) for target in targets], n_targets
+        ),
+        f"numpy one query vs many (block {block_size})": measure(
+            lambda: smith_waterman_scores_one_to_many(query, targets, table, -10, -4, valid, block_size), n_targets
+        ),
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Throughput of the Smith-Waterman scoring engines for one query against many database sequences."
+    )
+    parser.add_argument("--targets", type=int, default=256, help="Number of database sequences. Default: 256")
+    parser.add_argument("--query-length", type=int, default=350, help="Length of the query. Default: 350")
+    parser.add_argument("--block-size", type=int, default=64, help="Targets aligned together by the batched kernel. Default: 64")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0")
+    args = parser.parse_args()
+
+    differences = check_sw_kernel(seed=args.seed)
+    for settings, number, expected, score in differences:
+        print(f"Scores differ for {settings}, target {number}: PairwiseAligner {expected}, NumPy engine {score}")
+    if differences:
+        sys.exit(1)
+    print(f"NumPy engine scores identical to PairwiseAligner in {len(CHECK_SETTINGS)} scoring settings")
+
+    results = benchmark_sw_kernel(
+        n_targets=args.targets,
+        query_length=args.query_length,
+        block_size=args.block_size,
+        seed=args.seed,
+    )
+
+    baseline = next(iter(results.values()))
+    for method, pairs_per_second in results.items():
+        print(f"{method:<55} {pairs_per_second:10.1f} pairs/s  {pairs_per_second / baseline:5.2f}x")
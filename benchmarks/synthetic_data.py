@@ -0,0 +1,222 @@
+## NOTE! This script is meant to be run through the terminal, from the repository root:
+## python3 benchmarks/synthetic_data.py path/for/dataset --scale 1
+
+# Seeded generator of synthetic benchmark data: a chromoprotein-like protein database, a proteome with
+# planted homologs of database entries, and a genome encoding that proteome. The same seed and scale always
+# give the same files, so benchmark runs at different times or on different machines are comparable.
+
+import argparse
+import csv
+import os
+import random
+
+# Amino acid background frequencies (UniProtKB/Swiss-Prot), so that random alignments score like real ones
+AMINO_ACID_FREQUENCIES = {
+    "A": 8.25, "R": 5.53, "N": 4.06, "D": 5.45, "C": 1.37, "Q": 3.93, "E": 6.75, "G": 7.07, "H": 2.27, "I": 5.96,
+    "L": 9.66, "K": 5.84, "M": 2.42, "F": 3.86, "P": 4.70, "S": 6.56, "T": 5.34, "W": 1.08, "Y": 2.92, "V": 6.87,
+}
+AMINO_ACIDS = list(AMINO_ACID_FREQUENCIES)
+WEIGHTS = list(AMINO_ACID_FREQUENCIES.values())
+
+# Synonymous codons, the genome is back-translated with random ones and translates into the same proteins
+CODONS = {
+    "A": ["GCT", "GCC", "GCA", "GCG"], "R": ["CGT", "CGC", "AGA", "AGG"], "N": ["AAT", "AAC"], "D": ["GAT", "GAC"],
+    "C": ["TGT", "TGC"], "Q": ["CAA", "CAG"], "E": ["GAA", "GAG"], "G": ["GGT", "GGC", "GGA", "GGG"],
+    "H": ["CAT", "CAC"], "I": ["ATT", "ATC", "ATA"], "L": ["CTT", "CTC", "CTG", "TTA", "TTG"], "K": ["AAA", "AAG"],
+    "M": ["ATG"], "F": ["TTT", "TTC"], "P": ["CCT", "CCC", "CCA", "CCG"], "S": ["TCT", "TCC", "AGT", "AGC"],
+    "T": ["ACT", "ACC", "ACA", "ACG"], "W": ["TGG"], "Y": ["TAT", "TAC"], "V": ["GTT", "GTC", "GTA", "GTG"],
+}
+STOP_CODONS = ["TAA", "TAG", "TGA"]
+SHINE_DALGARNO = "AGGAGG"
+
+# Sizes at scale 1
+DATABASE_ENTRIES = 500
+PROTEOME_PROTEINS = 400
+HOMOLOG_FRACTION = 0.1
+
+
+def random_protein(rng, length):
+    """Random protein of a length, starting with M, residues drawn from the background frequencies."""
+    return "M" + "".join(rng.choices(AMINO_ACIDS, WEIGHTS, k=length - 1))
+
+
+def random_length(rng, min_length=80, max_length=600):
+    """Protein length from a log-normal distribution around 300, like bacterial proteins, clipped to a range."""
+    return int(min(max(rng.lognormvariate(5.6, 0.45), min_length), max_length))
+
+
+def mutate(rng, protein, identity, indel_rate=0.01):
+    """Planted homolog: substitutes a fraction 1 - identity of the residues and adds short insertions and deletions.
+
+    Args:
+        rng (random.Random): Random generator.
+        protein (str): Ancestral protein.
+        identity (float): Fraction of residues kept.
+        indel_rate (float, optional): Probability of an insertion or deletion of 1 to 3 residues per position. Defaults to 0.01.
+
+    Returns:
+        str: The homolog, starting with M.
+    """
+    residues = []
+    for residue in protein[1:]:
+        if rng.random() < indel_rate:
+            if rng.random() < 0.5:
+                continue
+            residues += rng.choices(AMINO_ACIDS, WEIGHTS, k=rng.randint(1, 3))
+        residues.append(residue if rng.random() < identity else rng.choices(AMINO_ACIDS, WEIGHTS)[0])
+    return "M" + "".join(residues)
+
+
+def synthetic_database(rng, n_entries, families=None):
+    """Chromoprotein-like database: protein families of related entries, with UniProt style names.
+
+    Args:
+        rng (random.Random): Random generator.
+        n_entries (int): Number of database entries.
+        families (int, optional): Number of protein families. Defaults to None (one per 5 entries).
+
+    Returns:
+        list: (name, sequence) tuples.
+    """
+    families = families or max(1, n_entries // 5)
+    ancestors = [random_protein(rng, random_length(rng, 150, 400)) for _ in range(families)]
+    records = []
+    for number in range(n_entries):
+        family = number % families
+        accession = f"SYN{number:05d}"
+        records.append(
+            (
+                f"sp|{accession}|{accession}_SYNTH Synthetic chromoprotein family {family} OS=Synthetic OX=0",
+                mutate(rng, ancestors[family], rng.uniform(0.6, 0.95)),
+            )
+        )
+    return records
+
+
+def synthetic_proteome(rng, database, n_proteins, homolog_fraction=HOMOLOG_FRACTION, identity=(0.35, 0.9)):
+    """Proteome of random proteins, a fraction of them planted homologs of database entries.
+
+    Args:
+        rng (random.Random): Random generator.
+        database (list): (name, sequence) tuples of the database.
+        n_proteins (int): Number of proteins.
+        homolog_fraction (float, optional): Fraction of planted homologs. Defaults to HOMOLOG_FRACTION.
+        identity (tuple, optional): Range of the identity of the planted homologs to their database entry. Defaults to (0.35, 0.9).
+
+    Returns:
+        tuple: (records, truth), the (name, sequence) tuples and a dictionary of planted homolog name to the
+            first word of the name of its database entry.
+    """
+    n_homologs = int(round(n_proteins * homolog_fraction))
+    homologs = set(rng.sample(range(n_proteins), n_homologs))
+    records, truth = [], {}
+    for number in range(n_proteins):
+        name = f"synthetic_protein_{number + 1}"
+        if number in homologs:
+            entry_name, entry = rng.choice(database)
+            records.append((name, mutate(rng, entry, rng.uniform(*identity))))
+            truth[name] = entry_name.split()[0]
+        else:
+            records.append((name, random_protein(rng, random_length(rng))))
+    return records, truth
+
+
+def database_families(database_path):
+    """Family of each entry of a synthetic database, {first word of the name: family}, read from the headers."""
+    families = {}
+    with open(database_path, "r") as f:
+        for line in f:
+            if line.startswith(">"):
+                words = line[1:].split()
+                families[words[0]] = int(words[words.index("family") + 1])
+    return families
+
+
+def random_dna(rng, length, gc=0.5):
+    return "".join(rng.choices("GCAT", [gc / 2, gc / 2, (1 - gc) / 2, (1 - gc) / 2], k=length))
+
+
+def synthetic_genome(rng, proteome, n_contigs=1, intergenic=(50, 250)):
+    """Genome encoding a proteome, genes separated by random intergenic DNA with a ribosome binding site.
+
+    The genes stay in proteome order on the forward strand, so Prodigal finds them in that order.
+
+    Args:
+        rng (random.Random): Random generator.
+        proteome (list): (name, sequence) tuples.
+        n_contigs (int, optional): Number of contigs the genes are spread over. Defaults to 1.
+        intergenic (tuple, optional): Range of the intergenic distances. Defaults to (50, 250).
+
+    Returns:
+        list: (contig name, DNA sequence) tuples.
+    """
+    contigs = [[] for _ in range(n_contigs)]
+    for number, (_, protein) in enumerate(proteome):
+        spacer = random_dna(rng, rng.randint(*intergenic))
+        gene = "".join(rng.choice(CODONS[residue]) for residue in protein) + rng.choice(STOP_CODONS)
+        contigs[number * n_contigs // len(proteome)].append(spacer + SHINE_DALGARNO + random_dna(rng, 7) + gene)
+    return [
+        (f"synthetic_contig_{number + 1}", "".join(genes) + random_dna(rng, rng.randint(*intergenic)))
+        for number, genes in enumerate(contigs)
+    ]
+
+
+def write_fasta(path, records, width=60):
+    with open(path, "w") as f:
+        for name, sequence in records:
+            f.write(f">{name}\n")
+            for start in range(0, len(sequence), width):
+                f.write(sequence[start : start + width] + "\n")
+
+
+def generate_dataset(directory, scale=1.0, seed=0, homolog_fraction=HOMOLOG_FRACTION, n_contigs=1):
+    """Writes a synthetic dataset: database.fasta, proteome.faa, genome.fasta and truth.tsv.
+
+    Args:
+        directory (str): Output directory.
+        scale (float, optional): Multiplies the number of database entries and proteins. Defaults to 1.0.
+        seed (int, optional): Random seed. Defaults to 0.
+        homolog_fraction (float, optional): Fraction of the proteins that are planted homologs. Defaults to HOMOLOG_FRACTION.
+        n_contigs (int, optional): Number of contigs of the genome. Defaults to 1.
+
+    Returns:
+        dict: Paths of the files ("database", "proteome", "genome", "truth") and the truth dictionary ("homologs").
+    """
+    rng = random.Random(f"{seed}-{scale}")
+    database = synthetic_database(rng, max(1, int(DATABASE_ENTRIES * scale)))
+    proteome, truth = synthetic_proteome(rng, database, max(1, int(PROTEOME_PROTEINS * scale)), homolog_fraction)
+    genome = synthetic_genome(rng, proteome, n_contigs)
+
+    os.makedirs(directory, exist_ok=True)
+    paths = {
+        "database": os.path.join(directory, "database.fasta"),
+        "proteome": os.path.join(directory, "proteome.faa"),
+        "genome": os.path.join(directory, "genome.fasta"),
+        "truth": os.path.join(directory, "truth.tsv"),
+    }
+    write_fasta(paths["database"], database)
+    write_fasta(paths["proteome"], proteome)
+    write_fasta(paths["genome"], genome)
+    with open(paths["truth"], "w", newline="") as f:
+        writer = csv.writer(f, delimiter="\t")
+        writer.writerow(["protein", "database_entry"])
+        writer.writerows(truth.items())
+
+    return dict(paths, homologs=truth)
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Writes a seeded synthetic dataset (database, proteome with planted homologs, genome) for the benchmarks."
+    )
+    parser.add_argument("output", help="Output directory")
+    parser.add_argument("--scale", type=float, default=1.0, help=f"Size multiplier, scale 1 has {DATABASE_ENTRIES} database entries and {PROTEOME_PROTEINS} proteins. Default: 1")
+    parser.add_argument("--homolog-fraction", type=float, default=HOMOLOG_FRACTION, help=f"Fraction of the proteins that are planted homologs of database entries. Default: {HOMOLOG_FRACTION}")
+    parser.add_argument("--contigs", type=int, default=1, help="Number of contigs of the genome. Default: 1")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0")
+    args = parser.parse_args()
+
+    dataset = generate_dataset(args.output, args.scale, args.seed, args.homolog_fraction, args.contigs)
+    print(f"Wrote {', '.join(dataset[key] for key in ('database', 'proteome', 'genome', 'truth'))}")
+    print(f"{len(dataset['homologs'])} planted homologs")
@@ -3,22 +3,61 @@
 import argparse
 import logging
 import os
+import shutil
 import tempfile
+import Bio
+import numpy as np
 import pandas as pd
 
 from scripts.initialization_scripts import check_requirements
 from scripts.protein_sequence_obtainer import name_and_sequence_pair as nm
 from scripts.smith_waterman import smith_waterman_alignment as sm
+from scripts.smith_waterman import SW_ENGINES
 from scripts.protein_search import protein_blastp_search as pbs
-from scripts.sorter import csv_sorter
+from scripts.kmer_prefilter import kmer_candidate_search
+from scripts.kmer_prefilter import KMER_ALPHABETS
+from scripts.sorter import table_sorter
+from scripts.table_io import table_path
+from scripts.table_io import write_table
+from scripts.table_io import TABLE_FORMATS
+from scripts.sequence_store import sequence_store
+from scripts.checkpoint import file_hash, run_stage, stage_manifest, table_hash, tool_version
+from scripts.instrumentation import RunReport
 from scripts.DNAtoProtein_prodigal import run_prodigal as DNAtoProtein
-from scripts.statistical_analysis import statistics_calculation
 from scripts.initialization_scripts import suppress_output
 
 ## Thanos' code
 
 from scripts.characterize_proteins import dereplicate_highest_score
 from scripts.characterize_proteins import calculate_mass_length
+from scripts.protein_properties import protein_properties
+
+# Dictionary used for checking requirements
+# packages are used by
+REQUIREMENTS = {
+    "packages": [
+        ("Bio", "1.84"),  # biopython
+        ("matplotlib", "3.9.2"),
+        ("numpy", "2.1.0"),
+        ("pandas", "2.2.2"),
+        ("scipy", "1.14.1"),
+        ("seaborn", "0.13.2"),
+        ("statsmodels", "0.14.2"),
+    ],
+    "python_version": "3.12.5",
+    "prodigal_version": "2.6.3",
+    "blast_version": "2.16.0",
+}
+
+
+def pipeline_requirements(candidate_search="blastp", table_format="csv"):
+    """Requirements of a run, BLAST is not needed with the k-mer prefilter and pyarrow only for binary result files."""
+    requirements = dict(REQUIREMENTS)
+    if candidate_search == "kmer":
+        del requirements["blast_version"]
+    if table_format != "csv":
+        requirements["packages"] = requirements["packages"] + [("pyarrow", None)]
+    return requirements
 
 ## main function
 
@@ -39,7 +78,50 @@ def main(
     blastpnsw=True,
     mass_n_length=True,
     multiple_test_correction="fdr_bh",
+    gumbel_fit="auto",
+    null_calibration=False,
+    db_cache_dir="temp/blast_db_cache",
+    db_cache_max_size=2048 * 1024**2,
+    evalue_cutoff=0.05,
+    max_hits_per_query=None,
+    blast_shards=1,
+    prodigal_meta=False,
+    sw_engine="biopython",
+    sw_cache="temp/sw_score_cache.sqlite",
+    sw_cache_max_entries=5_000_000,
+    sw_top_k=1,
+    candidate_search="blastp",
+    kmer_index_dir="temp/kmer_index",
+    kmer_alphabet="murphy10",
+    kmer_seed="1101011",
+    kmer_min_hits=3,
+    sequence_store_dir="temp/sequence_store",
+    table_format="csv",
+    checkpoints=True,
+    profile=False,
+    plots="png",
+    plot_dpi=600,
+    skip_checks=False,
+    blast_database=None,
+    sw_executor=None,
+    plot_executor=None,
+    shared_process=False,
 ):
+    """Runs the ChromoSearch pipeline on a single genome.
+
+    Most arguments mirror the command line options, see add_pipeline_arguments(). The last five
+    let a caller that runs several genomes (chromosearch_batch.py) share work between them.
+
+    Args:
+        skip_checks (bool, optional): Skip the requirement check. Defaults to False.
+        blast_database (str, optional): Location + prefix of an already prepared BLAST protein database for the database FASTA. Defaults to None (prepared by the blastp step).
+        sw_executor (concurrent.futures.Executor, optional): Process pool to run the Smith-Waterman alignments in. Defaults to None (a pool per run).
+        plot_executor (concurrent.futures.Executor, optional): Process pool to render the plots in. Defaults to None (a pool per run).
+        shared_process (bool, optional): Other genomes run in threads of this process, see RunReport. Defaults to False.
+
+    Returns:
+        pandas.DataFrame: The final results table.
+    """
 
     logging.basicConfig(
         level=logging.DEBUG,
@@ -67,28 +149,28 @@ def main(
     # Check requirements before running the pipeline
     # =================================================================
 
-    # Dictionary used for checking requirements
-    # packages are used by
-    requirements = {
-        "packages": [
-            ("Bio", "1.84"),  # biopython
-            ("matplotlib", "3.9.2"),
-            ("numpy", "2.1.0"),
-            ("pandas", "2.2.2"),
-            ("scipy", "1.14.1"),
-            ("seaborn", "0.13.2"),
-            ("statsmodels", "0.14.2"),
-        ],
-        "python_version": "3.12.5",
-        "prodigal_version": "2.6.3",
-        "blast_version": "2.16.0",
-    }
+    if not skip_checks:
+        check_requirements(pipeline_requirements(candidate_search, table_format))
+
+    # Stages hand their tables to the next one in memory, intermediates are only written as a copy
+    intermediates = temp_output if save_intermediates else None
 
-    check_requirements(requirements)
+    def save_intermediate(table, name):
+        if save_intermediates:
+            write_table(table, table_path(f"{temp_output}/output_{gene}_{name}", table_format))
 
-    # if save_intermediates:
-    temp_protein_search = os.path.join(temp_output)
-    temp_SW_csv = os.path.join(temp_output)
+    # Stages whose inputs, parameters and tools did not change since the last run are reloaded from their checkpoint
+    checkpoint_dir = os.path.join(temp_output, "checkpoints") if checkpoints else None
+
+    # Wall time, CPU time, peak memory and throughput of each stage, see scripts/instrumentation.py
+    report = RunReport(
+        gene,
+        profile_dir=f"{output_dir}/profile" if profile else None,
+        shared_process=shared_process,
+        threads=threads,
+        candidate_search=candidate_search,
+        sw_engine=sw_engine,
+    )
 
     try:
 
@@ -98,97 +180,262 @@ def main(
 
         if process:
             print(f"Identifying candidate proteins in DNA: started...")
-            DNAtoProtein(fasta_path, output_dir, gene)
+
+            def run_prodigal():
+                # Errors of Prodigal are only printed, an old output must not pass for the new one
+                if os.path.exists(DNA_to_protein_directory):
+                    os.remove(DNA_to_protein_directory)
+                DNAtoProtein(fasta_path, output_dir, gene, threads=threads, meta=prodigal_meta)
+                return DNA_to_protein_directory
+
+            with report.stage("prodigal") as stage:
+                proteins = run_stage(
+                    checkpoint_dir,
+                    stage_manifest(
+                        "prodigal",
+                        inputs={"genome": file_hash(fasta_path)},
+                        params={"meta": prodigal_meta},
+                        versions={"prodigal": tool_version("prodigal", "-v")},
+                    ),
+                    run_prodigal,
+                    complete=os.path.exists,
+                    record=stage,
+                )
+                if proteins != DNA_to_protein_directory:
+                    shutil.copyfile(proteins, DNA_to_protein_directory)
             print(f"Identifying candidate proteins in DNA: complete")
             print(f"Identifying candidate proteins in DNA: complete")
         
         else: 
             DNA_to_protein_directory = fasta_path
 
-        print("Running blastP search: started...")
-        pbs(
-            DNA_to_protein_directory,
-            gene,
-            temp_protein_search,
-            input_database=f"{database}",
-            threads=threads,
-        )
+        # Both FASTA files are parsed once, the stages below share the sequence stores
+        with report.stage("sequence_stores", unit="proteins") as stage:
+            protein_sequences = sequence_store(DNA_to_protein_directory)
+            database_sequences = sequence_store(database, sequence_store_dir)
+            stage["items"] = len(protein_sequences)
+
+            sequence_hashes = {
+                "proteins": file_hash(DNA_to_protein_directory),
+                "database": file_hash(database),
+            }
+
+        if candidate_search == "kmer":
+            print("Selecting candidate pairs with the k-mer prefilter: started...")
+            with report.stage("kmer_prefilter", unit="proteins") as stage:
+                alignment_references = run_stage(
+                    checkpoint_dir,
+                    stage_manifest(
+                        "kmer_prefilter",
+                        inputs=sequence_hashes,
+                        params={
+                            "alphabet": kmer_alphabet,
+                            "seed": kmer_seed,
+                            "min_hits": kmer_min_hits,
+                            "max_hits_per_query": max_hits_per_query,
+                        },
+                    ),
+                    lambda: kmer_candidate_search(
+                        protein_sequences,
+                        gene,
+                        intermediates,
+                        input_database=f"{database}",
+                        index_dir=kmer_index_dir,
+                        alphabet=kmer_alphabet,
+                        seed=kmer_seed,
+                        min_hits=kmer_min_hits,
+                        max_hits_per_query=max_hits_per_query,
+                        table_format=table_format,
+                    ),
+                    record=stage,
+                )
+                stage["items"] = len(protein_sequences)
+                stage["pairs"] = len(alignment_references)
+            print("Selecting candidate pairs with the k-mer prefilter: complete")
+
+        else:
+            print("Running blastP search: started...")
+            with report.stage("blastp", unit="proteins") as stage:
+                protein_search_results = run_stage(
+                    checkpoint_dir,
+                    stage_manifest(
+                        "blastp",
+                        inputs=sequence_hashes,
+                        params={
+                            "evalue_cutoff": evalue_cutoff,
+                            "max_hits_per_query": max_hits_per_query,
+                        },
+                        versions={"blastp": tool_version("blastp", "-version")},
+                    ),
+                    lambda: pbs(
+                        DNA_to_protein_directory,
+                        gene,
+                        intermediates,
+                        input_database=f"{database}",
+                        threads=threads,
+                        db_cache_dir=db_cache_dir,
+                        db_cache_max_size=db_cache_max_size,
+                        evalue_cutoff=evalue_cutoff,
+                        max_hits_per_query=max_hits_per_query,
+                        shards=blast_shards,
+                        protein_database=blast_database,
+                        table_format=table_format,
+                    ),
+                    # A failed blastp run returns no hits, but so can a finished one
+                    complete=lambda hits: hits.attrs.get("complete", False),
+                    record=stage,
+                )
+                stage["items"] = len(protein_sequences)
+                stage["hits"] = len(protein_search_results)
+
+            print(f"Running blastP search: complete")
+
+            # blastp hits are already filtered on the e-value while parsing, this orders them
+            print(f"Removing hits with high E-values: started")
+            with report.stage("sort_hits", unit="hits") as stage:
+                alignment_references = table_sorter(
+                    protein_search_results,
+                    sort_value_metric="evalue",
+                    cut_off_value=float(evalue_cutoff),
+                )
+                save_intermediate(alignment_references, "sorted_pBLAST")
+                stage["items"] = len(protein_search_results)
+            print(f"Removing hits with high E-values: complete")
 
-        print(f"Running blastP search: complete")
+        print(f"smith waterman + name_and_sequence_pair started...")
 
-        print(f"Removing hits with high E-values: started")
-        csv_sorter(
-            input_csv=f"{temp_protein_search}/output_{gene}_protein_search.csv",
-            genome=gene,
-            output=temp_protein_search,
-            sort_value_metric="evalue",
-            cut_off_value=float(0.05),
-            name_output="sorted_pBLAST",
+        smith_waterman_manifest = stage_manifest(
+            "smith_waterman",
+            inputs=dict(
+                sequence_hashes,
+                pairs=table_hash(alignment_references) if blastpnsw else None,
+            ),
+            params={
+                "matrix": matrix,
+                "match": match,
+                "mismatch": mismatch,
+                "gap_open": gap_open,
+                "gap_extend": gap_extend,
+                "blastpnsw": blastpnsw,
+                "engine": sw_engine,
+                "top_k": sw_top_k,
+            },
+            versions={"biopython": Bio.__version__, "numpy": np.__version__},
         )
-        print(f"Removing hits with high E-values: complete")
 
-        print(f"smith waterman + name_and_sequence_pair started...")
-        sequence_pairs = nm(
-            DNA_to_protein_directory,
-            f"{temp_protein_search}/output_{gene}_sorted_pBLAST.csv",
-            input_database_fasta=f"{database}",
-            blastpsw=blastpnsw,
-        )
-        print(
-            f"Performing the Smith-Waterman algorithm on {len(sequence_pairs)} sequence pairs..."
-        )
+        def run_smith_waterman():
+            sequence_pairs = nm(
+                protein_sequences,
+                alignment_references,
+                input_database_fasta=database_sequences,
+                blastpsw=blastpnsw,
+            )
+            print(
+                f"Performing the Smith-Waterman algorithm on {len(sequence_pairs)} sequence pairs..."
+            )
 
-        sm(
-            temp_SW_csv,
-            gene_name=gene,
-            sequence_pairs=sequence_pairs,
-            threads=threads,
-            matrix=matrix,
-            match=match,
-            mismatch=mismatch,
-            gap_open=gap_open,
-            gap_extend=gap_extend,
-        )
+            return sm(
+                intermediates,
+                gene_name=gene,
+                sequence_pairs=sequence_pairs,
+                threads=threads,
+                matrix=matrix,
+                match=match,
+                mismatch=mismatch,
+                gap_open=gap_open,
+                gap_extend=gap_extend,
+                executor=sw_executor,
+                engine=sw_engine,
+                score_cache=sw_cache,
+                score_cache_max_entries=sw_cache_max_entries,
+                table_format=table_format,
+                top_k=sw_top_k if sw_top_k > 0 else None,
+                # Scores on disk as they complete, kept when the run is interrupted and resumed from by a rerun
+                # with the same inputs and parameters
+                partial_output=f"{temp_output}/output_{gene}_smith_waterman.partial_{smith_waterman_manifest['key'][:16]}.csv",
+            )
+
+        with report.stage("smith_waterman", unit="pairs") as stage:
+            alignment_results = run_stage(
+                checkpoint_dir,
+                smith_waterman_manifest,
+                run_smith_waterman,
+                # Pairs that can not be scored are NaN in a complete run too
+                complete=lambda results: results.attrs.get("complete", False),
+                record=stage,
+            )
+            stage["items"] = len(alignment_results)
         print(f"smith waterman + name_and_sequence_pair finished")
 
-        csv_sorter(
-            f"{temp_SW_csv}/output_{gene}_smith_waterman.csv",
-            gene,
-            temp_SW_csv,
-            only_sort=True,
-            sort_value_metric="Score",
-            name_output="sorted_alignment",
-        )
+        # With --sw-top-k the alignment stage already gives the best hits of each query, best first
+        if sw_top_k > 0:
+            sorted_alignment_results = alignment_results
+        else:
+            with report.stage("sort_alignments", unit="pairs") as stage:
+                sorted_alignment_results = table_sorter(
+                    alignment_results,
+                    only_sort=True,
+                    sort_value_metric="Score",
+                )
+                stage["items"] = len(sorted_alignment_results)
+        save_intermediate(sorted_alignment_results, "sorted_alignment")
 
         ## Implementation of normalization code
         results_with_mass_and_length = 0
         if mass_n_length:
-            dereplicated_results = dereplicate_highest_score(
-                f"{temp_SW_csv}/output_{gene}_sorted_alignment.csv"
-            )
-
-            results_with_mass_and_length = calculate_mass_length(
-                DNA_to_protein_directory,
-                dereplicated_results,
-                f"{temp_protein_search}/output_{gene}_sorted_pBLAST.csv",
-            )
+            with report.stage("dereplicate", unit="pairs") as stage:
+                dereplicated_results = dereplicate_highest_score(
+                    sorted_alignment_results
+                )
+                stage["items"] = len(sorted_alignment_results)
+
+            # Properties of all candidate proteins, not only of the hits
+            with report.stage("protein_properties", unit="proteins") as stage:
+                proteome_properties = protein_properties(protein_sequences)
+                write_table(
+                    proteome_properties.rename(columns={"Name1": "Genome_entry_id"}),
+                    table_path(f"{output_dir}/chromosearch_{gene}_protein_properties", table_format),
+                )
+                stage["items"] = len(proteome_properties)
+
+            with report.stage("characterization", unit="hits") as stage:
+                results_with_mass_and_length = calculate_mass_length(
+                    protein_sequences,
+                    dereplicated_results,
+                    alignment_references,
+                    properties=proteome_properties,
+                )
+                stage["items"] = len(results_with_mass_and_length)
 
             print("Calculation of mass and length of candidate proteins: finished")
 
         # Statistical analysis - thanos
         # ==================================================================================================================
 
-        # Create directory for outputs of statistical analysis (plots)
-        statistics_directory = f"{output_dir}/Statistical_analysis/"
-
-        os.makedirs(statistics_directory, exist_ok=True)
-
-        # TODO: add support for changing plot_dpi through the command line
-        final_results_dataframe = statistics_calculation(
-            results_with_mass_and_length,
-            statistics_directory,
-            multiple_test_correction,
-        )
+        with report.stage("statistics", unit="hits") as stage:
+            # Imported here, scipy and statsmodels take most of a second to import
+            from scripts.statistical_analysis import statistics_calculation
+
+            calibration = None
+            if null_calibration:
+                from scripts.null_calibration import load_null_calibration
+
+                # The null of the best score against the whole database, conservative when only candidates are aligned
+                calibration = load_null_calibration(database, match, mismatch, gap_open, gap_extend, matrix, targets_per_decoy=0)
+                if calibration is None:
+                    print(
+                        "WARNING: No null calibration of the database for these scoring settings, run chromosearch_calibrate.py first. Fitting the scores of this run instead."
+                    )
+                    logger.warning(f"No null calibration of {database}, fitting the scores instead")
+
+            final_results_dataframe, gumbel_params = statistics_calculation(
+                results_with_mass_and_length,
+                multiple_test_correction,
+                gumbel_fit,
+                calibration,
+            )
+            stage["items"] = len(final_results_dataframe)
+            stage["p_values"] = "null_calibration" if calibration is not None else "fit"
 
         # final corrections to the dataframe
         final_results_dataframe.rename(
@@ -197,36 +444,44 @@ def main(
         )
 
         # only save the final results, with statistics
-        final_results_dataframe.to_csv(
-            f"{output_dir}/chromosearch_{gene}_final_results.csv"
-        )
+        with report.stage("write_results", unit="hits") as stage:
+            write_table(
+                final_results_dataframe,
+                table_path(f"{output_dir}/chromosearch_{gene}_final_results", table_format),
+                index=True,
+            )
+            stage["items"] = len(final_results_dataframe)
+
+        # Plots of the statistical analysis, rendered in worker processes once the results are written
+        if plots != "none":
+            statistics_directory = f"{output_dir}/Statistical_analysis/"
+            os.makedirs(statistics_directory, exist_ok=True)
+
+            with report.stage("plots", unit="plots") as stage:
+                # Imported here, matplotlib and seaborn take most of a second to import
+                from scripts.statistics_plots import plot_statistics
+
+                stage["items"] = plot_statistics(
+                    final_results_dataframe["Normalized_score"].to_numpy(),
+                    gumbel_params,
+                    statistics_directory,
+                    plot_format=plots,
+                    plot_dpi=plot_dpi,
+                    executor=plot_executor,
+                )
 
     finally:
-        if not save_intermediates:
-            os.remove(
-                os.path.join(temp_protein_search, f"output_{gene}_protein_search.csv")
-            )
-            os.remove(os.path.join(temp_SW_csv, f"output_{gene}_smith_waterman.csv"))
+        # Also written when a stage fails, with the stages up to the failing one
+        report.write(f"{output_dir}/chromosearch_{gene}_run_report.json")
 
     logger.info(f"Finished processing the {gene} gene")
 
+    return final_results_dataframe
 
-if __name__ == "__main__":
 
-    ## The code below is only valid if the chromosearch-function is run via the terminal.
+def add_pipeline_arguments(parser):
+    """Adds the command line options shared by chromosearch.py and chromosearch_batch.py to parser."""
 
-    parser = argparse.ArgumentParser(
-        description="Process a single genomic data file and perform various bioinformatics tasks."
-    )
-    parser.add_argument(
-        "-i",
-        "--input-genome",
-        help="Path to the fasta file for the bacterial genome.",
-        required=True,
-    )
-    parser.add_argument(
-        "-p", "--prefix", required=True, help="Naming prefix for output files."
-    )
     parser.add_argument(
         "-db",
         "--database",
@@ -305,56 +560,236 @@ if __name__ == "__main__":
         ],
         help='Method used to correct p-values for multiple testing using the statsmodels.stats.multitest module. Available methods: "bonferroni", "sidak", "holm-sidak", "holm", "simes-hochberg", "hommel", "fdr_bh", "fdr_by", "fdr_tsbh", "fdr_tsbky" Default:  Benjamini-Hochberg.',
     )
-    parser.add_argument("output_path", help="Path to where to save the output files")
+    parser.add_argument(
+        "--gumbel-fit",
+        default="auto",
+        choices=["auto", "mle", "subsample", "binned", "scipy"],
+        help="How the Gumbel distribution is fitted to the normalized scores: maximum likelihood on all scores (mle), on a stratified subsample of 100000 scores (subsample) or on a histogram of 4096 bins (binned), or with scipy's generic fit (scipy). auto fits all scores up to 100000 of them and the histogram above that. Default: auto",
+    )
+    parser.add_argument(
+        "--null-calibration",
+        action="store_true",
+        help="Take the Gumbel parameters of the p-values from the null calibration of the database for the scoring settings, made with chromosearch_calibrate.py, by protein length, instead of fitting them to the scores of the run. Without a calibration the scores are fitted",
+    )
+    parser.add_argument(
+        "--db-cache-dir",
+        default="temp/blast_db_cache",
+        help="Directory of the persistent BLAST database cache, shared between runs. Databases are keyed on the content of the database FASTA and the makeblastdb version. Set to an empty string to build a temporary database instead. Default: temp/blast_db_cache",
+    )
+    parser.add_argument(
+        "--db-cache-size",
+        type=int,
+        default=2048,
+        help="Size cap of the BLAST database cache in MB. The least recently used databases are evicted when it is exceeded. Default: 2048",
+    )
+    parser.add_argument(
+        "--evalue",
+        type=float,
+        default=0.05,
+        help="E-value cutoff for the blastp hits. Hits at or above it are dropped while the blastp output is read. Default: 0.05",
+    )
+    parser.add_argument(
+        "--max-hits-per-query",
+        type=int,
+        default=None,
+        help="Only keep this many blastp hits (highest bitscore) per candidate protein. Default: all hits",
+    )
+    parser.add_argument(
+        "--blast-shards",
+        type=int,
+        default=1,
+        help="Split the candidate proteins into this many residue-balanced chunks and search them with concurrent blastp processes, sharing the threads. Set to 0 to use one shard per thread. Results are identical to a single blastp run. Default: 1",
+    )
+    parser.add_argument(
+        "--sw-engine",
+        default="biopython",
+        choices=SW_ENGINES,
+        help="Scoring engine for the Smith-Waterman alignments: Biopython's PairwiseAligner, or the vectorized NumPy engine. Both give the same scores. Default: biopython",
+    )
+    parser.add_argument(
+        "--sw-cache",
+        default="temp/sw_score_cache.sqlite",
+        help="Location of the persistent Smith-Waterman score cache (SQLite), shared between runs. Scores are keyed on the sequences and the scoring parameters. Set to an empty string to disable. Default: temp/sw_score_cache.sqlite",
+    )
+    parser.add_argument(
+        "--sw-cache-max-entries",
+        type=int,
+        default=5_000_000,
+        help="Size cap of the Smith-Waterman score cache in number of scores. The least recently used scores are evicted when it is exceeded. Default: 5000000",
+    )
+    parser.add_argument(
+        "--sw-top-k",
+        type=int,
+        default=1,
+        help="Number of Smith-Waterman hits kept per protein. The alignment workers keep only these, so the scores of all pairs are never held in memory, and the best hit of each protein goes on to the statistics. 0 keeps the scores of all pairs, as the output_<prefix>_smith_waterman intermediate. Default: 1",
+    )
+    parser.add_argument(
+        "--prodigal-meta",
+        action="store_true",
+        help="Run Prodigal in metagenomic mode (-p meta) instead of training on the genome. Use for metagenome assemblies and small genomes.",
+    )
+    parser.add_argument(
+        "--candidate-search",
+        default="blastp",
+        choices=["blastp", "kmer"],
+        help="How candidate pairs for Smith-Waterman are selected: blastp, or the built-in k-mer prefilter, which pairs each candidate protein with the database proteins sharing enough k-mers on one diagonal and does not need BLAST. Default: blastp",
+    )
+    parser.add_argument(
+        "--kmer-index-dir",
+        default="temp/kmer_index",
+        help="Directory of the persistent k-mer indices of the database, keyed on the content of the database FASTA, the alphabet and the seed. Default: temp/kmer_index",
+    )
+    parser.add_argument(
+        "--kmer-alphabet",
+        default="murphy10",
+        choices=KMER_ALPHABETS,
+        help="Amino acid alphabet of the k-mer prefilter, murphy10 groups similar residues. Default: murphy10",
+    )
+    parser.add_argument(
+        "--kmer-seed",
+        default="1101011",
+        help="Spaced seed of the k-mer prefilter, 1 for positions that must match and 0 for positions that are ignored. Default: 1101011",
+    )
+    parser.add_argument(
+        "--kmer-min-hits",
+        type=int,
+        default=3,
+        help="Number of k-mer hits on one diagonal needed for a pair to be aligned. Default: 3",
+    )
+    parser.add_argument(
+        "--sequence-store-dir",
+        default="temp/sequence_store",
+        help="Directory of the parsed database FASTA files (sequence stores), keyed on the content of the FASTA and loaded memory-mapped by later runs. Set to an empty string to parse the database on every run. Default: temp/sequence_store",
+    )
+    parser.add_argument(
+        "--format",
+        default="csv",
+        choices=TABLE_FORMATS,
+        help="File format of the result tables and intermediates: csv, or the compressed columnar parquet or arrow (Arrow IPC), which need pyarrow. Default: csv",
+    )
+    parser.add_argument(
+        "--no-checkpoints",
+        dest="checkpoints",
+        action="store_false",
+        help="Run every stage, instead of reloading the output of Prodigal, the candidate search and Smith-Waterman from the checkpoints in temp/<prefix>/checkpoints when their inputs, parameters and tool versions did not change since the last run",
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Profile each stage with cProfile, the <stage>.prof files are written to <output>/<prefix>/profile and can be read with pstats or snakeviz",
+    )
+    parser.add_argument(
+        "--plots",
+        default="png",
+        choices=["none", "png", "svg"],
+        help="File format of the plots of the statistical analysis (score histogram, Gumbel fit and Q-Q plot), or none to skip them. The plots are rendered in parallel processes after the final results are written. Default: png",
+    )
+    parser.add_argument(
+        "--plot-dpi",
+        type=int,
+        default=600,
+        help="Resolution of the png plots. Default: 600",
+    )
+    parser.add_argument(
+        "--skip-checks",
+        action="store_true",
+        help="Skip the check of the required packages, Prodigal and BLAST. A passed check is remembered in temp/requirement_checks for the same interpreter and PATH, so this is only needed to save the check of the first run",
+    )
 
-    args = parser.parse_args()
 
-    fasta_path_argument = args.input_genome
-    output_path_argument = args.output_path
-    gene_argument = args.prefix
-    database_argument = args.database
-    save_intermediates_argument = args.save_intermediates
-    matrix_argument = args.matrix
-    match_argument = args.match
-    mismatch_argument = args.mismatch
-    gap_open_argument = args.gap_open
-    gap_extend_argument = args.gap_extend
-    process_argument = args.process
-    blastpnsw_argument = args.blastpandsmithwaterman
-    mutliple_test_correction = args.mutliple_correction
+def resolve_threads(requested_threads):
+    """Checks the --threads argument and returns the number of threads to use."""
 
     # check options for threads arg
     # assign all available cpus
-    if args.threads <= 0:
+    if requested_threads <= 0:
         threads = os.cpu_count()
-    elif args.threads > os.cpu_count():
+    elif requested_threads > os.cpu_count():
         raise ValueError(
             "Number of threads specified exceeds those available in the system. Please specify a lower count, or run in single-threaded mode."
         )
     else:
-        threads = args.threads
+        threads = requested_threads
 
     if threads == 1:
         print(
             "You have chosen to run the pipeline using only 1 thread. This might take some time...\n"
         )
 
+    return threads
+
+
+def pipeline_arguments(args):
+    """Maps the parsed options from add_pipeline_arguments() to keyword arguments of main()."""
+
+    return dict(
+        database=args.database,
+        process=args.process,
+        save_intermediates=args.save_intermediates,
+        matrix=args.matrix,
+        match=args.match,
+        mismatch=args.mismatch,
+        gap_open=args.gap_open,
+        gap_extend=args.gap_extend,
+        blastpnsw=args.blastpandsmithwaterman,
+        multiple_test_correction=args.mutliple_correction,
+        gumbel_fit=args.gumbel_fit,
+        null_calibration=args.null_calibration,
+        db_cache_dir=args.db_cache_dir or None,
+        db_cache_max_size=args.db_cache_size * 1024**2,
+        evalue_cutoff=args.evalue,
+        max_hits_per_query=args.max_hits_per_query,
+        blast_shards=args.blast_shards,
+        prodigal_meta=args.prodigal_meta,
+        sw_engine=args.sw_engine,
+        sw_cache=args.sw_cache or None,
+        sw_cache_max_entries=args.sw_cache_max_entries,
+        sw_top_k=args.sw_top_k,
+        candidate_search=args.candidate_search,
+        kmer_index_dir=args.kmer_index_dir,
+        kmer_alphabet=args.kmer_alphabet,
+        kmer_seed=args.kmer_seed,
+        kmer_min_hits=args.kmer_min_hits,
+        sequence_store_dir=args.sequence_store_dir or None,
+        table_format=args.format,
+        checkpoints=args.checkpoints,
+        profile=args.profile,
+        plots=args.plots,
+        plot_dpi=args.plot_dpi,
+        skip_checks=args.skip_checks,
+    )
+
+
+if __name__ == "__main__":
+
+    ## The code below is only valid if the chromosearch-function is run via the terminal.
+
+    parser = argparse.ArgumentParser(
+        description="Process a single genomic data file and perform various bioinformatics tasks."
+    )
+    parser.add_argument(
+        "-i",
+        "--input-genome",
+        help="Path to the fasta file for the bacterial genome.",
+        required=True,
+    )
+    parser.add_argument(
+        "-p", "--prefix", required=True, help="Naming prefix for output files."
+    )
+    add_pipeline_arguments(parser)
+    parser.add_argument("output_path", help="Path to where to save the output files")
+
+    args = parser.parse_args()
+
+    threads = resolve_threads(args.threads)
+
     # Use decorated main to suppress output, other than errors
     decorated_with_suppress_main = suppress_output(args.quiet)(main)
 
     decorated_with_suppress_main(
-        fasta_path=fasta_path_argument,
-        output_path=output_path_argument,
-        gene=gene_argument,
-        database=database_argument,
-        process=process_argument,
-        save_intermediates=save_intermediates_argument,
+        fasta_path=args.input_genome,
+        output_path=args.output_path,
+        gene=args.prefix,
         threads=threads,
-        matrix=matrix_argument,
-        match=match_argument,
-        mismatch=mismatch_argument,
-        gap_open=gap_open_argument,
-        gap_extend=gap_extend_argument,
-        blastpnsw=blastpnsw_argument,
-        multiple_test_correction=mutliple_test_correction,
+        **pipeline_arguments(args),
     )
@@ -0,0 +1,280 @@
+## NOTE! This script is meant to be run through the terminal
+
+import argparse
+import logging
+import os
+import time
+import contextlib
+import concurrent.futures as futures
+import pandas as pd
+
+from chromosearch import main
+from chromosearch import pipeline_requirements
+from chromosearch import add_pipeline_arguments, resolve_threads, pipeline_arguments
+from scripts.initialization_scripts import check_requirements
+from scripts.initialization_scripts import suppress_output
+from scripts.protein_search import blast_protein_database
+from scripts.table_io import table_path
+from scripts.table_io import write_table
+
+logger = logging.getLogger(__name__)
+
+FASTA_EXTENSIONS = (".fasta", ".fa", ".fna", ".fas", ".faa")
+
+
+def read_genomes(genomes):
+    """Lists the genomes of a batch from a directory or a manifest file.
+
+    A directory contributes every FASTA file in it (by extension), named by the file name without extension.
+    A manifest has one genome per line, either "prefix<TAB>path", "prefix,path" or only "path".
+    Empty lines and lines starting with '#' are ignored, relative paths are relative to the manifest.
+
+    Args:
+        genomes (str): Directory of genome FASTA files, or manifest file.
+
+    Raises:
+        ValueError: The batch is empty or two genomes share a prefix.
+
+    Returns:
+        list: List of (prefix, fasta_path) tuples, in input order.
+    """
+
+    batch = []
+    if os.path.isdir(genomes):
+        for file_name in sorted(os.listdir(genomes)):
+            if file_name.lower().endswith(FASTA_EXTENSIONS):
+                batch.append(
+                    (os.path.splitext(file_name)[0], os.path.join(genomes, file_name))
+                )
+    else:
+        manifest_dir = os.path.dirname(os.path.abspath(genomes))
+        with open(genomes, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line or line.startswith("#"):
+                    continue
+                fields = [field.strip() for field in line.replace(",", "\t").split("\t")]
+                if len(fields) == 1:
+                    path = fields[0]
+                    prefix = os.path.splitext(os.path.basename(path))[0]
+                else:
+                    prefix, path = fields[0], fields[1]
+                batch.append((prefix, os.path.join(manifest_dir, path)))
+
+    if not batch:
+        raise ValueError(f"No genomes found in {genomes}")
+
+    prefixes = [prefix for prefix, _ in batch]
+    duplicates = sorted({prefix for prefix in prefixes if prefixes.count(prefix) > 1})
+    if duplicates:
+        raise ValueError(f"Genome prefixes must be unique, duplicated: {duplicates}")
+
+    return batch
+
+
+def summarize_genome(prefix, fasta_path, final_results, wall_time, error=None):
+    """Creates the row of the batch summary table for one genome.
+
+    Args:
+        prefix (str): Naming prefix of the genome.
+        fasta_path (str): Input FASTA of the genome.
+        final_results (pandas.DataFrame): Final results table of the genome, None if the run failed.
+        wall_time (float): Run time of the genome in seconds.
+        error (Exception, optional): Error the run failed with. Defaults to None.
+
+    Returns:
+        dict: Summary row.
+    """
+
+    row = {
+        "Genome": prefix,
+        "Input": fasta_path,
+        "Status": "failed" if error is not None else "complete",
+        "Candidate_hits": None,
+        "Significant_hits": None,
+        "Best_genome_entry_id": None,
+        "Best_database_hit_id": None,
+        "Best_normalized_score": None,
+        "Best_corrected_pvalue": None,
+        "Wall_time_s": round(wall_time, 2),
+        "Error": str(error) if error is not None else None,
+    }
+
+    if final_results is not None and len(final_results) > 0:
+        best = final_results.loc[final_results["Normalized_score"].idxmax()]
+        row.update(
+            {
+                "Candidate_hits": len(final_results),
+                "Significant_hits": int((final_results["Corrected_pvalues"] < 0.05).sum()),
+                "Best_genome_entry_id": best["Genome_entry_id"],
+                "Best_database_hit_id": best["Database_hit_id"],
+                "Best_normalized_score": best["Normalized_score"],
+                "Best_corrected_pvalue": best["Corrected_pvalues"],
+            }
+        )
+
+    return row
+
+
+def batch_main(genomes, output_path, threads=1, genome_workers=None, **pipeline_options):
+    """Runs the ChromoSearch pipeline on a batch of genomes.
+
+    The requirement check, the BLAST database and the process pool (Smith-Waterman and plots) are
+    prepared once and shared by all genomes. Up to genome_workers genomes are processed concurrently, splitting the
+    threads between them, so that the single-threaded stages (Prodigal, statistics) of one genome overlap
+    with the parallel stages of the others.
+
+    Args:
+        genomes (str): Directory of genome FASTA files, or manifest file, see read_genomes().
+        output_path (str): Path to where to save the output files, one directory per genome.
+        threads (int, optional): Number of threads available to the batch. Defaults to 1.
+        genome_workers (int, optional): Number of genomes processed concurrently. Defaults to None (min(genomes, threads)).
+        **pipeline_options: Further keyword arguments for chromosearch.main().
+
+    Returns:
+        pandas.DataFrame: The batch summary table, one row per genome.
+    """
+
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.FileHandler("project.log")],
+    )
+
+    batch = read_genomes(genomes)
+    logger.info(f"Starting batch of {len(batch)} genomes from {genomes}")
+
+    if not pipeline_options.pop("skip_checks", False):
+        check_requirements(
+            pipeline_requirements(
+                pipeline_options.get("candidate_search", "blastp"),
+                pipeline_options.get("table_format", "csv"),
+            )
+        )
+
+    if genome_workers is None or genome_workers <= 0:
+        genome_workers = min(len(batch), threads)
+    genome_workers = max(1, min(genome_workers, len(batch)))
+    threads_per_genome = max(1, threads // genome_workers)
+
+    os.makedirs(output_path, exist_ok=True)
+
+    summary_rows = {}
+    all_results = []
+
+    print(
+        f"Processing {len(batch)} genomes, {genome_workers} at a time with {threads_per_genome} threads each..."
+    )
+
+    # The k-mer prefilter needs no BLAST database
+    if pipeline_options.get("candidate_search", "blastp") == "kmer":
+        shared_database = contextlib.nullcontext()
+    else:
+        shared_database = blast_protein_database(
+            pipeline_options["database"],
+            pipeline_options.get("db_cache_dir"),
+            pipeline_options.get("db_cache_max_size"),
+        )
+
+    with shared_database as protein_database, futures.ProcessPoolExecutor(
+        max_workers=threads
+    ) as sw_pool, futures.ThreadPoolExecutor(
+        max_workers=genome_workers
+    ) as scheduler:
+
+        def run_genome(prefix, fasta_path):
+            start = time.perf_counter()
+            try:
+                final_results = main(
+                    fasta_path=fasta_path,
+                    output_path=output_path,
+                    gene=prefix,
+                    threads=threads_per_genome,
+                    skip_checks=True,
+                    blast_database=protein_database,
+                    sw_executor=sw_pool,
+                    plot_executor=sw_pool,
+                    shared_process=genome_workers > 1,
+                    **pipeline_options,
+                )
+                return final_results, time.perf_counter() - start, None
+            except Exception as e:
+                logger.error(f"Error processing genome {prefix}: {e}")
+                return None, time.perf_counter() - start, e
+
+        running = {
+            scheduler.submit(run_genome, prefix, fasta_path): (prefix, fasta_path)
+            for prefix, fasta_path in batch
+        }
+
+        for future in futures.as_completed(running):
+            prefix, fasta_path = running[future]
+            final_results, wall_time, error = future.result()
+            summary_rows[prefix] = summarize_genome(
+                prefix, fasta_path, final_results, wall_time, error
+            )
+
+            if error is None:
+                all_results.append(final_results.assign(Genome=prefix))
+                print(f"Genome {prefix}: complete ({wall_time:.1f} s)")
+            else:
+                print(f"Genome {prefix}: failed with {error}")
+
+    # Summary in input order
+    summary = pd.DataFrame([summary_rows[prefix] for prefix, _ in batch])
+    summary.to_csv(f"{output_path}/chromosearch_batch_summary.csv", index=False)
+
+    if all_results:
+        combined = pd.concat(all_results, ignore_index=True)
+        combined = combined[
+            ["Genome"] + [column for column in combined.columns if column != "Genome"]
+        ]
+        write_table(
+            combined,
+            table_path(
+                f"{output_path}/chromosearch_batch_final_results",
+                pipeline_options.get("table_format", "csv"),
+            ),
+        )
+
+    logger.info(f"Finished batch of {len(batch)} genomes")
+
+    return summary
+
+
+if __name__ == "__main__":
+
+    ## The code below is only valid if the batch function is run via the terminal.
+
+    parser = argparse.ArgumentParser(
+        description="Process a batch of genomic data files with a shared database preparation and worker pool."
+    )
+    parser.add_argument(
+        "-i",
+        "--input-genomes",
+        help="Directory of genome fasta files, or a manifest file with one 'prefix<TAB>path' (or 'path') per line.",
+        required=True,
+    )
+    parser.add_argument(
+        "--genome-workers",
+        type=int,
+        default=0,
+        help="Number of genomes processed concurrently, sharing the threads. Default: min(number of genomes, threads)",
+    )
+    add_pipeline_arguments(parser)
+    parser.add_argument("output_path", help="Path to where to save the output files")
+
+    args = parser.parse_args()
+
+    threads = resolve_threads(args.threads)
+
+    # Use decorated batch_main to suppress output, other than errors
+    decorated_with_suppress_batch_main = suppress_output(args.quiet)(batch_main)
+
+    decorated_with_suppress_batch_main(
+        genomes=args.input_genomes,
+        output_path=args.output_path,
+        threads=threads,
+        genome_workers=args.genome_workers,
+        **pipeline_arguments(args),
+    )
@@ -0,0 +1,131 @@
+## NOTE! This script is meant to be run through the terminal
+
+import argparse
+import logging
+
+from chromosearch import resolve_threads
+from scripts.null_calibration import calibrate_null_distribution
+from scripts.null_calibration import DECOY_METHODS
+from scripts.null_calibration import LENGTH_BINS
+from scripts.smith_waterman import SW_ENGINES
+from scripts.initialization_scripts import suppress_output
+
+logger = logging.getLogger(__name__)
+
+
+def calibrate_main(database, threads=1, **calibration_options):
+    """Calibrates the null distribution of the normalized scores for a database, see null_calibration.py.
+
+    Args:
+        database (str): Path to the database FASTA file.
+        threads (int, optional): Number of processes aligning the decoys. Defaults to 1.
+        **calibration_options: Further keyword arguments for calibrate_null_distribution().
+
+    Returns:
+        str: Path of the saved calibration.
+    """
+
+    logging.basicConfig(
+        level=logging.DEBUG,
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        handlers=[logging.FileHandler("project.log")],
+    )
+
+    path = calibrate_null_distribution(database, threads=threads, **calibration_options)
+    print(f"Null calibration saved in {path}, use it with chromosearch.py --null-calibration")
+
+    return path
+
+
+if __name__ == "__main__":
+
+    ## The code below is only valid if the calibration function is run via the terminal.
+
+    parser = argparse.ArgumentParser(
+        description="Calibrate the null distribution of the normalized scores for a database and Smith-Waterman scoring settings, by aligning decoy proteins against it. The Gumbel parameters per protein length are saved next to the database."
+    )
+    parser.add_argument(
+        "-db",
+        "--database",
+        default="databases/chromoproteins_uniprot/uniprotkb_chromophore_keyword_KW_0157_AND_reviewed_2024_06_24.fasta",
+        help="Path to the chromoprotein database",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=1,
+        help="Number of threads available to the calibration. Set to 0 or negative numbers to use all available cores",
+    )
+    parser.add_argument(
+        "-M",
+        "--matrix",
+        action="store_false",
+        help="If you want to disable BLOSUM62 matrix and use standard scores",
+    )
+    parser.add_argument("--match", type=int, default=3, help="Score for a match")
+    parser.add_argument(
+        "--mismatch", type=int, default=-1, help="Penalty for a mismatch"
+    )
+    parser.add_argument(
+        "--gap_open",
+        type=int,
+        default=-10,
+        help="Gap opening penalty for the Waterman-Smith alignments.",
+    )
+    parser.add_argument(
+        "--gap_extend",
+        type=int,
+        default=-4,
+        help="Gap extension penalty for the Waterman-Smith alignments.",
+    )
+    parser.add_argument(
+        "--decoys",
+        default="shuffle",
+        choices=DECOY_METHODS,
+        help="Decoy proteins: shuffled or reversed stretches of the database residues. Default: shuffle",
+    )
+    parser.add_argument(
+        "--decoys-per-bin",
+        type=int,
+        default=200,
+        help=f"Decoy proteins per protein length bin (lower bounds {', '.join(map(str, LENGTH_BINS))}). Default: 200",
+    )
+    parser.add_argument(
+        "--targets-per-decoy",
+        type=int,
+        default=0,
+        help="Random database entries each decoy is aligned against, its best score counts. 0 aligns against the whole database, the null that chromosearch.py --null-calibration uses. Default: 0",
+    )
+    parser.add_argument(
+        "--sw-engine",
+        default="biopython",
+        choices=SW_ENGINES,
+        help="Scoring engine for the Smith-Waterman alignments. Default: biopython",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed. Default: 0")
+    parser.add_argument(
+        "-q",
+        "--quiet",
+        action="store_true",
+        help="Quiets the text-outputs of the ChromoSearch.",
+    )
+
+    args = parser.parse_args()
+
+    threads = resolve_threads(args.threads)
+
+    suppress_output(args.quiet)(calibrate_main)(
+        database=args.database,
+        threads=threads,
+        match=args.match,
+        mismatch=args.mismatch,
+        gap_open=args.gap_open,
+        gap_extend=args.gap_extend,
+        matrix=args.matrix,
+        method=args.decoys,
+        decoys_per_bin=args.decoys_per_bin,
+        targets_per_decoy=args.targets_per_decoy,
+        engine=args.sw_engine,
+        seed=args.seed,
+    )
@@ -1,15 +1,150 @@
+import os
+import re
+import logging
+import tempfile
 import subprocess
+import concurrent.futures as futures
 
-# Function to run Prodigal and return the protein sequences 
+logger = logging.getLogger(__name__)
+
+# Function to run Prodigal and return the protein sequences
 # Input: genome (FASTA format)
 # Output: Protein candidates (also fasta format)
 
-def run_prodigal(input_file, output_prot_file, gene):
-    # Command to run Prodigal and output protein sequences
-    command = ['prodigal', '-i', input_file, '-a', f'{output_prot_file}/output_{gene}_DNAtoProtein.fasta', '-q']
+def run_prodigal(input_file, output_prot_file, gene, threads=1, meta=False):
+    """Runs Prodigal on a genome and writes the protein sequences to output_{gene}_DNAtoProtein.fasta.
+
+    With more than one thread and more than one contig the gene calling runs in parallel, see run_prodigal_parallel().
+
+    Args:
+        input_file (str): Genome FASTA file.
+        output_prot_file (str): Output directory.
+        gene (str): Naming prefix.
+        threads (int, optional): Number of concurrent Prodigal processes. Defaults to 1.
+        meta (bool, optional): Use the metagenomic mode (-p meta) instead of training on the genome. Defaults to False.
+    """
+    output_file = f'{output_prot_file}/output_{gene}_DNAtoProtein.fasta'
 
     try:
+        if threads > 1 and len(read_contigs(input_file)) > 1:
+            run_prodigal_parallel(input_file, output_file, threads, meta)
+            return
+
+        # Command to run Prodigal and output protein sequences
+        command = ['prodigal', '-i', input_file, '-a', output_file, '-q']
+        if meta:
+            command += ['-p', 'meta']
+
         subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
         # print(f"Prodigal finished successfully. Protein sequences saved to {output_prot_file}/output_{gene}_DNAtoProtein.fasta")
     except subprocess.CalledProcessError as e:
         print("Error running Prodigal:", e)
+
+
+def read_contigs(input_file):
+    """Reads the records of a nucleotide FASTA file.
+
+    Returns:
+        list: List of (record_text, length) tuples in file order, record_text including the header line.
+    """
+    contigs = []
+    with open(input_file, 'r') as f:
+        for line in f:
+            if line.startswith('>'):
+                contigs.append([line, 0])
+            elif contigs:
+                contigs[-1][0] += line
+                contigs[-1][1] += len(line.strip())
+    return [tuple(contig) for contig in contigs]
+
+
+def partition_contigs(lengths, n_groups):
+    """Partitions contigs into size-balanced groups (longest first, each to the currently smallest group).
+
+    Args:
+        lengths (list): Contig lengths.
+        n_groups (int): Number of groups.
+
+    Returns:
+        list: Non-empty groups, each a sorted list of contig indices.
+    """
+    groups = [[] for _ in range(n_groups)]
+    sizes = [0] * n_groups
+    for index in sorted(range(len(lengths)), key=lambda i: -lengths[i]):
+        smallest = sizes.index(min(sizes))
+        groups[smallest].append(index)
+        sizes[smallest] += lengths[index]
+    return [sorted(group) for group in groups if group]
+
+
+def _run_prodigal_group(group_fasta, training_file, meta):
+    """Runs Prodigal on one group of contigs, returns the path of its protein FASTA."""
+    proteins = f'{os.path.splitext(group_fasta)[0]}.faa'
+    command = ['prodigal', '-i', group_fasta, '-a', proteins, '-q']
+    if meta:
+        command += ['-p', 'meta']
+    else:
+        command += ['-t', training_file]
+    subprocess.run(command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    return proteins
+
+
+def run_prodigal_parallel(input_file, output_file, threads, meta=False):
+    """Calls genes with concurrent Prodigal processes over groups of contigs.
+
+    Prodigal is trained once on the full genome (or runs with -p meta), so each contig gets the same
+    gene calls as in a single run. The contigs are split into size-balanced groups, and the proteins of
+    the groups are merged back in the original contig order. Protein IDs ('<contig>_<gene number>') only
+    depend on the contig, and the 'ID=' field of the headers is renumbered to the contig's position in the
+    genome, so the output matches that of a single Prodigal run.
+
+    Args:
+        input_file (str): Genome FASTA file.
+        output_file (str): Protein FASTA file to write.
+        threads (int): Number of concurrent Prodigal processes.
+        meta (bool, optional): Use the metagenomic mode. Defaults to False.
+
+    Raises:
+        ValueError: Two proteins got the same ID (duplicated contig names in the genome).
+    """
+    contigs = read_contigs(input_file)
+    groups = partition_contigs([length for _, length in contigs], min(threads, len(contigs)))
+    logger.info(f'Running Prodigal on {len(contigs)} contigs in {len(groups)} groups')
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        training_file = os.path.join(work_dir, 'training.trn')
+        if not meta:
+            subprocess.run(['prodigal', '-i', input_file, '-t', training_file, '-q'], check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+        group_files = []
+        for number, group in enumerate(groups):
+            group_files.append(os.path.join(work_dir, f'group_{number:04d}.fasta'))
+            with open(group_files[-1], 'w') as f:
+                for index in group:
+                    f.write(contigs[index][0])
+
+        with futures.ThreadPoolExecutor(max_workers=len(groups)) as ex:
+            protein_files = list(ex.map(lambda group_file: _run_prodigal_group(group_file, training_file, meta), group_files))
+
+        # Collect the proteins per contig, with the 'ID=<contig number>_<gene number>' fields made genome-wide
+        proteins_per_contig = [[] for _ in contigs]
+        for group, protein_file in zip(groups, protein_files):
+            with open(protein_file, 'r') as f:
+                for line in f:
+                    if line.startswith('>'):
+                        match = re.search(r'ID=(\d+)_(\d+)', line)
+                        contig = group[int(match.group(1)) - 1]
+                        line = line.replace(match.group(0), f'ID={contig + 1}_{match.group(2)}', 1)
+                        proteins_per_contig[contig].append(line)
+                    else:
+                        proteins_per_contig[contig][-1] += line
+
+    seen = set()
+    with open(output_file, 'w') as f:
+        for proteins in proteins_per_contig:
+            for record in proteins:
+                protein_id = record[1:].split()[0]
+                if protein_id in seen:
+                    raise ValueError(f'Duplicate protein ID {protein_id}, the contig names of the genome must be unique')
+                seen.add(protein_id)
+                f.write(record)
@@ -0,0 +1,223 @@
+import os
+import shutil
+import hashlib
+import logging
+import subprocess
+from contextlib import contextmanager
+from functools import lru_cache
+
+try:
+    import fcntl
+except ImportError:  # Windows, no advisory locks available
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Marker written into a cache entry once makeblastdb has finished successfully.
+# Its mtime doubles as the "last used" timestamp for the LRU eviction.
+COMPLETE_MARKER = ".complete"
+
+
+@lru_cache(maxsize=None)
+def makeblastdb_version():
+    """Returns the version line reported by makeblastdb, used as part of the cache key.
+
+    Returns:
+        str: First line of 'makeblastdb -version', or 'unknown' if it could not be determined.
+    """
+    try:
+        result = subprocess.run(
+            ["makeblastdb", "-version"],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+        return result.stdout.strip().split("\n")[0] or "unknown"
+    except FileNotFoundError:
+        return "unknown"
+
+
+def fasta_content_hash(fasta_path, chunk_size=1 << 20):
+    """Calculates the SHA-256 hash of a FASTA file's content.
+
+    Args:
+        fasta_path (str): Path to the FASTA file.
+        chunk_size (int, optional): Bytes read per iteration. Defaults to 1 MiB.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    digest = hashlib.sha256()
+    with open(fasta_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(fasta_path):
+    """Key of a cache entry: hash of the FASTA content and the makeblastdb version."""
+    digest = hashlib.sha256()
+    digest.update(fasta_content_hash(fasta_path).encode())
+    digest.update(makeblastdb_version().encode())
+    return digest.hexdigest()[:32]
+
+
+def _flock(lock_file, mode):
+    """Applies an advisory lock ('exclusive', 'shared' or 'unlock') to an open file. No-op without fcntl."""
+    if fcntl is None:
+        return
+    flags = {"exclusive": fcntl.LOCK_EX, "shared": fcntl.LOCK_SH, "unlock": fcntl.LOCK_UN}
+    fcntl.flock(lock_file, flags[mode])
+
+
+@contextmanager
+def _try_lock(lock_path):
+    """Tries to take an exclusive lock on lock_path without waiting.
+
+    Yields True if the lock was acquired (and holds it for the context), False if it is held elsewhere.
+    On platforms without fcntl the lock always reports as acquired.
+    """
+    with open(lock_path, "a") as lock_file:
+        if fcntl is None:
+            yield True
+            return
+
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            yield False
+            return
+
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _entry_size(entry_dir):
+    total = 0
+    for root, _, files in os.walk(entry_dir):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+def _cache_entries(cache_dir):
+    """Lists the complete entries of the cache as (key, last_used, size) tuples."""
+    entries = []
+    for key in os.listdir(cache_dir):
+        # Skips lock files and in-progress builds ('<key>.lock', '<key>.build-<pid>')
+        if "." in key:
+            continue
+        entry_dir = os.path.join(cache_dir, key)
+        marker = os.path.join(entry_dir, COMPLETE_MARKER)
+        if os.path.isdir(entry_dir) and os.path.isfile(marker):
+            entries.append((key, os.path.getmtime(marker), _entry_size(entry_dir)))
+    return entries
+
+
+def evict_cache(cache_dir, max_size, keep=()):
+    """Removes the least recently used entries until the cache is at most max_size bytes.
+
+    Entries that are in use by another run (locked) and entries in keep are never removed.
+
+    Args:
+        cache_dir (str): Cache directory.
+        max_size (int): Size cap of the cache in bytes.
+        keep (iterable, optional): Keys that must not be evicted.
+
+    Returns:
+        list: Keys of the evicted entries.
+    """
+    entries = _cache_entries(cache_dir)
+    total = sum(size for _, _, size in entries)
+    evicted = []
+
+    # Oldest first
+    for key, _, size in sorted(entries, key=lambda entry: entry[1]):
+        if total <= max_size:
+            break
+        if key in keep:
+            continue
+
+        with _try_lock(os.path.join(cache_dir, f"{key}.lock")) as acquired:
+            if not acquired:
+                continue
+            shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+
+        total -= size
+        evicted.append(key)
+        logger.info(f"Evicted BLAST database {key} from cache ({size} bytes)")
+
+    return evicted
+
+
+@contextmanager
+def cached_blast_database(input_database, cache_dir, max_size=None, build=None):
+    """Provides a BLAST protein database for input_database from the on-disk cache, building it if needed.
+
+    The entry is keyed on the FASTA content and the makeblastdb version, so edits to the FASTA or a BLAST
+    upgrade produce a new entry. Concurrent runs serialize on a per-entry lock, so only one of them builds;
+    the others wait and reuse the result. The entry is held under a shared lock for the duration of the context,
+    which keeps it from being evicted by other runs while it is being searched.
+
+    Args:
+        input_database (str): Location of the input FASTA file protein sequences.
+        cache_dir (str): Directory of the cache.
+        max_size (int, optional): Size cap of the cache in bytes. Least recently used entries are evicted after a build. Defaults to None (no cap).
+        build (callable, optional): Function (input_database, output_dir) -> db_path that builds the database. Defaults to protein_search.make_blast_protein_database.
+
+    Yields:
+        str: Location + prefix of BLAST protein database.
+    """
+    if build is None:
+        from scripts.protein_search import make_blast_protein_database as build
+
+    if not os.path.isfile(input_database):
+        raise FileNotFoundError(
+            f"The specified database FASTA file does not exist: {input_database}"
+        )
+
+    os.makedirs(cache_dir, exist_ok=True)
+
+    key = cache_key(input_database)
+    entry_dir = os.path.join(cache_dir, key)
+    marker = os.path.join(entry_dir, COMPLETE_MARKER)
+    lock_path = os.path.join(cache_dir, f"{key}.lock")
+    db_name = os.path.splitext(os.path.basename(input_database))[0]
+
+    with open(lock_path, "a") as lock_file:
+        _flock(lock_file, "exclusive")
+        try:
+            if os.path.isfile(marker):
+                logger.info(f"Reusing cached BLAST database {key} for {input_database}")
+            else:
+                logger.info(f"Building BLAST database {key} for {input_database}")
+                shutil.rmtree(entry_dir, ignore_errors=True)
+
+                # Build next to the final location, then move it in place
+                build_dir = f"{entry_dir}.build-{os.getpid()}"
+                shutil.rmtree(build_dir, ignore_errors=True)
+                try:
+                    build(input_database, build_dir)
+                    with open(os.path.join(build_dir, COMPLETE_MARKER), "w") as f:
+                        f.write(f"{input_database}\n{makeblastdb_version()}\n")
+                    os.replace(build_dir, entry_dir)
+                finally:
+                    shutil.rmtree(build_dir, ignore_errors=True)
+
+            # Mark as recently used
+            os.utime(marker)
+
+            # Downgrade, so that concurrent runs can share the entry while it is searched
+            _flock(lock_file, "shared")
+
+            if max_size is not None:
+                evict_cache(cache_dir, max_size, keep=(key,))
+
+            yield os.path.join(entry_dir, db_name)
+        finally:
+            _flock(lock_file, "unlock")
@@ -1,15 +1,20 @@
 import pandas as pd
+import logging
 from copy import deepcopy
 import os
-from Bio import SeqIO
-from Bio.SeqUtils import molecular_weight
+
+from scripts.sequence_store import sequence_store
+from scripts.protein_properties import protein_properties
+from scripts.table_io import read_table
+
+logger = logging.getLogger(__name__)
 
 ## First dereplicating function
 
 
 def dereplicate_highest_score(df):
 
-    df = pd.read_csv(df)
+    df = read_table(df)
 
     # """
     # Dereplicate the DataFrame by keeping the highest score for each unique 'Name1'.
@@ -20,9 +25,10 @@ def dereplicate_highest_score(df):
     # Returns:
     # DataFrame: Dereplicated DataFrame with the highest score for each 'Name1'.
     # """
+    # Stable sort, so that of equal scores the first pair in the table is kept
     dataframe = deepcopy(df)
-    sorted_df = dataframe.sort_values(by="Score", ascending=False)
-    dereplicated_df = dataframe.drop_duplicates(
+    sorted_df = dataframe.sort_values(by="Score", ascending=False, kind="stable")
+    dereplicated_df = sorted_df.drop_duplicates(
         subset="Name1", keep="first"
     ).reset_index(drop=True)
     return dereplicated_df
@@ -31,43 +37,42 @@ def dereplicate_highest_score(df):
 ## Second, calculate statistics
 
 
-def calculate_mass_length(fasta_loc, df_entry, pblast_file_path):
-
-    # Read the FASTA file
-    sequences = list(SeqIO.parse(fasta_loc, "fasta"))
-    sequence_dict = {record.id: record for record in sequences}
+def calculate_mass_length(fasta_loc, df_entry, pblast_file_path, properties=None):
 
-    # Initialize lists to store the statistics
-    lengths = []
-    masses = []
+    # Properties of the whole proteome, from the FASTA file (or its sequence store) unless given
+    if properties is None:
+        properties = protein_properties(sequence_store(fasta_loc))
+    properties = properties.drop_duplicates(subset="Name1").set_index("Name1")
 
-    # Loop through the DataFrame and calculate statistics
-    for name in df_entry["Name1"]:
-        # Match the entry in the FASTA file
-        if name in sequence_dict:
-            seq_record = sequence_dict[name]
-            # Remove asterisks from the protein sequence
-            cleaned_sequence = str(seq_record.seq).replace("*", "")
-            sequence_length = len(cleaned_sequence)
-            sequence_mass = molecular_weight(cleaned_sequence, seq_type="protein")
-
-            lengths.append(sequence_length)
-            masses.append(sequence_mass)
-        else:
-            raise Exception(
-                "Entry in results does not match any entry in protein fasta file."
-            )
+    # Match the entries in the FASTA file
+    if not df_entry["Name1"].isin(properties.index).all():
+        raise Exception(
+            "Entry in results does not match any entry in protein fasta file."
+        )
+    entry_properties = properties.loc[df_entry["Name1"]]
 
     # Add the statistics to the DataFrame
-    df_entry["Length"] = lengths
+    df_entry["Length"] = entry_properties["Length"].to_numpy()
     df_entry["Normalized_score"] = df_entry["Score"] / df_entry["Length"]
-    df_entry["Mass"] = masses
+    df_entry["Mass"] = entry_properties["Mass"].to_numpy()
+    for column in ["Isoelectric_point", "GRAVY", "Aromaticity"]:
+        df_entry[column] = entry_properties[column].to_numpy()
+
+    if df_entry["Mass"].isna().any():
+        logger.warning(
+            f"No mass for {df_entry['Mass'].isna().sum()} entries with letters that are not amino acids"
+        )
 
-    pblast_df = pd.read_csv(pblast_file_path)
+    # Copy, the candidate table may be shared with other stages
+    pblast_df = read_table(pblast_file_path).copy()
 
     # Rename columns in the pBLAST DataFrame for merging
     pblast_df.rename(columns={"qseqid": "Name1", "sseqid": "Name2"}, inplace=True)
 
+    # Candidates from the k-mer prefilter have no E-value
+    if "evalue" not in pblast_df.columns:
+        pblast_df["evalue"] = float("nan")
+
     # Merge the DataFrames on 'Name1' and 'Name2'
     df_entry = pd.merge(
         df_entry,
@@ -0,0 +1,203 @@
+import os
+import json
+import hashlib
+import logging
+import shutil
+import tempfile
+import subprocess
+import pandas as pd
+from functools import lru_cache
+
+from scripts.blast_database_cache import fasta_content_hash
+
+logger = logging.getLogger(__name__)
+
+# Stage checkpoints. Each stage of a run records a manifest of everything its output depends on: hashes of
+# its input files and tables, its parameters and the versions of the tools it runs. A rerun with the same
+# manifest reloads the stored output instead of running the stage again. Each stage has its own directory
+# holding manifest.json and the output, the manifest being written last so that an interrupted stage leaves
+# no checkpoint behind.
+
+MANIFEST = "manifest.json"
+TABLE_OUTPUT = "output.pkl"
+
+
+@lru_cache(maxsize=None)
+def tool_version(*command):
+    """First line printed by a version command, e.g. tool_version("prodigal", "-v"), 'unknown' if it could not be run."""
+    try:
+        result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    except FileNotFoundError:
+        return "unknown"
+    # Prodigal prints its version to stderr
+    lines = (result.stdout + result.stderr).strip().split("\n")
+    return lines[0].strip() or "unknown"
+
+
+@lru_cache(maxsize=64)
+def _file_hash(path, mtime_ns, size):
+    return fasta_content_hash(path)
+
+
+def file_hash(path):
+    """SHA-256 of a file's content, computed once per version (modification time and size) of the file."""
+    stat = os.stat(path)
+    return _file_hash(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def table_hash(table):
+    """SHA-256 of the columns and values of a table, independent of its index."""
+    digest = hashlib.sha256()
+    digest.update(json.dumps([str(column) for column in table.columns]).encode())
+    digest.update(pd.util.hash_pandas_object(table, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def stage_manifest(stage, inputs=None, params=None, versions=None):
+    """Describes what the output of a stage depends on.
+
+    Args:
+        stage (str): Name of the stage, also the directory of its checkpoint.
+        inputs (dict, optional): Hashes of the input files and tables, see file_hash() and table_hash(). Defaults to None.
+        params (dict, optional): Parameters changing the output. Defaults to None.
+        versions (dict, optional): Versions of the tools and packages producing the output. Defaults to None.
+
+    Returns:
+        dict: The manifest, with a 'key' hashing all of it.
+    """
+    manifest = {
+        "stage": stage,
+        "inputs": inputs or {},
+        "params": params or {},
+        "versions": versions or {},
+    }
+    manifest["key"] = hashlib.sha256(json.dumps(manifest, sort_keys=True, default=str).encode()).hexdigest()
+    return manifest
+
+
+def _changes(stored, manifest):
+    """Names of the inputs, parameters and versions that differ between two manifests."""
+    changes = []
+    for section in ("inputs", "params", "versions"):
+        old, new = stored.get(section, {}), manifest[section]
+        changes += [f"{section}.{name}" for name in sorted(set(old) | set(new)) if old.get(name) != new.get(name)]
+    return changes
+
+
+def load_checkpoint(checkpoint_dir, manifest):
+    """Returns the stored output of a stage if its checkpoint matches the manifest.
+
+    Args:
+        checkpoint_dir (str): Directory of the checkpoints of the run.
+        manifest (dict): Manifest from stage_manifest().
+
+    Returns:
+        pandas.DataFrame or str: The stored table, or the path of the stored copy of the output file for stages
+            writing a file. None if there is no matching checkpoint.
+    """
+    stage_dir = os.path.join(checkpoint_dir, manifest["stage"])
+    try:
+        with open(os.path.join(stage_dir, MANIFEST), "r") as f:
+            stored = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    if stored.get("key") != manifest["key"]:
+        logger.info(f"Checkpoint of stage {manifest['stage']} is outdated, changed: {', '.join(_changes(stored, manifest)) or 'format'}")
+        return None
+
+    try:
+        if "output_file" in stored:
+            output = os.path.join(stage_dir, stored["output_file"])
+            if file_hash(output) != stored["output_hash"]:
+                logger.warning(f"Stored output {output} of stage {manifest['stage']} changed since its checkpoint")
+                return None
+        else:
+            output = pd.read_pickle(os.path.join(stage_dir, TABLE_OUTPUT))
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not load the checkpoint of stage {manifest['stage']}: {e}")
+        return None
+
+    logger.info(f"Reusing the checkpoint of stage {manifest['stage']} in {stage_dir}")
+    return output
+
+
+def _write_atomic(path, write):
+    """Writes a file with write(temp_path) next to path, then renames it to path."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".checkpoint.")
+    os.close(fd)
+    try:
+        write(temp_path)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+def save_checkpoint(checkpoint_dir, manifest, output):
+    """Stores the output of a stage with its manifest.
+
+    Args:
+        checkpoint_dir (str): Directory of the checkpoints of the run.
+        manifest (dict): Manifest from stage_manifest().
+        output (pandas.DataFrame or str): Output table, or the path of the output file of a stage writing a file.
+            A copy of the file is stored, with its content hash to detect changes.
+    """
+    stage_dir = os.path.join(checkpoint_dir, manifest["stage"])
+    os.makedirs(stage_dir, exist_ok=True)
+
+    # Invalidate the old checkpoint before its output is replaced
+    try:
+        os.remove(os.path.join(stage_dir, MANIFEST))
+    except FileNotFoundError:
+        pass
+
+    stored = dict(manifest)
+    if isinstance(output, pd.DataFrame):
+        _write_atomic(os.path.join(stage_dir, TABLE_OUTPUT), output.to_pickle)
+    else:
+        stored["output_file"] = os.path.basename(output)
+        stored["output_hash"] = file_hash(output)
+        _write_atomic(os.path.join(stage_dir, stored["output_file"]), lambda path: shutil.copyfile(output, path))
+
+    def write_manifest(path):
+        with open(path, "w") as f:
+            json.dump(stored, f, indent=2, default=str)
+
+    _write_atomic(os.path.join(stage_dir, MANIFEST), write_manifest)
+    logger.info(f"Saved the checkpoint of stage {manifest['stage']} in {stage_dir}")
+
+
+def run_stage(checkpoint_dir, manifest, run, complete=None, record=None):
+    """Runs a stage, unless a checkpoint matching its manifest holds its output already.
+
+    Args:
+        checkpoint_dir (str): Directory of the checkpoints of the run, None to always run the stage without checkpoint.
+        manifest (dict): Manifest from stage_manifest().
+        run (callable): Runs the stage and returns its output, a table or the path of the file it wrote. A reused
+            output file is the copy in the checkpoint, see load_checkpoint().
+        complete (callable, optional): Tells whether an output is complete enough to checkpoint, e.g. not
+            the empty result of a failed tool. Defaults to None (always checkpoint).
+        record (dict, optional): Stage record of a RunReport, gets 'checkpoint': 'reused', 'saved' or 'incomplete'. Defaults to None.
+
+    Returns:
+        pandas.DataFrame or str: Output of the stage.
+    """
+    if checkpoint_dir is not None:
+        output = load_checkpoint(checkpoint_dir, manifest)
+        if output is not None:
+            if record is not None:
+                record["checkpoint"] = "reused"
+            print(f"Stage {manifest['stage']}: inputs and parameters unchanged, reusing the checkpoint")
+            return output
+
+    output = run()
+    if checkpoint_dir is not None:
+        saved = complete is None or complete(output)
+        if record is not None:
+            record["checkpoint"] = "saved" if saved else "incomplete"
+        if saved:
+            save_checkpoint(checkpoint_dir, manifest, output)
+        else:
+            logger.warning(f"Output of stage {manifest['stage']} is incomplete, not saving a checkpoint")
+    return output
@@ -1,17 +1,61 @@
 import subprocess
 import sys
 import os
+import json
+import shutil
+import hashlib
+import importlib.util
+import importlib.metadata
 from functools import wraps
 
+# Distribution names of the packages whose import name differs, for looking up the installed version
+DISTRIBUTIONS = {"Bio": "biopython"}
 
-def check_requirements(requirements):
+
+def requirements_stamp_key(requirements):
+    """Key of a passed requirement check: the interpreter, PATH, the requirements and the Prodigal and BLAST
+    executables found in PATH (with their modification times, so that reinstalling them invalidates the stamp).
+    """
+    executables = {}
+    for executable in ("prodigal", "blastp"):
+        location = shutil.which(executable)
+        executables[executable] = (
+            [location, os.stat(location).st_mtime_ns] if location else None
+        )
+
+    key = json.dumps(
+        [
+            sys.executable,
+            sys.version,
+            os.environ.get("PATH", ""),
+            requirements,
+            executables,
+        ],
+        sort_keys=True,
+    )
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def check_requirements(requirements, stamp_dir="temp/requirement_checks"):
     """Checks that the requirements for the Chromosearch pipeline are installed and available.
     Exits the program if anything is missing with code 2.
 
+    A passed check leaves a stamp file in stamp_dir, keyed on the interpreter, PATH and the requirements, and
+    later runs with the same key skip the check. Installing packages into the same environment does not change
+    the key, delete the stamp directory to check again.
+
     Args:
-        requirements (dic): Dictionary of requirements, "packages" key as a list of tuples ("package_name", "version"), with the other keys only having a version string to check.
+        requirements (dic): Dictionary of requirements, "packages" key as a list of tuples ("package_name", "version"), with the other keys only having a version string to check. BLAST is only checked with a "blast_version" key.
+        stamp_dir (str, optional): Directory of the stamp files. Defaults to "temp/requirement_checks", None always checks.
     """
 
+    stamp = None
+    if stamp_dir is not None:
+        stamp = os.path.join(stamp_dir, requirements_stamp_key(requirements))
+        if os.path.exists(stamp):
+            print("Requirements for chromosearch already checked in this environment.")
+            return
+
     print("Checking requirements for chromosearch...")
     # Check each python module for being installed
     for package, version in requirements["packages"]:
@@ -19,14 +63,20 @@ def check_requirements(requirements):
             system_exit_missing_dependencies()
 
     # Check Prodigal and BLAST
-    if not check_blast(requirements["blast_version"]) or not check_prodigal(
-        requirements["prodigal_version"]
-    ):
+    if (
+        "blast_version" in requirements
+        and not check_blast(requirements["blast_version"])
+    ) or not check_prodigal(requirements["prodigal_version"]):
         system_exit_missing_dependencies()
 
     # Check Python version, doesn't return
     check_python_version(requirements["python_version"])
 
+    if stamp is not None:
+        os.makedirs(stamp_dir, exist_ok=True)
+        with open(stamp, "w") as f:
+            json.dump(requirements, f)
+
     return
 
 
@@ -41,6 +91,9 @@ def system_exit_missing_dependencies():
 def check_package(package_name, version=None):
     """Checks whether a package in the requirements is installed and available with the correct version.
 
+    The package is found and its version read from the installed metadata without importing it, since
+    importing scipy, statsmodels or seaborn alone takes about a second.
+
     Args:
         package_name (str): The name of the package to import
         version (str, optional): _description_. The version to check for the package. Defaults to None.
@@ -48,21 +101,24 @@ def check_package(package_name, version=None):
     Returns:
         bool: True for the package being installed, False in the opposite case. Version mismatch still returns True, since it is not critical.
     """
-    try:
-
-        pkg = __import__(package_name)
-        if version:
-            installed_version = pkg.__version__
-            if installed_version != version:
-                print(
-                    f"Warning: {package_name} version mismatch. Expected: {version}, Installed: {installed_version}. This might lead to errors or inconsistent behaviour."
-                )
-        return True
-
-    except ImportError:
+    if importlib.util.find_spec(package_name) is None:
         print(f"{package_name} is not installed.")
         return False
 
+    if version:
+        try:
+            installed_version = importlib.metadata.version(
+                DISTRIBUTIONS.get(package_name, package_name)
+            )
+        except importlib.metadata.PackageNotFoundError:
+            # No metadata (e.g. a source checkout in PYTHONPATH), fall back to importing it
+            installed_version = getattr(__import__(package_name), "__version__", None)
+        if installed_version != version:
+            print(
+                f"Warning: {package_name} version mismatch. Expected: {version}, Installed: {installed_version}. This might lead to errors or inconsistent behaviour."
+            )
+    return True
+
 
 def check_blast(version):
     """Checks whether BLAST is installed and available. Also checks for the correct version.
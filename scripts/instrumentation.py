@@ -0,0 +1,177 @@
+import os
+import sys
+import json
+import time
+import cProfile
+import logging
+import platform
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:  # Windows, no resource usage of child processes
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# Per-stage performance measurements of a run, written as a JSON report. For each stage: wall time, CPU time
+# of the process and of its finished child processes (prodigal, blastp, worker pools), peak resident memory of
+# both, and the number of items processed with the throughput. The process peak is reset at the start of each
+# stage where Linux allows it (/proc/self/clear_refs), elsewhere it is the peak of the run up to that stage.
+# The child figures only cover children that have exited, a shared worker pool is counted when it shuts down.
+# A run sharing its process with other runs (genomes run in threads by chromosearch_batch.py) records the CPU
+# time of its own thread, and does not reset the peak memory of the others: its peak memory and child figures
+# are those of the whole process. The *_scope fields of a stage tell which applies.
+
+CLEAR_REFS = "/proc/self/clear_refs"
+STATUS = "/proc/self/status"
+
+
+def _max_rss_mb(who):
+    """Peak resident memory from getrusage() in MB (reported in KB on Linux and in bytes on macOS)."""
+    max_rss = resource.getrusage(who).ru_maxrss
+    return max_rss / 1024**2 if sys.platform == "darwin" else max_rss / 1024
+
+
+def _reset_peak_rss():
+    """Resets the peak resident memory of the process (VmHWM), returns False where that is not possible."""
+    try:
+        with open(CLEAR_REFS, "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def _peak_rss_mb():
+    """Peak resident memory of the process in MB, since the last reset where available."""
+    try:
+        with open(STATUS, "r") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _max_rss_mb(resource.RUSAGE_SELF) if resource is not None else None
+
+
+def _round(value):
+    return None if value is None else round(value, 2)
+
+
+def _children_usage():
+    """(CPU seconds, peak RSS MB) of the finished child processes, (None, None) without the resource module."""
+    if resource is None:
+        return None, None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime, _max_rss_mb(resource.RUSAGE_CHILDREN)
+
+
+class RunReport:
+    """Collects the measurements of the stages of a run.
+
+    Args:
+        name (str): Name of the run, e.g. the genome prefix.
+        profile_dir (str, optional): Directory for a cProfile dump (<stage>.prof) per stage. Defaults to None (no profiling).
+        shared_process (bool, optional): Other runs are running in threads of the same process. Defaults to False.
+        **info: Additional fields of the report, e.g. the number of threads.
+    """
+
+    def __init__(self, name, profile_dir=None, shared_process=False, **info):
+        self.name = name
+        self.profile_dir = profile_dir
+        self.shared_process = shared_process
+        self.info = info
+        self.stages = []
+        self.started = datetime.now().isoformat(timespec="seconds")
+        self._start = time.perf_counter()
+
+        if profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name, unit=None):
+        """Measures the stage run in the context.
+
+        The context yields the record of the stage, a dict. The stage sets record["items"] to the number of
+        items it processed, counted in unit, for the throughput.
+
+        Args:
+            name (str): Name of the stage.
+            unit (str, optional): What the items are, e.g. "pairs". Defaults to None.
+
+        Yields:
+            dict: The record of the stage.
+        """
+        record = {"stage": name, "unit": unit, "items": None}
+
+        profiler = None
+        if self.profile_dir is not None:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # Only one profiler can be active at a time, e.g. with genomes run in parallel threads
+                logger.warning(f"Not profiling stage {name}: {e}")
+                profiler = None
+
+        # Resetting the peak memory of a shared process would reset that of the other runs
+        peak_reset = not self.shared_process and _reset_peak_rss()
+        cpu_time = time.thread_time if self.shared_process else time.process_time
+        children_cpu_start, _ = _children_usage()
+        cpu_start = cpu_time()
+        start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record["failed"] = True
+            raise
+        finally:
+            wall = time.perf_counter() - start
+            cpu = cpu_time() - cpu_start
+            children_cpu, children_peak_rss = _children_usage()
+
+            measurements = {
+                "stage": name,
+                "wall_s": round(wall, 4),
+                "cpu_s": round(cpu, 4),
+                "cpu_scope": "thread" if self.shared_process else "process",
+                "children_cpu_s": None if children_cpu is None else round(children_cpu - children_cpu_start, 4),
+                "children_scope": "process" if self.shared_process else "run",
+                "peak_rss_mb": _round(_peak_rss_mb()),
+                "peak_rss_scope": "process" if self.shared_process else "stage" if peak_reset else "run",
+                "children_peak_rss_mb": _round(children_peak_rss),
+            }
+            if record["items"] is not None:
+                measurements["throughput_per_s"] = _round(record["items"] / wall) if wall > 0 else None
+
+            if profiler is not None:
+                profiler.disable()
+                record["profile"] = os.path.join(self.profile_dir, f"{name}.prof")
+                profiler.dump_stats(record["profile"])
+
+            self.stages.append({**measurements, **record})
+
+            logger.info(
+                f"Stage {name}: {wall:.2f} s wall, {cpu:.2f} s CPU"
+                + (f", {record['items']} {unit or 'items'}" if record["items"] is not None else "")
+            )
+
+    def as_dict(self):
+        """The report as a JSON-serializable dict."""
+        return {
+            "name": self.name,
+            "started": self.started,
+            "wall_s": round(time.perf_counter() - self._start, 4),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            **self.info,
+            "stages": self.stages,
+        }
+
+    def write(self, path):
+        """Writes the report to a JSON file."""
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2)
+        logger.info(f"Saved the performance report in file: {path}")
@@ -0,0 +1,270 @@
+import os
+import shutil
+import logging
+import tempfile
+import numpy as np
+import pandas as pd
+
+from scripts.blast_database_cache import fasta_content_hash
+from scripts.sequence_store import sequence_store
+from scripts.table_io import table_path
+from scripts.table_io import write_table
+
+logger = logging.getLogger(__name__)
+
+# Native candidate selection: database proteins are indexed on spaced-seed k-mers over a reduced amino
+# acid alphabet, and a candidate protein is paired with the database proteins that share at least
+# min_hits k-mers on one diagonal (band). Only those pairs go on to Smith-Waterman.
+
+# Reduced alphabets, groups of interchangeable residues separated by spaces
+REDUCED_ALPHABETS = {
+    "murphy10": "LVIM C A G ST P FYW EDNQ KR H",
+    "full": "A C D E F G H I K L M N P Q R S T V W Y",
+}
+
+KMER_ALPHABETS = tuple(REDUCED_ALPHABETS)
+
+# Residue code of letters outside of the alphabet, k-mers containing it are skipped
+UNKNOWN = 255
+
+INDEX_ARRAYS = ("kmers", "entries", "positions", "lengths", "names")
+
+
+def residue_codes(alphabet):
+    """256-entry lookup table from byte values to group numbers of a reduced alphabet.
+
+    Args:
+        alphabet (str): Name of the reduced alphabet, a key of REDUCED_ALPHABETS.
+
+    Returns:
+        tuple: (table, size), the uint8 lookup table (UNKNOWN outside of the alphabet) and the number of groups.
+    """
+    groups = REDUCED_ALPHABETS[alphabet].split()
+    table = np.full(256, UNKNOWN, dtype=np.uint8)
+    for number, group in enumerate(groups):
+        for letter in group:
+            table[ord(letter)] = number
+            table[ord(letter.lower())] = number
+    return table, len(groups)
+
+
+def seed_offsets(seed, size=None):
+    """Offsets of the matching positions of a spaced seed, e.g. '1101011' -> [0, 1, 3, 5, 6].
+
+    With the size of the alphabet, seeds whose k-mer codes do not fit in int64 are rejected too.
+    """
+    if not seed or set(seed) - {"0", "1"} or seed[0] != "1" or seed[-1] != "1":
+        raise ValueError(f"Invalid seed {seed!r}, expected a pattern of 0 and 1 starting and ending with 1")
+    offsets = np.array([offset for offset, care in enumerate(seed) if care == "1"])
+    if size is not None and size ** len(offsets) > 2**63:
+        raise ValueError(
+            f"Seed {seed!r} has too many matching positions ({len(offsets)}) for an alphabet of {size} groups, "
+            f"its k-mer codes would overflow"
+        )
+    return offsets
+
+
+def kmer_codes(sequences, table, size, seed):
+    """Spaced-seed k-mer codes of the sequences, concatenated.
+
+    The residues are translated into one buffer, the sequences separated by an UNKNOWN residue, so that
+    the codes of all positions are computed with a few array operations and k-mers never cross two sequences.
+
+    Args:
+        sequences (SequenceStore): Sequences.
+        table (numpy.ndarray): Residue lookup table from residue_codes().
+        size (int): Size of the reduced alphabet.
+        seed (str): Spaced seed, see seed_offsets().
+
+    Returns:
+        tuple: (codes, sequence_indices, positions) arrays of the valid k-mers.
+    """
+    offsets = seed_offsets(seed, size)
+    span = offsets[-1] + 1
+
+    # Sequence i starts i separators after its start in the residue buffer of the store
+    starts = sequences.offsets[:-1] + np.arange(len(sequences))
+    buffer = np.full(len(sequences.residues) + len(sequences), UNKNOWN, dtype=np.uint8)
+    buffer[np.arange(len(sequences.residues)) + np.repeat(np.arange(len(sequences)), sequences.lengths)] = table[sequences.residues]
+
+    n_kmers = len(buffer) - span + 1
+    if n_kmers <= 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, empty
+
+    codes = np.zeros(n_kmers, dtype=np.int64)
+    valid = np.ones(n_kmers, dtype=bool)
+    for weight, offset in enumerate(offsets):
+        window = buffer[offset : offset + n_kmers]
+        valid &= window != UNKNOWN
+        codes += window.astype(np.int64) * size**weight
+
+    starts_in_buffer = np.flatnonzero(valid)
+    sequence_indices = np.searchsorted(starts, starts_in_buffer, side="right") - 1
+    positions = starts_in_buffer - starts[sequence_indices]
+    return codes[valid], sequence_indices, positions
+
+
+def build_kmer_index(input_database, index_dir, alphabet="murphy10", seed="1101011"):
+    """Builds the k-mer index of a database FASTA, or reuses the one already built for it.
+
+    The index is a directory of NumPy arrays: the k-mer codes of all database positions in sorted order,
+    with their database entry and position, plus the lengths and names of the entries. It is keyed on
+    the content of the FASTA, the alphabet and the seed, and built into a temporary directory that is
+    renamed into place once complete, so concurrent runs never see a partial index.
+
+    Args:
+        input_database (str): Database FASTA file.
+        index_dir (str): Directory holding the indices.
+        alphabet (str, optional): Reduced alphabet, a key of REDUCED_ALPHABETS. Defaults to "murphy10".
+        seed (str, optional): Spaced seed, see seed_offsets(). Defaults to "1101011".
+
+    Returns:
+        str: Directory of the index, see load_kmer_index().
+    """
+    table, size = residue_codes(alphabet)
+    seed_offsets(seed, size)
+
+    key = f"{fasta_content_hash(input_database)[:32]}_{alphabet}_{seed}"
+    index_path = os.path.join(index_dir, key)
+    if os.path.isdir(index_path):
+        logger.info(f"Reusing k-mer index {index_path}")
+        return index_path
+
+    os.makedirs(index_dir, exist_ok=True)
+    logger.info(f"Building k-mer index of {input_database} in {index_path}")
+
+    records = sequence_store(input_database)
+    codes, entries, positions = kmer_codes(records, table, size, seed)
+
+    order = np.argsort(codes, kind="stable")
+    arrays = {
+        "kmers": codes[order],
+        "entries": entries[order].astype(np.int32),
+        "positions": positions[order].astype(np.int32),
+        "lengths": records.lengths.astype(np.int32),
+        "names": np.array(records.names, dtype=str),
+    }
+
+    work_dir = tempfile.mkdtemp(dir=index_dir, prefix=f".{key}.")
+    try:
+        for name, array in arrays.items():
+            np.save(os.path.join(work_dir, f"{name}.npy"), array)
+        os.rename(work_dir, index_path)
+    except OSError:
+        # Built concurrently by another run, that one is used
+        shutil.rmtree(work_dir, ignore_errors=True)
+        if not os.path.isdir(index_path):
+            raise
+
+    return index_path
+
+
+def load_kmer_index(index_path):
+    """Loads the arrays of a k-mer index memory-mapped.
+
+    Returns:
+        dict: Arrays of the index by name, see build_kmer_index().
+    """
+    return {name: np.load(os.path.join(index_path, f"{name}.npy"), mmap_mode="r") for name in INDEX_ARRAYS}
+
+
+def diagonal_hits(index, codes, positions, diagonal_band=4):
+    """Counts the k-mer hits of one query per database entry and diagonal band.
+
+    Args:
+        index (dict): Arrays of the k-mer index, see load_kmer_index().
+        codes (numpy.ndarray): K-mer codes of the query.
+        positions (numpy.ndarray): Query positions of the k-mers.
+        diagonal_band (int, optional): Width of the diagonal bands hits are counted in. Defaults to 4.
+
+    Returns:
+        tuple: (entries, best_hits) arrays, for each database entry with a hit the highest number of hits on a band.
+    """
+    kmers = index["kmers"]
+    left = np.searchsorted(kmers, codes, side="left")
+    counts = np.searchsorted(kmers, codes, side="right") - left
+    total = int(counts.sum())
+    if total == 0:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty
+
+    # Index positions of all hits: left[k], left[k] + 1, ..., left[k] + counts[k] - 1 for each query k-mer
+    first_hit = np.cumsum(counts) - counts
+    hits = np.repeat(left - first_hit, counts) + np.arange(total)
+
+    entries = np.asarray(index["entries"][hits], dtype=np.int64)
+    diagonals = np.asarray(index["positions"][hits], dtype=np.int64) - np.repeat(positions, counts)
+
+    # One key per (entry, band); diagonals are shifted to be non-negative
+    bands = (diagonals - diagonals.min()) // diagonal_band
+    keys, hits_per_band = np.unique(entries * (bands.max() + 1) + bands, return_counts=True)
+    key_entries = keys // (bands.max() + 1)
+
+    # Highest band count per entry; keys are sorted, so the entries of a key run are contiguous
+    starts = np.flatnonzero(np.r_[True, key_entries[1:] != key_entries[:-1]])
+    return key_entries[starts], np.maximum.reduceat(hits_per_band, starts)
+
+
+def kmer_candidate_search(input_sequence, genome, output, input_database, index_dir="temp/kmer_index", alphabet="murphy10", seed="1101011", min_hits=3, diagonal_band=4, max_hits_per_query=None, table_format="csv"):
+    """Selects the candidate pairs for Smith-Waterman with the k-mer index instead of blastp.
+
+    The pairs are a table with the columns qseqid, sseqid and diagonal_hits, ordered by query and best
+    first, in the pair format name_and_sequence_pair() reads.
+
+    Args:
+        input_sequence (str or SequenceStore): FASTA file of the candidate proteins, or its sequence store.
+        genome (str): Naming prefix.
+        output (str): Output directory for the output_{genome}_kmer_prefilter result file, None to not write it.
+        input_database (str): Database FASTA file.
+        index_dir (str, optional): Directory holding the k-mer indices. Defaults to "temp/kmer_index".
+        alphabet (str, optional): Reduced alphabet, a key of REDUCED_ALPHABETS. Defaults to "murphy10".
+        seed (str, optional): Spaced seed, see seed_offsets(). Defaults to "1101011".
+        min_hits (int, optional): K-mer hits needed on one diagonal band. Defaults to 3.
+        diagonal_band (int, optional): Width of the diagonal bands. Defaults to 4.
+        max_hits_per_query (int, optional): Keep at most this many database entries per query. Defaults to None (all).
+        table_format (str, optional): Format of the result file, a key of TABLE_FORMATS. Defaults to "csv".
+
+    Returns:
+        pandas.DataFrame: The candidate pairs.
+    """
+    logger.debug("Entering kmer_candidate_search function")
+
+    index = load_kmer_index(build_kmer_index(input_database, index_dir, alphabet, seed))
+    names = index["names"]
+
+    queries = sequence_store(input_sequence)
+    table, size = residue_codes(alphabet)
+    codes, query_indices, positions = kmer_codes(queries, table, size, seed)
+
+    # K-mers of each query are contiguous in the concatenated codes
+    bounds = np.searchsorted(query_indices, np.arange(len(queries) + 1))
+
+    pairs = {"qseqid": [], "sseqid": [], "diagonal_hits": []}
+    for query, query_name in enumerate(queries.names):
+        start, end = bounds[query], bounds[query + 1]
+        entries, best_hits = diagonal_hits(index, codes[start:end], positions[start:end], diagonal_band)
+
+        selected = np.flatnonzero(best_hits >= min_hits)
+        selected = selected[np.argsort(-best_hits[selected], kind="stable")]
+        if max_hits_per_query is not None:
+            selected = selected[:max_hits_per_query]
+
+        pairs["qseqid"] += [query_name] * len(selected)
+        pairs["sseqid"] += names[entries[selected]].tolist()
+        pairs["diagonal_hits"] += best_hits[selected].tolist()
+
+    # Explicit types, the columns of an empty table would be float otherwise
+    pairs = pd.DataFrame(
+        {
+            "qseqid": pd.Series(pairs["qseqid"], dtype=object),
+            "sseqid": pd.Series(pairs["sseqid"], dtype=object),
+            "diagonal_hits": pd.Series(pairs["diagonal_hits"], dtype=np.int64),
+        }
+    )
+    if output is not None:
+        write_table(pairs, table_path(f"{output}/output_{genome}_kmer_prefilter", table_format))
+
+    logger.info(f"K-mer prefilter selected {len(pairs)} pairs for {len(queries)} proteins")
+    logger.debug("Exiting kmer_candidate_search function")
+    return pairs
@@ -0,0 +1,229 @@
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime
+
+import numpy as np
+
+from scripts.checkpoint import file_hash
+from scripts.protein_sequence_obtainer import SequencePairs
+from scripts.sequence_store import SequenceStore
+from scripts.smith_waterman import smith_waterman_alignment
+from scripts.smith_waterman import substitution_matrix_name
+from scripts.statistical_analysis import fit_gumbel
+from scripts.statistical_analysis import gumbel_goodness_of_fit
+
+logger = logging.getLogger(__name__)
+
+# Null distribution of the normalized scores, calibrated once per database and scoring scheme. Decoy
+# proteins (shuffled or reversed stretches of the database, so with its residue composition but without
+# homologs in it) are aligned against random database entries, and the Gumbel distribution is fitted to the
+# best normalized score of each decoy, separately for bins of the protein length. The parameters are saved in
+# a JSON file next to the database, and the statistics can take the parameters of the p-values from it
+# instead of fitting the scores of each run.
+
+DECOY_METHODS = ["shuffle", "reverse"]
+
+# Protein length bins of the calibration, as the lower bound of each bin
+LENGTH_BINS = [30, 100, 150, 200, 250, 300, 400, 500, 700, 1000]
+MAX_DECOY_LENGTH = 1500
+
+
+def scoring_parameters(match=3, mismatch=-1, gap_open=-10, gap_extend=-4, matrix=True):
+    """The Smith-Waterman scoring scheme, as stored in and keying a calibration."""
+    return {
+        "match": match,
+        "mismatch": mismatch,
+        "gap_open": gap_open,
+        "gap_extend": gap_extend,
+        "matrix": substitution_matrix_name(matrix),
+    }
+
+
+def calibration_path(database, scoring, targets_per_decoy=0):
+    """Location of the calibration of a database for a scoring scheme and null, next to the database FASTA file."""
+    null = dict(scoring, targets_per_decoy=targets_per_decoy)
+    key = hashlib.sha256(json.dumps(null, sort_keys=True).encode()).hexdigest()[:16]
+    return f"{database}.null_calibration_{key}.json"
+
+
+def decoy_sequences(database, length_bins, decoys_per_bin, method="shuffle", seed=0):
+    """Decoy proteins with the residue composition of the database, decoys_per_bin for each length bin.
+
+    A decoy is a stretch of the concatenated database residues of a random length within its bin, shuffled
+    or reversed. Bins starting at or above the number of database residues get no decoys.
+
+    Args:
+        database (SequenceStore): The database.
+        length_bins (list): Lower bounds of the length bins, in increasing order.
+        decoys_per_bin (int): Number of decoys per bin.
+        method (str, optional): One of DECOY_METHODS. Defaults to "shuffle".
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        list: (name, sequence) tuples, named decoy_<bin>_<number>.
+    """
+    rng = np.random.default_rng(seed)
+    residues = np.asarray(database.residues)
+    upper_bounds = list(length_bins[1:]) + [MAX_DECOY_LENGTH]
+
+    dropped = [lower for lower in length_bins if lower >= len(residues)]
+    if dropped:
+        logger.warning(f"Database has {len(residues)} residues, no decoys for the length bins from {', '.join(map(str, dropped))}")
+
+    decoys = []
+    for bin_number, (lower, upper) in enumerate(zip(length_bins, upper_bounds)):
+        if lower >= len(residues):
+            continue
+        lengths = rng.integers(lower, min(upper, len(residues)), size=decoys_per_bin, endpoint=False)
+        for number, length in enumerate(lengths.tolist()):
+            start = rng.integers(0, len(residues) - length + 1)
+            stretch = residues[start : start + length]
+            stretch = rng.permutation(stretch) if method == "shuffle" else stretch[::-1]
+            decoys.append((f"decoy_{bin_number}_{number}", stretch.tobytes().decode()))
+    return decoys
+
+
+def calibrate_null_distribution(
+    database,
+    match=3,
+    mismatch=-1,
+    gap_open=-10,
+    gap_extend=-4,
+    matrix=True,
+    decoys_per_bin=200,
+    targets_per_decoy=0,
+    length_bins=LENGTH_BINS,
+    method="shuffle",
+    threads=1,
+    engine="biopython",
+    seed=0,
+):
+    """Calibrates the null distribution of the normalized scores for a database and scoring scheme.
+
+    Args:
+        database (str): Path to the database FASTA file.
+        match (int, optional): Score for match. Defaults to 3.
+        mismatch (int, optional): Score for mismatch. Defaults to -1.
+        gap_open (int, optional): Penalty for gap opening. Defaults to -10.
+        gap_extend (int, optional): Penalty for gap extension. Defaults to -4.
+        matrix (bool, optional): Use the BLOSUM62 substitution matrix. Defaults to True.
+        decoys_per_bin (int, optional): Decoy proteins per length bin. Defaults to 200.
+        targets_per_decoy (int, optional): Random database entries each decoy is aligned against, its best score counts. 0 aligns against all entries, the null of a run scoring its proteins against the whole database. Defaults to 0.
+        length_bins (list, optional): Lower bounds of the length bins. Defaults to LENGTH_BINS.
+        method (str, optional): How decoys are made, one of DECOY_METHODS. Defaults to "shuffle".
+        threads (int, optional): Number of processes aligning the decoys. Defaults to 1.
+        engine (str, optional): Smith-Waterman scoring engine, one of SW_ENGINES. Defaults to "biopython".
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        str: Path of the saved calibration, see calibration_path().
+    """
+
+    logger.info(f"Calibrating the null distribution of {database}")
+
+    targets = SequenceStore.from_fasta(database)
+    decoys = SequenceStore.from_records(decoy_sequences(targets, length_bins, decoys_per_bin, method, seed))
+
+    # Each decoy against random database entries
+    rng = np.random.default_rng(seed + 1)
+    if targets_per_decoy <= 0 or targets_per_decoy >= len(targets):
+        pairs = SequencePairs(decoys, targets)
+    else:
+        target_indices = np.stack([rng.choice(len(targets), targets_per_decoy, replace=False) for _ in range(len(decoys))])
+        index_pairs = np.column_stack([np.repeat(np.arange(len(decoys)), targets_per_decoy), target_indices.ravel()])
+        pairs = SequencePairs(decoys, targets, index_pairs)
+
+    n_bins = sum(lower < len(targets.residues) for lower in length_bins)
+    print(f"Aligning {len(decoys)} decoys in {n_bins} length bins, {len(pairs)} alignments...")
+    # Only the best score of each decoy is kept
+    alignments = smith_waterman_alignment(
+        None, pairs, "null_calibration", match, mismatch, gap_open, gap_extend, matrix, threads=threads, engine=engine, top_k=1
+    )
+    if not alignments.attrs.get("complete", False):
+        raise RuntimeError("Smith-Waterman alignment of the decoys failed, see the log")
+
+    # Decoys with letters outside of the substitution matrix (e.g. selenocysteine) can not be scored
+    unscored = alignments["Score"].isna()
+    if unscored.any():
+        logger.warning(f"{unscored.sum()} decoys could not be scored, leaving them out of the calibration")
+        alignments = alignments[~unscored]
+
+    # Best normalized score of each decoy
+    best_scores = alignments.set_index("Name1")["Score"]
+    lengths = decoys.lengths[[decoys.index[name] for name in best_scores.index]]
+    normalized_scores = best_scores.to_numpy() / lengths
+    decoy_bins = np.array([int(name.split("_")[1]) for name in best_scores.index])
+
+    bins = []
+    upper_bounds = list(length_bins[1:]) + [None]
+    for bin_number, (lower, upper) in enumerate(zip(length_bins, upper_bounds)):
+        scores = normalized_scores[decoy_bins == bin_number]
+        if len(scores) == 0:
+            continue
+        mu, beta = fit_gumbel(scores, "mle")
+        goodness_of_fit = gumbel_goodness_of_fit(scores, (mu, beta))
+        bins.append(
+            {
+                "min_length": lower,
+                "max_length": upper,
+                "mu": mu,
+                "beta": beta,
+                "n": len(scores),
+                "ks_statistic": goodness_of_fit["ks_statistic"],
+            }
+        )
+        print(f"Length {lower:>5} to {upper or '':>5}: mu = {mu:.4f}, beta = {beta:.4f}, Kolmogorov-Smirnov statistic = {goodness_of_fit['ks_statistic']:.3f}")
+
+    if not bins:
+        raise RuntimeError("None of the decoys could be scored, see the log")
+
+    scoring = scoring_parameters(match, mismatch, gap_open, gap_extend, matrix)
+    calibration = {
+        "database": os.path.abspath(database),
+        "database_hash": file_hash(database),
+        "scoring": scoring,
+        "decoys": method,
+        "decoys_per_bin": decoys_per_bin,
+        "targets_per_decoy": targets_per_decoy,
+        "seed": seed,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "bins": bins,
+    }
+
+    path = calibration_path(database, scoring, targets_per_decoy)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "w") as f:
+        json.dump(calibration, f, indent=2)
+    os.replace(temporary_path, path)
+
+    logger.info(f"Saved the null calibration in file: {path}")
+    return path
+
+
+def load_null_calibration(database, match=3, mismatch=-1, gap_open=-10, gap_extend=-4, matrix=True, targets_per_decoy=0):
+    """Loads the calibration of a database for a scoring scheme.
+
+    Args:
+        targets_per_decoy (int, optional): Database entries per decoy of the calibration, see calibrate_null_distribution(). Defaults to 0 (all entries).
+
+    Returns:
+        dict: The calibration, None when there is none or the database changed since it was made.
+    """
+    path = calibration_path(database, scoring_parameters(match, mismatch, gap_open, gap_extend, matrix), targets_per_decoy)
+    if not os.path.exists(path):
+        return None
+
+    with open(path, "r") as f:
+        calibration = json.load(f)
+
+    if calibration.get("targets_per_decoy") != targets_per_decoy:
+        logger.warning(f"Null calibration {path} was made with {calibration.get('targets_per_decoy')} targets per decoy, not {targets_per_decoy}, ignoring it")
+        return None
+
+    if calibration["database_hash"] != file_hash(database):
+        logger.warning(f"Null calibration {path} is of an older version of the database, ignoring it")
+        return None
+
+    return calibration
@@ -0,0 +1,180 @@
+import logging
+import numpy as np
+import pandas as pd
+from Bio.Data import IUPACData
+from Bio.SeqUtils import ProtParamData
+from Bio.SeqUtils import IsoelectricPoint
+
+logger = logging.getLogger(__name__)
+
+# Vectorized protein properties. A residue count matrix (one row per sequence, one column per byte value)
+# is built with np.bincount from the encoded residues of a SequenceStore, and the properties are products of
+# it with per-residue tables. Stop codons ('*') are ignored, like the cleaned sequences used before, and the
+# values are those of Bio.SeqUtils.molecular_weight() and Bio.SeqUtils.ProtParam.ProteinAnalysis.
+# Sequences with letters outside of a table get NaN where Biopython raises an error.
+
+PROPERTY_COLUMNS = ["Length", "Mass", "Isoelectric_point", "GRAVY", "Aromaticity"]
+
+# Average mass of water, lost per peptide bond (as in Bio.SeqUtils.molecular_weight())
+WATER = 18.0153
+
+STOP = ord("*")
+
+# Byte values to upper case
+UPPER_CASE = np.arange(256, dtype=np.uint8)
+UPPER_CASE[ord("a") : ord("z") + 1] -= 32
+
+
+def residue_table(values):
+    """256-entry float table from a {letter: value} dictionary, NaN for other byte values."""
+    table = np.full(256, np.nan)
+    for letter, value in values.items():
+        table[ord(letter)] = value
+    return table
+
+
+MASS_TABLE = residue_table(IUPACData.protein_weights)
+GRAVY_TABLE = residue_table(ProtParamData.kd)
+AROMATIC_TABLE = residue_table({letter: 1.0 if letter in "FWY" else 0.0 for letter in IUPACData.protein_letters})
+AROMATIC_TABLE[np.isnan(AROMATIC_TABLE)] = 0.0
+
+
+def composition_matrix(store, start=0, end=None):
+    """Counts the residues (upper case, without '*') of a range of sequences of a store.
+
+    Args:
+        store (SequenceStore): The sequences.
+        start (int, optional): First sequence. Defaults to 0.
+        end (int, optional): End of the range (exclusive). Defaults to None (last sequence).
+
+    Returns:
+        numpy.ndarray: (sequences, 256) int64 count matrix, indexed by byte value.
+    """
+    end = len(store) if end is None else end
+    residues = UPPER_CASE[store.residues[store.offsets[start] : store.offsets[end]]]
+    rows = np.repeat(np.arange(end - start), np.diff(store.offsets[start : end + 1]))
+    counts = np.bincount(rows * 256 + residues, minlength=(end - start) * 256).reshape(end - start, 256)
+    counts[:, STOP] = 0
+    return counts
+
+
+def terminal_residues(store, start=0, end=None):
+    """First and last residue (upper case byte values, skipping '*') of a range of sequences, 0 for empty ones."""
+    end = len(store) if end is None else end
+    offsets = store.offsets[start : end + 1] - store.offsets[start]
+    residues = UPPER_CASE[store.residues[store.offsets[start] : store.offsets[end]]]
+
+    # Positions of the residues that are not '*', and the number of them before each sequence
+    kept = np.flatnonzero(residues != STOP)
+    before = np.searchsorted(kept, offsets)
+    counts = np.diff(before)
+
+    first = np.zeros(end - start, dtype=np.uint8)
+    last = np.zeros(end - start, dtype=np.uint8)
+    has_residues = counts > 0
+    first[has_residues] = residues[kept[before[:-1][has_residues]]]
+    last[has_residues] = residues[kept[before[1:][has_residues] - 1]]
+    return first, last
+
+
+def isoelectric_points(counts, first, last):
+    """Isoelectric points by the bisection of Bio.SeqUtils.IsoelectricPoint, for all sequences at once.
+
+    The bisection interval halves the same way for every sequence, so each step is evaluated on arrays
+    with the same operations, in the same order, as IsoelectricPoint.pi() for a single sequence.
+
+    Args:
+        counts (numpy.ndarray): Count matrix from composition_matrix().
+        first (numpy.ndarray): First residues from terminal_residues().
+        last (numpy.ndarray): Last residues from terminal_residues().
+
+    Returns:
+        numpy.ndarray: Isoelectric points.
+    """
+    n = len(counts)
+    n_terminal = residue_table(IsoelectricPoint.pKnterminal)[first]
+    c_terminal = residue_table(IsoelectricPoint.pKcterminal)[last]
+
+    positive = []
+    for residue, pK in IsoelectricPoint.positive_pKs.items():
+        if residue == "Nterm":
+            positive.append((np.ones(n), np.where(np.isnan(n_terminal), pK, n_terminal)))
+        else:
+            positive.append((counts[:, ord(residue)].astype(float), np.full(n, pK)))
+    negative = []
+    for residue, pK in IsoelectricPoint.negative_pKs.items():
+        if residue == "Cterm":
+            negative.append((np.ones(n), np.where(np.isnan(c_terminal), pK, c_terminal)))
+        else:
+            negative.append((counts[:, ord(residue)].astype(float), np.full(n, pK)))
+
+    pH = np.full(n, 7.775)
+    low, high = np.full(n, 4.05), np.full(n, 12.0)
+    active = high - low > 0.0001
+    while active.any():
+        positive_charge = np.zeros(n)
+        for content, pK in positive:
+            positive_charge += content * (1.0 / (10 ** (pH - pK) + 1.0))
+        negative_charge = np.zeros(n)
+        for content, pK in negative:
+            negative_charge += content * (1.0 / (10 ** (pK - pH) + 1.0))
+
+        above = positive_charge - negative_charge > 0.0
+        low = np.where(active & above, pH, low)
+        high = np.where(active & ~above, pH, high)
+        pH = np.where(active, (low + high) / 2, pH)
+        active = high - low > 0.0001
+    return pH
+
+
+def protein_properties(store, block_size=10_000):
+    """Calculates length, mass, isoelectric point, GRAVY and aromaticity of all sequences of a store.
+
+    Args:
+        store (SequenceStore): The sequences.
+        block_size (int, optional): Sequences per count matrix, bounding its memory. Defaults to 10,000.
+
+    Returns:
+        pandas.DataFrame: One row per sequence, the name in column 'Name1' and PROPERTY_COLUMNS.
+    """
+    blocks = []
+    for start in range(0, len(store), block_size):
+        end = min(start + block_size, len(store))
+        counts = composition_matrix(store, start, end)
+        first, last = terminal_residues(store, start, end)
+        lengths = counts.sum(axis=1)
+
+        # Letters outside of a table only make the sequences containing them NaN
+        with np.errstate(invalid="ignore", divide="ignore"):
+            present = counts > 0
+            mass = np.where(present, counts * MASS_TABLE, 0.0).sum(axis=1)
+            mass[(present & np.isnan(MASS_TABLE)).any(axis=1)] = np.nan
+            mass -= (lengths - 1) * WATER
+
+            gravy = np.where(present, counts * GRAVY_TABLE, 0.0).sum(axis=1)
+            gravy[(present & np.isnan(GRAVY_TABLE)).any(axis=1)] = np.nan
+            gravy /= lengths
+
+            aromaticity = counts @ AROMATIC_TABLE / lengths
+            pI = isoelectric_points(counts, first, last)
+
+        # Biopython gives an empty sequence the mass of water, and fails on the rest
+        empty = lengths == 0
+        gravy[empty], aromaticity[empty], pI[empty] = np.nan, np.nan, np.nan
+
+        blocks.append(
+            pd.DataFrame(
+                {
+                    "Name1": store.names[start:end],
+                    "Length": lengths,
+                    "Mass": mass,
+                    "Isoelectric_point": pI,
+                    "GRAVY": gravy,
+                    "Aromaticity": aromaticity,
+                }
+            )
+        )
+
+    if not blocks:
+        return pd.DataFrame(columns=["Name1"] + PROPERTY_COLUMNS)
+    return pd.concat(blocks, ignore_index=True)
@@ -2,19 +2,29 @@ import os
 import logging
 import tempfile
 import subprocess
-import csv
+import shutil
+import heapq
+import concurrent.futures as futures
+import pandas as pd
+from contextlib import contextmanager
 
+from scripts.blast_database_cache import cached_blast_database
+from scripts.table_io import table_path
+from scripts.table_io import write_table
 
 logger = logging.getLogger(__name__)
 
+# Columns of the blastp tabular output (-outfmt 6) and of the protein search results
+BLAST_COLUMNS = ["qseqid", "sseqid", "pident", "length", "mismatch", "gapopen", "qstart", "qend", "sstart", "send", "evalue", "bitscore"]
 
 
-def make_blast_protein_database(input_database):
+def make_blast_protein_database(input_database, output_dir=None):
     """
-    Creates the protein database for BLASTP - protein_blastp_search() in a temporary location.
+    Creates the protein database for BLASTP - protein_blastp_search() in output_dir, or a temporary location.
 
     Args:
         input_database (str): Location of the input FASTA file protein sequences.
+        output_dir (str, optional): Directory to create the database in. Defaults to None (a new temporary directory).
 
     Raises:
         FileNotFoundError: Input FASTA cannot be accessed.
@@ -32,9 +42,12 @@ def make_blast_protein_database(input_database):
     # Set database prefix
     output_db_name = os.path.splitext(os.path.basename(input_database))[0]
 
-    # Create a temporary directory for the database
-    temp_dir = tempfile.mkdtemp()
-    db_path = os.path.join(temp_dir, output_db_name)
+    # Create a temporary directory for the database, unless a location is given
+    if output_dir is None:
+        output_dir = tempfile.mkdtemp()
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+    db_path = os.path.join(output_dir, output_db_name)
 
     # Construct the makeblastdb command
     command = [
@@ -51,7 +64,7 @@ def make_blast_protein_database(input_database):
         # Log the output and error messages
         logger.info(result.stdout)
         
-        logger.info(f"Protein BLAST database created successfully in temporary directory + prefix: {db_path}")
+        logger.info(f"Protein BLAST database created successfully in directory + prefix: {db_path}")
 
         # Return the database path, without the suffix
         return db_path
@@ -62,63 +75,257 @@ def make_blast_protein_database(input_database):
     except Exception as e:
         logger.error(f"An unexpected error occurred: {e}")
         raise
-        
 
 
+@contextmanager
+def blast_protein_database(input_database, cache_dir=None, max_cache_size=None):
+    """Provides the BLAST protein database for input_database for the duration of the context.
+
+    With a cache_dir the database is taken from (or built into) the persistent cache, see
+    scripts.blast_database_cache. Without one it is built in a temporary directory that is removed afterwards.
+
+    Args:
+        input_database (str): Location of the input FASTA file protein sequences.
+        cache_dir (str, optional): Directory of the BLAST database cache. Defaults to None.
+        max_cache_size (int, optional): Size cap of the cache in bytes. Defaults to None (no cap).
+
+    Yields:
+        str: Location + prefix of BLAST protein database.
+    """
+    if cache_dir is not None:
+        with cached_blast_database(input_database, cache_dir, max_size=max_cache_size) as db_path:
+            yield db_path
+        return
+
+    temp_dir = tempfile.mkdtemp()
+    try:
+        yield make_blast_protein_database(input_database, temp_dir)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+
+def parse_blastp_tabular(lines, evalue_cutoff=None, max_hits_per_query=None):
+    """Parses blastp tabular output (-outfmt 6 with BLAST_COLUMNS) line by line, applying the filters during the parse.
 
-def protein_blastp_search(input_sequence, genome, output, input_database, threads):
+    blastp writes the hits of a query contiguously, so the top-N selection only has to hold the
+    hits of the current query. Rows are yielded in the order blastp wrote them.
+
+    Args:
+        lines (iterable): Lines of blastp output, e.g. an open pipe.
+        evalue_cutoff (float, optional): Only hits with an e-value strictly below the cutoff are kept. Defaults to None (no cutoff).
+        max_hits_per_query (int, optional): Keep at most this many hits (highest bitscore) per query. Defaults to None (all hits).
+
+    Yields:
+        list: Fields of a passing hit, in the order of BLAST_COLUMNS.
+    """
+    evalue_index = BLAST_COLUMNS.index("evalue")
+    bitscore_index = BLAST_COLUMNS.index("bitscore")
+
+    current_query = None
+    kept = []  # min-heap of (bitscore, -row_number, fields) for the current query
+
+    def flush():
+        # Emit the kept hits of a query in their original order
+        for _, _, fields in sorted(kept, key=lambda hit: -hit[1]):
+            yield fields
+        kept.clear()
+
+    for row_number, line in enumerate(lines):
+        line = line.rstrip("\n")
+        if not line or line.startswith("#"):
+            continue
+        fields = line.split("\t")
+
+        if evalue_cutoff is not None and not float(fields[evalue_index]) < evalue_cutoff:
+            continue
+
+        if max_hits_per_query is None:
+            yield fields
+            continue
+
+        if fields[0] != current_query:
+            yield from flush()
+            current_query = fields[0]
+
+        hit = (float(fields[bitscore_index]), -row_number, fields)
+        if len(kept) < max_hits_per_query:
+            heapq.heappush(kept, hit)
+        else:
+            heapq.heappushpop(kept, hit)
+
+    yield from flush()
+
+
+def split_fasta_by_residues(input_fasta, n_chunks, output_dir):
+    """Splits a FASTA file into at most n_chunks contiguous chunks with balanced total residue counts.
+
+    The records keep their order, so concatenating the chunks gives back the original file.
+
+    Args:
+        input_fasta (str): FASTA file to split.
+        n_chunks (int): Number of chunks to aim for.
+        output_dir (str): Directory to write the chunks to.
+
+    Returns:
+        list: Paths of the (non-empty) chunk files, in order.
+    """
+    records = []
+    with open(input_fasta, 'r') as f:
+        for line in f:
+            if line.startswith('>'):
+                records.append([line, 0])
+            elif records:
+                records[-1][0] += line
+                records[-1][1] += len(line.strip())
+
+    total = sum(residues for _, residues in records)
+    chunk_paths = []
+    chunk_file = None
+    cumulative = 0
+
+    for text, residues in records:
+        # Chunk i ends once the cumulative residue count passes (i + 1) / n_chunks of the total
+        if chunk_file is None or (len(chunk_paths) < n_chunks and cumulative >= total * len(chunk_paths) / n_chunks):
+            if chunk_file is not None:
+                chunk_file.close()
+            chunk_paths.append(os.path.join(output_dir, f'chunk_{len(chunk_paths):04d}.fasta'))
+            chunk_file = open(chunk_paths[-1], 'w')
+        chunk_file.write(text)
+        cumulative += residues
+
+    if chunk_file is not None:
+        chunk_file.close()
+
+    return chunk_paths
+
+
+def protein_blastp_search(input_sequence, genome, output, input_database, threads, db_cache_dir=None, db_cache_max_size=None, evalue_cutoff=None, max_hits_per_query=None, shards=1, protein_database=None, table_format='csv'):
     """Run BLASTP of the putative proteins against the predefined database.
 
     Args:
         input_sequence (str): Predicted proteins from the genome
         genome (str): Naming convention
-        output (str): Output directory
+        output (str): Output directory for the output_{genome}_protein_search result file, None to not write it
         input_database (str): Location of the input FASTA file protein sequences.
         threads (_type_): Number of threads for the search to use
+        db_cache_dir (str, optional): Directory of the BLAST database cache. Defaults to None (temporary database).
+        db_cache_max_size (int, optional): Size cap of the BLAST database cache in bytes. Defaults to None (no cap).
+        evalue_cutoff (float, optional): Only keep hits with an e-value below the cutoff. Defaults to None (no cutoff).
+        max_hits_per_query (int, optional): Only keep the best hits (by bitscore) of each query. Defaults to None (all hits).
+        shards (int, optional): Number of concurrent blastp processes to split the query proteins over, sharing the threads. 0 uses one shard per thread. Defaults to 1.
+        protein_database (str, optional): Location + prefix of an already prepared BLAST protein database for input_database. Defaults to None (prepared here).
+        table_format (str, optional): Format of the result file, a key of TABLE_FORMATS. Defaults to 'csv'.
+
+    Returns:
+        pandas.DataFrame: The passing hits, columns BLAST_COLUMNS, with attrs['complete'] as in _run_blastp().
     """
 
     logger.debug('Entering protein_blastp_search function')
 
-    # Get protein database
-    protein_database = make_blast_protein_database(input_database)
+    if shards <= 0:
+        shards = threads
+    shards = min(shards, threads)
+
+    if protein_database is not None:
+        hits = _run_blastp(input_sequence, genome, output, protein_database, threads, evalue_cutoff, max_hits_per_query, shards, table_format)
+    else:
+        # Get protein database
+        with blast_protein_database(input_database, db_cache_dir, db_cache_max_size) as protein_database:
+            hits = _run_blastp(input_sequence, genome, output, protein_database, threads, evalue_cutoff, max_hits_per_query, shards, table_format)
+
+    logger.debug('Exiting protein_blastp_search function')
+    return hits
+
+
+def _blastp_hits(query, protein_database, threads, evalue_cutoff=None, max_hits_per_query=None):
+    """Runs blastp on a query FASTA and yields the passing hits as they are parsed.
 
+    Raises:
+        subprocess.CalledProcessError: blastp exited with an error.
+    """
 
     # Generate the BLASTP command
     blastp_command = [
         'blastp',
         '-db', protein_database,
-        '-outfmt', '6 qseqid sseqid pident length mismatch gapopen qstart qend sstart send evalue bitscore',
-        '-query', input_sequence,
+        '-outfmt', '6 ' + ' '.join(BLAST_COLUMNS),
+        '-query', query,
         '-num_threads', str(threads)
     ]
 
-    output_csv_file = f'{output}/output_{genome}_protein_search.csv'
+    # Push the e-value cutoff down to blastp. The hits per query are left to the parser: -max_target_seqs keeps
+    # the first targets blastp finds, not the best ones
+    if evalue_cutoff is not None:
+        blastp_command += ['-evalue', str(evalue_cutoff)]
+
+    # stderr goes to a file, so that a chatty blastp can not block on a full pipe while stdout is read
+    with tempfile.TemporaryFile(mode='w+') as stderr_file:
+        with subprocess.Popen(blastp_command, stdout=subprocess.PIPE, stderr=stderr_file, text=True) as blastp:
+            yield from parse_blastp_tabular(blastp.stdout, evalue_cutoff, max_hits_per_query)
+
+        if blastp.returncode != 0:
+            stderr_file.seek(0)
+            raise subprocess.CalledProcessError(blastp.returncode, blastp_command, stderr=stderr_file.read())
+
+
+def blastp_table(rows):
+    """Creates the hit table (BLAST_COLUMNS) from parsed blastp rows, with numeric columns as numbers."""
+    table = pd.DataFrame(rows, columns=BLAST_COLUMNS)
+    for column in BLAST_COLUMNS[2:]:
+        table[column] = pd.to_numeric(table[column])
+    return table
+
+
+def _run_blastp(input_sequence, genome, output, protein_database, threads, evalue_cutoff=None, max_hits_per_query=None, shards=1, table_format='csv'):
+    """Runs blastp against an existing protein database and collects the passing hits as they are parsed.
 
-    ## Unclear what the subprocess.PIPE does
+    With shards > 1 the query FASTA is split into residue-balanced chunks that are searched by concurrent blastp
+    processes sharing the thread budget. Their hits are concatenated in chunk order, which is the order of a single run.
 
+    Returns:
+        pandas.DataFrame: The hits, columns BLAST_COLUMNS. Also written to the output_{genome}_protein_search result file in output, unless output is None.
+            attrs['complete'] is True when every blastp run finished, so that no hits is told apart from a failed search.
+    """
+
+    rows = []
+    complete = False
     try:
-        blast_results = subprocess.run(blastp_command, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-
-        # Split the output into lines and write to CSV file
-        with open(output_csv_file, 'w', newline='') as csvfile:
-            csvwriter = csv.writer(csvfile, delimiter=',')
-            # Write header
-            csvwriter.writerow(["qseqid", "sseqid", "pident", "length", "mismatch", "gapopen", "qstart", "qend", "sstart", "send", "evalue", "bitscore"])
-            # Write rows
-            for line in blast_results.stdout.strip().split('\n'):
-                csvwriter.writerow(line.split('\t'))
-        
-        ## Include in the -q flag
+        if shards <= 1:
+            rows = list(_blastp_hits(input_sequence, protein_database, threads, evalue_cutoff, max_hits_per_query))
+        else:
+            with tempfile.TemporaryDirectory() as shard_dir:
+                chunks = split_fasta_by_residues(input_sequence, shards, shard_dir)
+                shard_rows = []
+                if chunks:
+                    # The first threads % len(chunks) shards get one thread more, so that all threads are used
+                    threads_per_shard = [
+                        max(1, threads // len(chunks) + (number < threads % len(chunks))) for number in range(len(chunks))
+                    ]
+                    logger.info(f'Running blastp in {len(chunks)} shards with {", ".join(map(str, threads_per_shard))} threads')
 
-        # print(f"P-blast results saved to {output_csv_file}")
-        logger.info(f'pblast result saved in file: {output_csv_file}')
+                    with futures.ThreadPoolExecutor(max_workers=len(chunks)) as ex:
+                        shard_rows = list(ex.map(
+                            lambda chunk, chunk_threads: list(_blastp_hits(chunk, protein_database, chunk_threads, evalue_cutoff, max_hits_per_query)),
+                            chunks,
+                            threads_per_shard,
+                        ))
+
+                # Merge in chunk order
+                rows = [fields for shard in shard_rows for fields in shard]
+
+        logger.info(f'pblast result: {len(rows)} hits')
+        complete = True
     except subprocess.CalledProcessError as e:
         print("P-blast failed with the following error message:\n", e.stderr)
         logger.error(f'Error in rotein_blastp_search (subprocess): {e}')
     except Exception as ex:
         print("An error occurred:", ex)
-        print("BLASTP Output:\n", blast_results.stdout)
         logger.error(f'Error in rotein_blastp_search: {ex}')
     except KeyboardInterrupt:
         logger.warning("Data processing interrupted by user")
-    logger.debug('Exiting protein_blastp_search function')
\ No newline at end of file
+
+    hits = blastp_table(rows)
+    hits.attrs['complete'] = complete
+    if output is not None:
+        write_table(hits, table_path(f'{output}/output_{genome}_protein_search', table_format))
+    return hits
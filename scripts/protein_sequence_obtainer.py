@@ -1,69 +1,114 @@
 import pandas as pd
+import numpy as np
 import logging
 
+from scripts.sequence_store import SequenceStore, sequence_store
+from scripts.table_io import read_table
+
 logger = logging.getLogger(__name__)
 
+
+class SequencePairs:
+    """Sequence pairs to align, as index pairs into a query table and a target table.
+
+    The pairs are either an explicit list of (query index, target index) pairs, or, without one, the full
+    cross product of the tables in query-major order. The cross product is never materialized: pair k is
+    query k // len(targets) against target k % len(targets), and pairs are only turned into sequences
+    for the task that aligns them.
+
+    Iterating gives the pairs in the list format used before, [(name1, seq1), (name2, seq2)].
+
+    Args:
+        queries (SequenceStore): Query table, indexing gives (name, sequence) tuples.
+        targets (SequenceStore): Target table, indexing gives (name, sequence) tuples.
+        index_pairs (array-like, optional): (query index, target index) pairs. Defaults to None (cross product).
+    """
+
+    def __init__(self, queries, targets, index_pairs=None):
+        self.queries = queries if isinstance(queries, SequenceStore) else SequenceStore.from_records(queries)
+        self.targets = targets if isinstance(targets, SequenceStore) else SequenceStore.from_records(targets)
+        self.index_pairs = None if index_pairs is None else np.asarray(index_pairs, dtype=np.int64).reshape(-1, 2)
+
+    @classmethod
+    def from_list(cls, sequence_pairs):
+        """Wraps a list of sequence pairs, format [[(name1, seq1), (name2, seq_2)], ...]"""
+        queries = [pair[0] for pair in sequence_pairs]
+        targets = [pair[1] for pair in sequence_pairs]
+        index = np.arange(len(sequence_pairs))
+        return cls(queries, targets, np.column_stack([index, index]))
+
+    @property
+    def is_cross_product(self):
+        return self.index_pairs is None
+
+    def __len__(self):
+        if self.is_cross_product:
+            return len(self.queries) * len(self.targets)
+        return len(self.index_pairs)
+
+    def table_indices(self, pair_indices):
+        """Query and target table indices of pairs.
+
+        Args:
+            pair_indices (numpy.ndarray): Indices of pairs.
+
+        Returns:
+            tuple: (query indices, target indices) arrays.
+        """
+        pair_indices = np.asarray(pair_indices, dtype=np.int64)
+        if self.is_cross_product:
+            return np.divmod(pair_indices, len(self.targets))
+        return self.index_pairs[pair_indices, 0], self.index_pairs[pair_indices, 1]
+
+    def materialize(self, pair_indices):
+        """Turns pairs into the list format [[(name1, seq1), (name2, seq_2)], ...]"""
+        query_indices, target_indices = self.table_indices(pair_indices)
+        return [[self.queries[query], self.targets[target]] for query, target in zip(query_indices.tolist(), target_indices.tolist())]
+
+    def __getitem__(self, pair_index):
+        return self.materialize([pair_index])[0]
+
+    def __iter__(self):
+        # In blocks, so that a cross product is never held in memory at once
+        for start in range(0, len(self), 10_000):
+            yield from self.materialize(np.arange(start, min(start + 10_000, len(self))))
+
+
 def name_and_sequence_pair(input_genome_fasta, alignment_references, input_database_fasta, blastpsw=True):
+    """Pairs the candidate proteins with the database proteins to align.
+
+    Args:
+        input_genome_fasta (str or SequenceStore): FASTA file of the candidate proteins, or its sequence store.
+        alignment_references (pandas.DataFrame or str): Sorted blastp results (or their result file), the pairs to use with blastpsw.
+        input_database_fasta (str or SequenceStore): FASTA file of the database proteins, or its sequence store.
+        blastpsw (bool, optional): Pair according to the blastp hits. Otherwise pair every candidate with every database protein. Defaults to True.
+
+    Returns:
+        SequencePairs: The sequence pairs.
+    """
     
     logger.debug('Entering pname_and_sequence_pair function')
-    def parse_fasta_file(file_path): # Input, path to FASTA file you want to parse
-        logger.debug('Entering parse_fasta_file function')
-        try:
-            sequences = []
-            with open(file_path, 'r') as f:
-                lines = f.readlines()
-                current_name = None 
-                current_sequence = []
-                for line in lines:
-                    line = line.strip()
-                    if line.startswith('>'): # Adding the name of the protein
-                        if current_name is not None:
-                            sequences.append((current_name, ''.join(current_sequence)))
-                        current_name = line[1:].split()[0]  # Extracting the protein name
-                        current_sequence = []
-                    else:
-                        current_sequence.append(line) # Adding the protein sequence
-                # Append the last sequence
-                if current_name is not None and current_sequence:
-                    sequences.append((current_name, ''.join(current_sequence)))
-        except Exception as e:
-            logger.error(f'Error in parse_fasta_file function: {e}')
-        except KeyboardInterrupt:
-            logger.warning("Data processing interrupted by user")
-        logger.debug('Exiting parse_fasta_file function')
-        return sequences
+    final_list = SequencePairs([], [], [])
     try:
-         
-        fasta_file = input_genome_fasta
-        fasta_file2 = input_database_fasta
-
-        sequences = parse_fasta_file(fasta_file) # Parsing the genome 
-        sequences2 = parse_fasta_file(fasta_file2) # Parsing the database
 
-        df = pd.DataFrame(sequences, columns=['Protein Name', 'Sequence'])
-        df2 = pd.DataFrame(sequences2, columns=['Protein Name', 'Sequence'])
-        df.set_index('Protein Name', inplace=True)
-        df2.set_index('Protein Name', inplace=True)
+        # Sequence tables the pairs index into
+        queries = sequence_store(input_genome_fasta) # The genome
+        targets = sequence_store(input_database_fasta) # The database
 
-        final_list = [] 
-
-        sorted_output_df = pd.read_csv(alignment_references)
+        sorted_output_df = read_table(alignment_references)
 
         ## Output pairs based on the highest scoring results from BlastP
 
         if blastpsw:
             logger.info('Paring from BlastP results')
 
+            query_index = queries.index
+            target_index = targets.index
+            index_pairs = []
+
             try:
-                for i in range(len(sorted_output_df)):
-                    index_1 = sorted_output_df.iloc[i, 0]
-                    index_2 = sorted_output_df.iloc[i, 1]
- 
-                    seq_1 = df.loc[index_1, 'Sequence']
-                    seq_2 = df2.loc[index_2, 'Sequence']
-                    
-                    final_list.append([(index_1, str(seq_1)), (index_2, str(seq_2))])
-                
+                for index_1, index_2 in zip(sorted_output_df.iloc[:, 0], sorted_output_df.iloc[:, 1]):
+                    index_pairs.append((query_index[index_1], target_index[index_2]))
 
             except KeyError as e:
                 print(f"KeyError encountered: {e}")
@@ -72,27 +117,19 @@ def name_and_sequence_pair(input_genome_fasta, alignment_references, input_datab
             except Exception as e:
                 print(f"An unexpected error occurred: {e}")
 
+            final_list = SequencePairs(queries, targets, index_pairs)
+
 
         ## Outputs ALL possible pairs of genes and entries in the database.
         ## NOTE! This may be VERY 
         ## computationally intensive for larger databases and/or larger protein
-        ## candidate families.
+        ## candidate families. The pairs are generated lazily from the two
+        ## sequence tables, see SequencePairs.
 
         else:
             logger.info('Paring ALL possible combinations of genes in query and database')
 
-            final_list = []
-            try:
-                count = 0
-                for index_1, row_1 in df.iterrows():
-                    for index_2, row_2 in df2.iterrows():
-                        count += 1
-                        seq_1 = row_1['Sequence']
-                        seq_2 = row_2['Sequence']
-                        final_list.append([(index_1, str(seq_1)), (index_2, str(seq_2))])
-
-            except Exception as e:
-                print(f"An error occurred: {e}")
+            final_list = SequencePairs(queries, targets)
     
             
 
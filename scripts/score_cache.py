@@ -0,0 +1,138 @@
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def sequence_hash(sequence):
+    """128-bit BLAKE2b digest of a sequence, used as its key in the score cache."""
+    return hashlib.blake2b(sequence.encode(), digest_size=16).digest()
+
+
+def scoring_scheme(match, mismatch, gap_open, gap_extend, matrix_name):
+    """String identifying the scoring parameters of a Smith-Waterman score.
+
+    Args:
+        match (float): Score for match.
+        mismatch (float): Score for mismatch.
+        gap_open (float): Penalty for gap opening.
+        gap_extend (float): Penalty for gap extension.
+        matrix_name (str): Name of the substitution matrix, None without one.
+
+    Returns:
+        str: Scoring scheme, part of the cache key.
+    """
+    return f"match={match};mismatch={mismatch};gap_open={gap_open};gap_extend={gap_extend};matrix={matrix_name}"
+
+
+class ScoreCache:
+    """Persistent cache of Smith-Waterman scores in an SQLite file, shared between runs.
+
+    Scores are keyed on hashes of both sequences and the scoring scheme, so the same pair is found again
+    under different names, in other genomes or after a database refresh. The cache holds at most
+    max_entries scores; once exceeded, the least recently used ones are evicted.
+
+    Args:
+        path (str): Location of the SQLite file.
+        scheme (str): Scoring scheme of the scores looked up and stored, see scoring_scheme().
+        max_entries (int, optional): Size cap in number of scores. Defaults to None (no cap).
+    """
+
+    def __init__(self, path, scheme, max_entries=None):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self.path = path
+        self.scheme = scheme
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        # Workers store scores while the parent looks them up. A lookup reads and then updates last_used; in WAL
+        # mode a deferred transaction can not take the write lock after another process committed, and fails
+        # at once instead of waiting. Write transactions take the lock when they begin instead.
+        self.connection = sqlite3.connect(path, timeout=120, isolation_level="IMMEDIATE")
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS scores ("
+            "seq1 BLOB NOT NULL, seq2 BLOB NOT NULL, scheme TEXT NOT NULL, "
+            "score REAL NOT NULL, last_used REAL NOT NULL, "
+            "PRIMARY KEY (seq1, seq2, scheme)) WITHOUT ROWID"
+        )
+        self.connection.execute("CREATE INDEX IF NOT EXISTS scores_last_used ON scores (last_used)")
+        self.connection.commit()
+
+    def lookup(self, keys):
+        """Looks up the scores of (seq1_hash, seq2_hash) keys and marks the found ones as recently used.
+
+        Args:
+            keys (list): List of (seq1_hash, seq2_hash) tuples from sequence_hash().
+
+        Returns:
+            dict: Scores found in the cache, {(seq1_hash, seq2_hash): score}.
+        """
+        found = {}
+        if keys:
+            with self.connection:
+                self.connection.execute("CREATE TEMP TABLE IF NOT EXISTS wanted (seq1 BLOB, seq2 BLOB)")
+                self.connection.execute("DELETE FROM wanted")
+                self.connection.executemany("INSERT INTO wanted VALUES (?, ?)", keys)
+                rows = self.connection.execute(
+                    "SELECT scores.seq1, scores.seq2, scores.score FROM wanted "
+                    "JOIN scores ON scores.seq1 = wanted.seq1 AND scores.seq2 = wanted.seq2 AND scores.scheme = ?",
+                    (self.scheme,),
+                )
+                found = {(seq1, seq2): score for seq1, seq2, score in rows}
+
+                self.connection.executemany(
+                    "UPDATE scores SET last_used = ? WHERE seq1 = ? AND seq2 = ? AND scheme = ?",
+                    [(time.time(), seq1, seq2, self.scheme) for seq1, seq2 in found],
+                )
+
+        self.hits += sum(1 for key in keys if key in found)
+        self.misses += sum(1 for key in keys if key not in found)
+        return found
+
+    def store(self, scores):
+        """Stores new scores and evicts the least recently used ones beyond max_entries.
+
+        Args:
+            scores (dict): {(seq1_hash, seq2_hash): score}. NaN and None scores are skipped.
+        """
+        now = time.time()
+        rows = [
+            (seq1, seq2, self.scheme, float(score), now)
+            for (seq1, seq2), score in scores.items()
+            if score is not None and score == score
+        ]
+        with self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?)", rows)
+        if self.max_entries is not None:
+            self.evict(self.max_entries)
+
+    def evict(self, max_entries):
+        """Removes the least recently used scores until the cache holds at most max_entries.
+
+        Returns:
+            int: Number of evicted scores.
+        """
+        (count,) = self.connection.execute("SELECT COUNT(*) FROM scores").fetchone()
+        excess = count - max_entries
+        if excess <= 0:
+            return 0
+
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM scores WHERE (seq1, seq2, scheme) IN "
+                "(SELECT seq1, seq2, scheme FROM scores ORDER BY last_used LIMIT ?)",
+                (excess,),
+            )
+        logger.info(f"Evicted {excess} scores from the Smith-Waterman score cache")
+        return excess
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,255 @@
+import os
+import json
+import logging
+import tempfile
+import numpy as np
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from scripts.blast_database_cache import fasta_content_hash
+
+logger = logging.getLogger(__name__)
+
+# File layout of a saved store: MAGIC, the header length as uint64, a JSON header (number of sequences,
+# number of residues, names), zero padding to a multiple of 8 bytes, the offsets (int64) and the residues (uint8).
+MAGIC = b"CSSTORE1"
+
+
+class SequenceStore:
+    """Sequences of a FASTA file, parsed once into a compact array-backed store.
+
+    The residues of all sequences are concatenated into one uint8 buffer, sequence i being
+    residues[offsets[i]:offsets[i + 1]]. Names are the first word of the FASTA headers, and index maps
+    a name to the position of its first sequence. A store saved with save() is loaded memory-mapped.
+
+    Indexing a store with a position gives the (name, sequence) tuple, so it can be used where a list
+    of (name, sequence) tuples is expected.
+
+    Args:
+        names (list): Sequence names.
+        residues (numpy.ndarray): uint8 residue buffer.
+        offsets (numpy.ndarray): int64 start of each sequence in residues, plus the end of the last one.
+    """
+
+    def __init__(self, names, residues, offsets):
+        # File the store is memory-mapped from, see load()
+        self.path = None
+        self.names = list(names)
+        self.residues = residues
+        self.offsets = offsets
+        self.index = {}
+        for position, name in enumerate(self.names):
+            self.index.setdefault(name, position)
+
+    @classmethod
+    def from_records(cls, records):
+        """Creates a store from (name, sequence) tuples."""
+        names = [name for name, _ in records]
+        sequences = [sequence.encode() for _, sequence in records]
+        offsets = np.zeros(len(sequences) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(sequence) for sequence in sequences])
+        residues = np.frombuffer(b"".join(sequences), dtype=np.uint8)
+        return cls(names, residues, offsets)
+
+    @classmethod
+    def from_fasta(cls, fasta_path):
+        """Parses a FASTA file into a store.
+
+        Args:
+            fasta_path (str): Path to the FASTA file.
+
+        Returns:
+            SequenceStore: The sequences of the file, in file order.
+        """
+        records = []
+        with open(fasta_path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line.startswith(">"):
+                    records.append((line[1:].split()[0], []))
+                elif records:
+                    records[-1][1].append(line)
+        return cls.from_records([(name, "".join(sequence)) for name, sequence in records])
+
+    @classmethod
+    def from_buffer(cls, buffer):
+        """Creates a store on the bytes of a saved store, without copying the arrays.
+
+        Args:
+            buffer (numpy.ndarray): uint8 array with the content of a file written by save().
+
+        Returns:
+            SequenceStore: Store whose offsets and residues are views into buffer.
+        """
+        # Plain ndarray views, slicing a numpy.memmap is several times slower
+        buffer = np.asarray(buffer)
+        if buffer[: len(MAGIC)].tobytes() != MAGIC:
+            raise ValueError("not a sequence store")
+        header_length = int(buffer[len(MAGIC) : len(MAGIC) + 8].view(np.uint64)[0])
+        header = json.loads(buffer[len(MAGIC) + 8 : len(MAGIC) + 8 + header_length].tobytes())
+
+        start = _data_start(header_length)
+        n, n_residues = header["n_sequences"], header["n_residues"]
+        offsets = buffer[start : start + 8 * (n + 1)].view(np.int64)
+        residues = buffer[start + 8 * (n + 1) : start + 8 * (n + 1) + n_residues]
+        return cls(header["names"], residues, offsets)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Loads a store written by save().
+
+        Args:
+            path (str): Location of the store file.
+            mmap (bool, optional): Memory-map the file instead of reading it. Defaults to True.
+
+        Returns:
+            SequenceStore: The loaded store.
+        """
+        buffer = np.memmap(path, dtype=np.uint8, mode="r") if mmap else np.fromfile(path, dtype=np.uint8)
+        try:
+            store = cls.from_buffer(buffer)
+        except ValueError:
+            raise ValueError(f"{path} is not a sequence store")
+        if mmap:
+            store.path = path
+        return store
+
+    def save(self, path):
+        """Writes the store to a single file, atomically (written next to path, then renamed)."""
+        directory = os.path.dirname(path) or "."
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".sequence_store.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                self._write(f)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    def _write(self, f):
+        header = json.dumps(
+            {"n_sequences": len(self), "n_residues": int(self.offsets[-1]), "names": self.names}
+        ).encode()
+        f.write(MAGIC)
+        f.write(np.uint64(len(header)).tobytes())
+        f.write(header)
+        f.write(b"\0" * (_data_start(len(header)) - len(MAGIC) - 8 - len(header)))
+        f.write(np.ascontiguousarray(self.offsets, dtype=np.int64).tobytes())
+        f.write(np.ascontiguousarray(self.residues, dtype=np.uint8).tobytes())
+
+    @property
+    def lengths(self):
+        """Sequence lengths as an int64 array."""
+        return np.diff(self.offsets)
+
+    def encoded(self, position):
+        """Residues of a sequence as a uint8 array (a view into the buffer)."""
+        return self.residues[self.offsets[position] : self.offsets[position + 1]]
+
+    def sequence(self, position):
+        """Sequence at a position as a string."""
+        return self.encoded(position).tobytes().decode()
+
+    def get(self, name):
+        """Sequence of a name as a string, None if the name is not in the store."""
+        position = self.index.get(name)
+        return None if position is None else self.sequence(position)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, position):
+        return self.names[position], self.sequence(position)
+
+    def __iter__(self):
+        for position in range(len(self)):
+            yield self[position]
+
+
+def _data_start(header_length):
+    """Offset of the arrays in a store file, aligned to 8 bytes."""
+    return -(-(len(MAGIC) + 8 + header_length) // 8) * 8
+
+
+def sequence_store(fasta_path, store_dir=None):
+    """Returns the SequenceStore of a FASTA file, or the FASTA's store itself when given one.
+
+    With a store_dir the store is saved there, keyed on the content of the FASTA, and later calls load
+    it memory-mapped instead of parsing the FASTA again.
+
+    Args:
+        fasta_path (str or SequenceStore): FASTA file.
+        store_dir (str, optional): Directory of saved stores. Defaults to None (parse the FASTA).
+
+    Returns:
+        SequenceStore: The sequences of the FASTA file.
+    """
+    if isinstance(fasta_path, SequenceStore):
+        return fasta_path
+    if store_dir is None:
+        return SequenceStore.from_fasta(fasta_path)
+
+    path = os.path.join(store_dir, f"{fasta_content_hash(fasta_path)[:32]}.seqstore")
+    if os.path.exists(path):
+        logger.info(f"Loading sequence store {path} for {fasta_path}")
+        return SequenceStore.load(path)
+
+    os.makedirs(store_dir, exist_ok=True)
+    store = SequenceStore.from_fasta(fasta_path)
+    store.save(path)
+    logger.info(f"Saved sequence store {path} for {fasta_path}")
+    return SequenceStore.load(path)
+
+
+@contextmanager
+def shared_sequence_store(store):
+    """Makes a store available to worker processes as a memory-mapped file.
+
+    A store that is already memory-mapped from a file shares that file. Otherwise the store is saved to
+    a temporary file for the duration of the context. Workers open the file with attach_sequence_store(),
+    so the operating system shares its pages between the processes instead of each task pickling sequences.
+
+    Args:
+        store (SequenceStore): The store to share.
+
+    Yields:
+        str: Path of the store file, to pass to attach_sequence_store().
+    """
+    if store.path is not None:
+        yield store.path
+        return
+
+    fd, path = tempfile.mkstemp(prefix="chromosearch_sequences_", suffix=".seqstore")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            store._write(f)
+        yield path
+    finally:
+        try:
+            os.remove(path)
+        except OSError:
+            # Still mapped by a worker on platforms that do not allow removing open files
+            logger.warning(f"Could not remove shared sequence store {path}")
+
+
+# Stores attached in this (worker) process, most recently used last
+_attached_stores = OrderedDict()
+MAX_ATTACHED_STORES = 8
+
+
+def attach_sequence_store(path):
+    """Memory-maps a store shared with shared_sequence_store(), once per process.
+
+    Args:
+        path (str): Path yielded by shared_sequence_store().
+
+    Returns:
+        SequenceStore: The store.
+    """
+    store = _attached_stores.pop(path, None)
+    if store is None:
+        store = SequenceStore.load(path)
+    _attached_stores[path] = store
+    while len(_attached_stores) > MAX_ATTACHED_STORES:
+        _attached_stores.popitem(last=False)
+    return store
@@ -1,14 +1,37 @@
-import csv
+import io
+import os
+import time
+import heapq
 import logging
 import concurrent.futures as futures
-from functools import partial
-from itertools import islice
+import numpy as np
+import pandas as pd
+from functools import partial, lru_cache
 from Bio.Align import PairwiseAligner
 from Bio.Align import substitution_matrices
 
+from scripts.smith_waterman_numpy import scoring_table, smith_waterman_scores_by_query, smith_waterman_scores_one_to_many
+from scripts.score_cache import ScoreCache, scoring_scheme, sequence_hash
+from scripts.protein_sequence_obtainer import SequencePairs
+from scripts.sequence_store import shared_sequence_store, attach_sequence_store
+from scripts.table_io import BackgroundTableWriter, complete_lines_size, table_path, write_table
+
 logger = logging.getLogger(__name__)
 
-def sequence_pairs_smith_waterman(match, mismatch, gap_open, gap_extend, matrix, sequence_pairs):
+# Scoring engines for sequence_pairs_smith_waterman():
+# "biopython" - PairwiseAligner, score only (no traceback)
+# "numpy" - the vectorized engine in scripts/smith_waterman_numpy.py, same scores. Aligns each
+#           query against all of its targets in the batch at once.
+SW_ENGINES = ("biopython", "numpy")
+
+
+def substitution_matrix_name(matrix):
+    """Name of the substitution matrix used for the matrix argument, None for plain match/mismatch scores."""
+    # TO IMPLEMENT: SUPPORT OTHER MATRICES
+    return "BLOSUM62" if matrix else None
+
+
+def sequence_pairs_smith_waterman(match, mismatch, gap_open, gap_extend, matrix, sequence_pairs, engine="biopython"):
     """Basic funtion that takes a list of sequence_pairs and returns their names along with their scores. Used by smith_waterman_alignment().
 
     Args:
@@ -17,6 +40,7 @@ def sequence_pairs_smith_waterman(match, mismatch, gap_open, gap_extend, matrix,
         gap_open (_type_): Penalty for gap opening
         gap_extend (_type_): Penalty for gap extension
         sequence_pairs (_type_): List of sequence pairs, format [[(name1, seq1), (name2, seq_2)], ...]
+        engine (str, optional): Scoring engine, one of SW_ENGINES. Defaults to "biopython".
     Returns:
         list: List of dictionaries, each with the format {'Name1': name1, 'Name2': name2, 'Score': score}.
     """   
@@ -29,18 +53,31 @@ def sequence_pairs_smith_waterman(match, mismatch, gap_open, gap_extend, matrix,
     aligner.open_gap_score = gap_open   
     aligner.extend_gap_score = gap_extend 
 
-    # TO IMPLEMENT: SUPPORT OTHER MATRICES 
-    if matrix is not None:
-        aligner.substitution_matrix = substitution_matrices.load("BLOSUM62")
+    matrix_name = substitution_matrix_name(matrix)
+    if matrix_name is not None:
+        aligner.substitution_matrix = substitution_matrices.load(matrix_name)
+
+    if engine == "numpy":
+        table, valid = scoring_table(match, mismatch, aligner.substitution_matrix)
+        batched_scores = smith_waterman_scores_by_query(
+            [(seq1, seq2) for (_, seq1), (_, seq2) in sequence_pairs], table, gap_open, gap_extend, valid
+        )
+    elif engine != "biopython":
+        raise ValueError(f"Unknown Smith-Waterman engine: {engine}")
 
     # List of dirs to return
     results_list = []
 
-    for pair in sequence_pairs:
+    for index, pair in enumerate(sequence_pairs):
         (name1, seq1), (name2, seq2) = pair
         try:
-            best_alignment = aligner.align(seq1, seq2)[0]
-            score = best_alignment.score
+            if engine == "numpy":
+                score = float(batched_scores[index])
+                if score != score:
+                    raise ValueError("sequence contains letters not in the alphabet")
+            else:
+                # Only the score is used, so skip building the alignment and its traceback
+                score = aligner.score(seq1, seq2)
 
         except Exception as e:
             logger.error(f'Error in sequence_pair_smith_waterman(), for sequences {name1}, {name2}: {e}')
@@ -54,59 +91,571 @@ def sequence_pairs_smith_waterman(match, mismatch, gap_open, gap_extend, matrix,
     return results_list
 
 
-# NOTE: Changed from one pair = one process to batch processing
-def batch_sequence_pairs(sequence_pairs, threads):
-    """Creates the sequence pairs for the batch process
+@lru_cache(maxsize=8)
+def _aligner(match, mismatch, gap_open, gap_extend, matrix_name):
+    """Local PairwiseAligner for a scoring scheme, built once per (worker) process."""
+    aligner = PairwiseAligner()
+    aligner.mode = 'local'
+    aligner.match_score = match
+    aligner.mismatch_score = mismatch
+    aligner.open_gap_score = gap_open
+    aligner.extend_gap_score = gap_extend
+    if matrix_name is not None:
+        aligner.substitution_matrix = substitution_matrices.load(matrix_name)
+    return aligner
+
+
+@lru_cache(maxsize=8)
+def _worker_score_cache(path, scheme):
+    """Connection of a worker process to the score cache, opened once per process."""
+    return ScoreCache(path, scheme)
+
+
+def index_pairs_smith_waterman(match, mismatch, gap_open, gap_extend, matrix, queries, targets, index_pairs, engine="biopython", score_cache=None):
+    """Scores pairs given as indices into two shared sequence stores. Used by smith_waterman_alignment().
+
+    The stores are memory-mapped once per worker process (see attach_sequence_store()), so a task only
+    carries the index pairs instead of the sequences. With score_cache, the worker stores the scores in the
+    score cache itself, so that only the scores it returns have to come back (see top_k_per_query()).
 
     Args:
-        sequence_pairs (list): List of sequence pairs, format [[(name1, seq1), (name2, seq_2)], ...]
-        threads (int): Number of threads.
+        match (int): Score for match
+        mismatch (int): Score for mismatch
+        gap_open (int): Penalty for gap opening
+        gap_extend (int): Penalty for gap extension
+        matrix (bool): Use the BLOSUM62 substitution matrix.
+        queries (str): Path of the shared query store, from shared_sequence_store().
+        targets (str): Path of the shared target store, from shared_sequence_store().
+        index_pairs (numpy.ndarray): (query index, target index) rows.
+        engine (str, optional): Scoring engine, one of SW_ENGINES. Defaults to "biopython".
+        score_cache (tuple, optional): (path, scoring scheme) of the score cache to store the scores in. Defaults to None.
 
     Returns:
-        list: List of sequence pairs batches.
+        numpy.ndarray: Scores in the order of index_pairs, NaN for pairs that could not be scored.
     """
+    queries = attach_sequence_store(queries)
+    targets = attach_sequence_store(targets)
+    aligner = _aligner(match, mismatch, gap_open, gap_extend, substitution_matrix_name(matrix))
+    scores = np.full(len(index_pairs), np.nan)
+
+    if engine == "numpy":
+        table, valid = scoring_table(match, mismatch, aligner.substitution_matrix)
+        failed = np.zeros(len(index_pairs), dtype=bool)
+        order = np.argsort(index_pairs[:, 0], kind='stable')
+        boundaries = np.flatnonzero(np.diff(index_pairs[order, 0])) + 1
+        for rows in np.split(order, boundaries):
+            query = index_pairs[rows[0], 0]
+            try:
+                scores[rows] = smith_waterman_scores_one_to_many(
+                    queries.encoded(query), [targets.encoded(target) for target in index_pairs[rows, 1]], table, gap_open, gap_extend, valid
+                )
+            except ValueError as e:
+                failed[rows] = True
+                logger.error(f'Error in index_pairs_smith_waterman(), for sequence {queries.names[query]}: {e}')
+
+        # Targets with letters not in the alphabet
+        for row in np.flatnonzero(np.isnan(scores) & ~failed):
+            query, target = index_pairs[row]
+            logger.error(f'Error in index_pairs_smith_waterman(), no score for sequences {queries.names[query]}, {targets.names[target]}')
+    elif engine == "biopython":
+        for row, (query, target) in enumerate(index_pairs.tolist()):
+            try:
+                # Only the score is used, so skip building the alignment and its traceback
+                scores[row] = aligner.score(queries.sequence(query), targets.sequence(target))
+            except Exception as e:
+                logger.error(f'Error in index_pairs_smith_waterman(), for sequences {queries.names[query]}, {targets.names[target]}: {e}')
+    else:
+        raise ValueError(f"Unknown Smith-Waterman engine: {engine}")
+
+    if score_cache is not None:
+        hashes = {}
+        keys = [
+            (
+                hashes.setdefault((0, query), sequence_hash(queries.sequence(query))),
+                hashes.setdefault((1, target), sequence_hash(targets.sequence(target))),
+            )
+            for query, target in index_pairs.tolist()
+        ]
+        _worker_score_cache(*score_cache).store(dict(zip(keys, scores.tolist())))
 
-    CHUNK_SIZE = len(sequence_pairs) // threads
-    
-    # Uses generator for memory efficiency
-    it = iter(sequence_pairs)
-    while True:
-        batch = list(islice(it, CHUNK_SIZE))
-        if not batch:
-            return
-        yield batch
+    return scores
 
-def write_smith_waterman_results(output, gene_name, results_dictonaries):
-    """Function to write the results of the Waterman-Smith alignment into a .csv file.
+
+# NOTE: Changed from one pair = one process to batch processing, then to cost-balanced tasks
+def schedule_sequence_pairs(sequence_pairs, threads, tasks_per_worker=8):
+    """Splits the sequence pairs into small tasks of about equal alignment cost, longest first.
+
+    The cost of a pair is estimated as len(seq1) * len(seq2). Pairs are grouped by query, so a task
+    keeps the pairs of a query together (which the numpy engine aligns at once), and groups costing more
+    than the target are split. The target cost gives about tasks_per_worker tasks per worker, so that
+    the pool can hand out the remaining tasks to whichever worker is free.
+
+    Tasks are generated lazily. For a cross product (all-vs-all mode) the queries are visited longest
+    first and only the task being generated is held in memory.
 
     Args:
-        output (str): Output file location.
-        gene_name (str): Naming prefix for the results.
-        results_dir (): List of dictionaries to write out.
+        sequence_pairs (SequencePairs): The sequence pairs.
+        threads (int): Number of workers.
+        tasks_per_worker (int, optional): Aimed number of tasks per worker. Defaults to 8.
+
+    Yields:
+        numpy.ndarray: Indices of the pairs of a task.
     """
+    if len(sequence_pairs) == 0:
+        return
 
-    with open(f'{output}/output_{gene_name}_smith_waterman.csv', 'w', newline='') as csvfile:
-        
-        try:
-            fieldnames = ['Name1', 'Name2', 'Score']
-            writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-            writer.writeheader()
-
-            # Write all results
-            for result in results_dictonaries:
-                writer.writerow(result)
-        
-        except Exception as e:
-            logger.error(f'Error in function write_smith_waterman_results(): {e}')
+    query_lengths = sequence_pairs.queries.lengths
+    target_lengths = sequence_pairs.targets.lengths
+
+    if sequence_pairs.is_cross_product:
+        total_cost = query_lengths.sum() * target_lengths.sum()
+        target_cost = max(1, total_cost / (max(1, threads) * tasks_per_worker))
+        n_targets = len(target_lengths)
+
+        for query in np.argsort(-query_lengths, kind='stable'):
+            # Consecutive targets, cut where the cumulative cost passes a multiple of the target cost
+            cumulative = np.cumsum(target_lengths * query_lengths[query])
+            cuts = np.searchsorted(cumulative, np.arange(target_cost, cumulative[-1], target_cost), side='left') + 1
+            for start, end in zip(np.r_[0, cuts], np.r_[cuts, n_targets]):
+                if end > start:
+                    yield np.arange(query * n_targets + start, query * n_targets + end)
+        return
+
+    query_indices, target_indices = sequence_pairs.table_indices(np.arange(len(sequence_pairs)))
+    costs = query_lengths[query_indices] * target_lengths[target_indices]
+    target_cost = max(1, costs.sum() / (max(1, threads) * tasks_per_worker))
+
+    tasks = []
+    order = np.argsort(query_indices, kind='stable')
+    boundaries = np.flatnonzero(np.diff(query_indices[order])) + 1
+    for indices in np.split(order, boundaries):
+        task, task_cost = [], 0
+        for index in indices.tolist():
+            task.append(index)
+            task_cost += costs[index]
+            if task_cost >= target_cost:
+                tasks.append((task_cost, task))
+                task, task_cost = [], 0
+        if task:
+            tasks.append((task_cost, task))
+
+    tasks.sort(key=lambda task: -task[0])
+    for _, task in tasks:
+        yield np.array(task, dtype=np.int64)
+
+
+def top_k_per_query(function, top_k, index_pairs):
+    """Runs function on a task in a worker and only returns the top_k scores of each query of the task.
+
+    Ties are broken by the row order, pairs that could not be scored (NaN) are always returned.
+
+    Args:
+        function (callable): Function taking a (query index, target index) array and returning the scores of its rows, see index_pairs_smith_waterman().
+        top_k (int): Number of scores kept per query.
+        index_pairs (numpy.ndarray): (query index, target index) rows.
+
+    Returns:
+        tuple: (positions of the kept rows in index_pairs, their scores)
+    """
+    return top_k_rows(index_pairs, function(index_pairs), top_k)
+
+
+def top_k_rows(index_pairs, scores, top_k):
+    """The top_k scores of each query among scored rows, see top_k_per_query().
+
+    Returns:
+        tuple: (positions of the kept rows in index_pairs, their scores)
+    """
+    failed = np.isnan(scores)
+
+    # By query, then best score first, then row order
+    order = np.lexsort((np.arange(len(scores)), -np.where(failed, -np.inf, scores), index_pairs[:, 0]))
+    queries = index_pairs[order, 0]
+    group_starts = np.r_[0, np.flatnonzero(np.diff(queries)) + 1]
+    ranks = np.arange(len(order)) - np.repeat(group_starts, np.diff(np.r_[group_starts, len(order)]))
+    kept = order[(ranks < top_k) | failed[order]]
+    return kept, scores[kept]
+
+
+class TopScores:
+    """The top_k scores of each query, in bounded heaps that are merged as the tasks of run_scheduled_pairs() finish.
+
+    Ties are broken by the pair order, so the kept pairs are those a stable sort on the score would put first.
+    Pairs that could not be scored (NaN) are only kept for queries with fewer than top_k scores.
+
+    Args:
+        top_k (int): Number of scores kept per query.
+    """
+
+    def __init__(self, top_k):
+        self.top_k = top_k
+        self.heaps = {}
+        self.failed = {}
+        # Number of pairs of each query that came back, scored or not
+        self.counts = {}
+        self.incomplete = []
+
+    def count(self, query_indices):
+        """Counts the pairs of a task, also those whose scores were dropped in the worker."""
+        queries, counts = np.unique(query_indices, return_counts=True)
+        for query, n_pairs in zip(queries.tolist(), counts.tolist()):
+            self.counts[query] = self.counts.get(query, 0) + n_pairs
+
+    def push(self, pair_indices, query_indices, scores):
+        """Merges scored pairs into the heaps of their queries."""
+        for pair, query, score in zip(pair_indices.tolist(), query_indices.tolist(), scores.tolist()):
+            if np.isnan(score):
+                failed = self.failed.setdefault(query, [])
+                if len(failed) < self.top_k:
+                    failed.append(pair)
+                continue
+
+            # The heap root is the worst kept pair: lowest score, and of equal scores the latest pair
+            heap = self.heaps.setdefault(query, [])
+            if len(heap) < self.top_k:
+                heapq.heappush(heap, (score, -pair))
+            elif (score, -pair) > heap[0]:
+                heapq.heapreplace(heap, (score, -pair))
+
+    def mark_incomplete(self, queries, n_pairs, first_pairs):
+        """Adds a pair without a score for each query of which fewer than n_pairs pairs came back, see query_pair_counts()."""
+        for query, expected, first_pair in zip(queries.tolist(), n_pairs.tolist(), first_pairs.tolist()):
+            if self.counts.get(query, 0) < expected:
+                self.incomplete.append(first_pair)
+
+    def pairs(self):
+        """The kept pairs, best first, then the pairs without a score.
+
+        Returns:
+            tuple: (pair indices, scores) arrays.
+        """
+        kept = sorted((-score, -negative_pair) for heap in self.heaps.values() for score, negative_pair in heap)
+        failed = sorted(
+            set(self.incomplete).union(
+                pair
+                for query, pairs in self.failed.items()
+                for pair in pairs[: max(0, self.top_k - len(self.heaps.get(query, ())))]
+            )
+        )
+        pair_indices = np.array([pair for _, pair in kept] + failed, dtype=np.int64)
+        scores = np.array([-score for score, _ in kept] + [np.nan] * len(failed), dtype=np.float64)
+        return pair_indices, scores
+
+
+def query_pair_counts(sequence_pairs):
+    """Queries of sequence_pairs with their number of pairs and their first pair.
+
+    Returns:
+        tuple: (query indices, numbers of pairs, first pair indices) arrays.
+    """
+    if sequence_pairs.is_cross_product:
+        queries = np.arange(len(sequence_pairs.queries))
+        n_targets = len(sequence_pairs.targets)
+        return queries, np.full(len(queries), n_targets), queries * n_targets
+    queries, first_pairs, n_pairs = np.unique(sequence_pairs.index_pairs[:, 0], return_index=True, return_counts=True)
+    return queries, n_pairs, first_pairs
+
+
+def timed_task(function, index_pairs):
+    """Runs function on a task in a worker, returning (worker pid, busy seconds, results)."""
+    start = time.perf_counter()
+    results = function(index_pairs)
+    return os.getpid(), time.perf_counter() - start, results
+
+
+def run_scheduled_pairs(executor, function, sequence_pairs, threads, cache=None, max_in_flight=None, top_scores=None, writer=None, workers_store_scores=False, resumed=None):
+    """Runs function over cost-balanced tasks of sequence_pairs in executor and reports the worker utilization.
+
+    Tasks are generated lazily and fed to the pool through a bounded window of max_in_flight tasks; the
+    pool hands each one to the next free worker. A task is a (query index, target index) array, the
+    workers read the sequences from the shared stores, and the scores are collected in one array.
+    With top_scores, the workers only return the best scores of each task, which are merged into top_scores
+    as the tasks finish, and no array of all scores is made. With a cache as well, the workers have to store
+    the scores in the cache themselves (workers_store_scores, see index_pairs_smith_waterman()).
+
+    Results are collected in the order the tasks complete. With a writer, the scores of each task are also
+    appended to its file as they arrive, so they are on disk when the run is interrupted. The resumed pairs
+    of such a file (see resumed_pairs()) are kept as they are and not scheduled again.
 
-    return
+    Args:
+        executor (concurrent.futures.Executor): Pool to run the tasks in.
+        function (callable): Function taking a (query index, target index) array and returning the scores of its rows, see index_pairs_smith_waterman().
+        sequence_pairs (SequencePairs): The sequence pairs.
+        threads (int): Number of workers.
+        cache (ScoreCache, optional): Score cache consulted before a task is submitted, and updated with its results. Defaults to None.
+        max_in_flight (int, optional): Number of tasks submitted at once. Defaults to None (2 per worker).
+        top_scores (TopScores, optional): Keeps the top scores of each query instead of all scores. Defaults to None.
+        writer (BackgroundTableWriter, optional): Writer of the partial results, columns PARTIAL_COLUMNS. Defaults to None.
+        workers_store_scores (bool, optional): function stores its scores in the cache, instead of this process. Defaults to False.
+        resumed (tuple, optional): (pair indices, scores) arrays of pairs done by an earlier run, pair indices sorted. Defaults to None.
+
+    Returns:
+        numpy.ndarray: Scores in the order of sequence_pairs, NaN for failed pairs. None with top_scores.
+    """
+    if max_in_flight is None:
+        max_in_flight = 2 * max(1, threads)
+
+    scores = None
+    if top_scores is None:
+        scores = np.full(len(sequence_pairs), np.nan)
+    if top_scores is not None:
+        if cache is not None and not workers_store_scores:
+            raise ValueError("Keeping the top scores with a score cache needs workers that store their scores")
+        function = partial(top_k_per_query, function, top_scores.top_k)
+
+    if writer is not None:
+        query_names = np.array(sequence_pairs.queries.names, dtype=object)
+        target_names = np.array(sequence_pairs.targets.names, dtype=object)
+
+    def keep(task, task_scores, write=True):
+        query_indices, target_indices = sequence_pairs.table_indices(task)
+        if top_scores is None:
+            scores[task] = task_scores
+        else:
+            top_scores.push(task, query_indices, task_scores)
+        if writer is not None and write:
+            writer.append(pd.DataFrame({
+                'Pair': task,
+                'Name1': query_names[query_indices],
+                'Name2': target_names[target_indices],
+                'Score': task_scores,
+            }))
+    busy_per_worker = {}
+    running = {}
+    hashes = {}
+    n_tasks = 0
+    start = time.perf_counter()
+
+    def collect(done):
+        for future in done:
+            task, keys = running.pop(future)
+            pid, busy, task_scores = future.result()
+            busy_per_worker[pid] = busy_per_worker.get(pid, 0.0) + busy
+            if cache is not None and not workers_store_scores:
+                cache.store(dict(zip(keys, task_scores.tolist())))
+            if top_scores is not None:
+                top_scores.count(sequence_pairs.table_indices(task)[0])
+                # Only the kept rows of the task came back
+                positions, task_scores = task_scores
+                task = task[positions]
+            keep(task, task_scores)
+
+    if resumed is not None:
+        resumed_indices, resumed_scores = resumed
+        if top_scores is not None:
+            top_scores.count(sequence_pairs.table_indices(resumed_indices)[0])
+        # Already in the file
+        keep(resumed_indices, resumed_scores, write=False)
+
+    def sequence_hashes(table, indices):
+        return [hashes.setdefault((id(table), index), sequence_hash(table.sequence(index))) for index in indices]
+
+    for task in schedule_sequence_pairs(sequence_pairs, threads):
+        if resumed is not None and len(resumed_indices):
+            positions = np.minimum(np.searchsorted(resumed_indices, task), len(resumed_indices) - 1)
+            task = task[resumed_indices[positions] != task]
+            if not len(task):
+                continue
+
+        index_pairs = np.column_stack(sequence_pairs.table_indices(task))
+        keys = None
+
+        # Only pairs that are not in the score cache go to the workers
+        if cache is not None:
+            keys = list(zip(
+                sequence_hashes(sequence_pairs.queries, index_pairs[:, 0].tolist()),
+                sequence_hashes(sequence_pairs.targets, index_pairs[:, 1].tolist()),
+            ))
+            cached_scores = cache.lookup(keys)
+            missing = [position for position, key in enumerate(keys) if key not in cached_scores]
+            cached = [position for position, key in enumerate(keys) if key in cached_scores]
+            if cached:
+                cached_task = task[cached]
+                task_scores = np.array([cached_scores[keys[position]] for position in cached], dtype=np.float64)
+                if top_scores is not None:
+                    top_scores.count(index_pairs[cached, 0])
+                    positions, task_scores = top_k_rows(index_pairs[cached], task_scores, top_scores.top_k)
+                    cached_task = cached_task[positions]
+                keep(cached_task, task_scores)
+            task = task[missing]
+            index_pairs = index_pairs[missing]
+            keys = [keys[position] for position in missing]
+            if not missing:
+                continue
+
+        running[executor.submit(timed_task, function, index_pairs)] = (task, keys)
+        n_tasks += 1
+
+        if len(running) >= max_in_flight:
+            done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+            collect(done)
+
+    collect(list(running))
+
+    if workers_store_scores and cache.max_entries is not None:
+        cache.evict(cache.max_entries)
+
+    wall = time.perf_counter() - start
+    if busy_per_worker and wall > 0:
+        utilization = {pid: busy / wall for pid, busy in busy_per_worker.items()}
+        print(
+            f"Smith-Waterman: {n_tasks} tasks on {len(utilization)} workers in {wall:.1f} s, "
+            f"worker utilization min {min(utilization.values()):.0%}, "
+            f"mean {sum(utilization.values()) / len(utilization):.0%}, max {max(utilization.values()):.0%}"
+        )
+        for pid, worker_utilization in sorted(utilization.items()):
+            logger.info(f'Smith-Waterman worker {pid}: busy {busy_per_worker[pid]:.2f} s of {wall:.2f} s ({worker_utilization:.0%})')
+
+    return scores
+
+
+# Columns of the partial results file of smith_waterman_alignment(), Pair being the index of the pair
+PARTIAL_COLUMNS = ['Pair', 'Name1', 'Name2', 'Score']
+
+
+def read_partial_results(partial_output):
+    """Reads a partial results file of smith_waterman_alignment() up to its last complete line.
+
+    Returns:
+        pandas.DataFrame: Columns PARTIAL_COLUMNS, one row per pair, in pair order.
+    """
+    with open(partial_output, 'rb') as f:
+        size = complete_lines_size(f)
+        f.seek(0)
+        content = f.read(size)
+
+    partial = pd.read_csv(io.BytesIO(content), dtype={'Pair': np.int64, 'Name1': str, 'Name2': str, 'Score': np.float64})
+    return partial.drop_duplicates(subset='Pair').sort_values('Pair', kind='stable').reset_index(drop=True)
+
+
+def resumed_pairs(partial_output, sequence_pairs):
+    """Done pairs of a partial results file of an earlier run over the same sequence pairs.
+
+    Pairs without a score are done too: a pair that comes back without one can never be scored (e.g. letters
+    outside of the substitution matrix), the pairs of an interrupted task never reach the file.
+
+    Raises:
+        ValueError: The file holds pairs that are not in sequence_pairs.
+
+    Returns:
+        tuple: (pair indices, scores) arrays, in pair order.
+    """
+    partial = read_partial_results(partial_output)
+    pair_indices = partial['Pair'].to_numpy()
 
-def smith_waterman_alignment(output, sequence_pairs, gene_name, match=3, mismatch=-1, gap_open=-10, gap_extend=-4, matrix=True, threads= 1):
+    matching = len(pair_indices) == 0 or (pair_indices.min() >= 0 and pair_indices.max() < len(sequence_pairs))
+    if matching:
+        query_indices, target_indices = sequence_pairs.table_indices(pair_indices)
+        matching = (
+            np.array_equal(np.array(sequence_pairs.queries.names, dtype=object)[query_indices], partial['Name1'].to_numpy())
+            and np.array_equal(np.array(sequence_pairs.targets.names, dtype=object)[target_indices], partial['Name2'].to_numpy())
+        )
+    if not matching:
+        raise ValueError(f"Partial results {partial_output} are of other sequence pairs, remove the file to start over")
+
+    return pair_indices, partial['Score'].to_numpy()
+
+
+def order_partial_results(partial_output, top_k=None):
+    """Final ordering step for a partial results file of smith_waterman_alignment(), e.g. of an interrupted run.
+
+    The file holds the scores in the order the tasks completed. A last line cut off by the interruption is
+    skipped.
+
+    Args:
+        partial_output (str): Location of the partial results file.
+        top_k (int, optional): Keep the top_k scores of each query, best first, as smith_waterman_alignment() does. Defaults to None (all scores in pair order).
+
+    Returns:
+        pandas.DataFrame: Columns Name1, Name2 and Score.
+    """
+    partial = read_partial_results(partial_output)
+    if top_k is not None:
+        partial = partial.sort_values('Score', ascending=False, kind='stable').groupby('Name1', sort=False).head(top_k)
+    return partial[['Name1', 'Name2', 'Score']].reset_index(drop=True)
+
+
+def smith_waterman_table(sequence_pairs, scores, pair_indices=None):
+    """Creates the results table (Name1, Name2, Score) of the pairs at pair_indices, of all pairs in order without."""
+    if pair_indices is None:
+        pair_indices = np.arange(len(sequence_pairs))
+    query_indices, target_indices = sequence_pairs.table_indices(pair_indices)
+    return pd.DataFrame({
+        'Name1': np.array(sequence_pairs.queries.names, dtype=object)[query_indices],
+        'Name2': np.array(sequence_pairs.targets.names, dtype=object)[target_indices],
+        'Score': scores,
+    })
+
+
+def smith_waterman_alignment(output, sequence_pairs, gene_name, match=3, mismatch=-1, gap_open=-10, gap_extend=-4, matrix=True, threads= 1, executor=None, engine="biopython", score_cache=None, score_cache_max_entries=None, table_format="csv", top_k=None, partial_output=None):
+    """Aligns all sequence pairs in a process pool and returns their scores, also written to the output_{gene_name}_smith_waterman result file.
+
+    With top_k, only the top_k scores of each query are kept, reduced in the workers and merged as the tasks
+    finish (see TopScores), so the scores of all pairs are never held at once. With top_k=1 this is the
+    dereplicated table of the best hit of each query.
+
+    With partial_output, the scores are appended to that CSV file by a background writer as the tasks
+    complete (with top_k, the top_k scores of each query of a task), pairs that can not be scored included.
+    The file is removed once every task came back, and kept when the run fails or is interrupted. A run finding the file resumes from it: its pairs
+    are not aligned again, and it is appended to. The pairs of a task dropped by top_k are aligned again,
+    unless they are in the score cache. See order_partial_results() for the scores of a file.
+
+    Args:
+        output (str): Output directory, None to not write the scores to a file.
+        sequence_pairs (SequencePairs): The sequence pairs. A list of sequence pairs, format [[(name1, seq1), (name2, seq_2)], ...] is accepted too.
+        gene_name (str): Naming prefix for the results.
+        match (int, optional): Score for match. Defaults to 3.
+        mismatch (int, optional): Score for mismatch. Defaults to -1.
+        gap_open (int, optional): Penalty for gap opening. Defaults to -10.
+        gap_extend (int, optional): Penalty for gap extension. Defaults to -4.
+        matrix (bool, optional): Use the BLOSUM62 substitution matrix. Defaults to True.
+        threads (int, optional): Number of threads. Defaults to 1.
+        executor (concurrent.futures.Executor, optional): Pool to run the batches in, e.g. one shared between genomes. Defaults to None (a new ProcessPoolExecutor).
+        engine (str, optional): Scoring engine, one of SW_ENGINES. Defaults to "biopython".
+        score_cache (str, optional): Location of the persistent score cache (SQLite), consulted before aligning. Defaults to None (no cache).
+        score_cache_max_entries (int, optional): Size cap of the score cache in number of scores. Defaults to None (no cap).
+        table_format (str, optional): Format of the result file, a key of TABLE_FORMATS. Defaults to "csv".
+        top_k (int, optional): Number of scores kept per query. Defaults to None (all scores).
+        partial_output (str, optional): Location of the partial results file, only to be shared by runs over the same sequence pairs and settings. Defaults to None (no partial results).
+
+    Raises:
+        ValueError: partial_output holds pairs that are not in sequence_pairs, see resumed_pairs().
+
+    Returns:
+        pandas.DataFrame: The scores, columns Name1, Name2 and Score, in the order of sequence_pairs. With top_k, best score first, ties in the order of sequence_pairs.
+            attrs['complete'] is True when every task came back, so that pairs that can not be scored (NaN, e.g. letters outside of the substitution matrix) are told apart from a failed or interrupted run.
+    """
 
     logger.debug('Entering smith_waterman_alignment function')
 
-    result_to_write = []
+    if not isinstance(sequence_pairs, SequencePairs):
+        sequence_pairs = SequencePairs.from_list(sequence_pairs)
+
+    scores = np.full(len(sequence_pairs), np.nan) if top_k is None else None
+    top_scores = TopScores(top_k) if top_k is not None else None
+    cache = None
+    writer = None
+    resumed = None
+    # Whether every task came back, whatever the scores
+    complete = False
+
+    # Raised to the caller, a partial results file of other pairs is not overwritten
+    if partial_output is not None and os.path.exists(partial_output):
+        resumed = resumed_pairs(partial_output, sequence_pairs)
+        print(f"Resuming Smith-Waterman from {partial_output}, {len(resumed[0])} pairs already done")
+        logger.info(f'Resuming Smith-Waterman from file: {partial_output}, {len(resumed[0])} pairs already done')
+
     try:
+        if partial_output is not None:
+            writer = BackgroundTableWriter(partial_output, PARTIAL_COLUMNS, append=True)
+
+        if score_cache is not None:
+            cache = ScoreCache(
+                score_cache,
+                scoring_scheme(match, mismatch, gap_open, gap_extend, substitution_matrix_name(matrix)),
+                score_cache_max_entries,
+            )
+
         # # Single-threaded mode
         # if threads == 1:
         #     logger.debug('Entered single-threaded mode...')
@@ -115,14 +664,29 @@ def smith_waterman_alignment(output, sequence_pairs, gene_name, match=3, mismatc
         # else:
         # logger.debug('Entered multi-threaded mode...')
 
-        # Set the first arguments for the function as static, and map to the batch sequence pairs
-        partial_sequence_pair_smith_waterman = partial(sequence_pairs_smith_waterman, match, mismatch, gap_open, gap_extend, matrix)
-        with futures.ProcessPoolExecutor() as ex:
-            result = list(ex.map(partial_sequence_pair_smith_waterman, batch_sequence_pairs(sequence_pairs, threads)))
-        
-        # flatten result list of lists of dictionaries
-        # Could retain use of a generator if memory is a problem - Unlikely
-        result_to_write = [item for sublist in result for item in sublist]
+        # The sequences are shared with the workers through memory-mapped stores, the tasks carry index pairs
+        with shared_sequence_store(sequence_pairs.queries) as queries, shared_sequence_store(sequence_pairs.targets) as targets:
+
+            # Set the first arguments for the function as static, and map to the scheduled tasks
+            # With top_k the workers only return the best scores, so they store all scores in the cache themselves
+            workers_store_scores = cache is not None and top_scores is not None
+            partial_index_pairs_smith_waterman = partial(
+                index_pairs_smith_waterman, match, mismatch, gap_open, gap_extend, matrix, queries, targets, engine=engine,
+                score_cache=(cache.path, cache.scheme) if workers_store_scores else None,
+            )
+            if len(sequence_pairs) == 0:
+                pass
+            elif executor is not None:
+                scores = run_scheduled_pairs(executor, partial_index_pairs_smith_waterman, sequence_pairs, threads, cache, top_scores=top_scores, writer=writer, workers_store_scores=workers_store_scores, resumed=resumed)
+            else:
+                with futures.ProcessPoolExecutor(max_workers=threads) as ex:
+                    scores = run_scheduled_pairs(ex, partial_index_pairs_smith_waterman, sequence_pairs, threads, cache, top_scores=top_scores, writer=writer, workers_store_scores=workers_store_scores, resumed=resumed)
+
+        complete = True
+
+        if cache is not None:
+            print(f"Smith-Waterman score cache: {cache.hits} hits, {cache.misses} misses")
+            logger.info(f'Smith-Waterman score cache {score_cache}: {cache.hits} hits, {cache.misses} misses')
 
     except Exception as e:
         logger.error(f'Error in smith_waterman_alignment function: {e}')
@@ -130,9 +694,35 @@ def smith_waterman_alignment(output, sequence_pairs, gene_name, match=3, mismatc
     except KeyboardInterrupt:
         logger.warning("Data processing interrupted by user")
 
+    finally:
+        if cache is not None:
+            cache.close()
+        if writer is not None:
+            try:
+                writer.close()
+            except Exception as e:
+                logger.error(f'Error writing the partial Smith-Waterman results: {e}')
+
     logger.debug("Waterman-Smith finished, writing results...")
 
+    if top_scores is None:
+        results = smith_waterman_table(sequence_pairs, scores)
+    else:
+        # Queries with pairs that did not come back (failed or interrupted) get a NaN row
+        top_scores.mark_incomplete(*query_pair_counts(sequence_pairs))
+        pair_indices, scores = top_scores.pairs()
+        results = smith_waterman_table(sequence_pairs, scores, pair_indices)
+
+    if partial_output is not None and os.path.exists(partial_output):
+        if not complete:
+            print(f"Smith-Waterman did not finish, the scores so far are kept in {partial_output}")
+            logger.warning(f'Smith-Waterman did not finish, partial results kept in file: {partial_output}')
+        else:
+            os.remove(partial_output)
+
     # Write results to file
-    write_smith_waterman_results(output, gene_name, result_to_write)
+    if output is not None:
+        write_table(results, table_path(f'{output}/output_{gene_name}_smith_waterman', table_format))
 
-    return
+    results.attrs['complete'] = complete
+    return results
@@ -0,0 +1,208 @@
+import numpy as np
+
+# Score-only Smith-Waterman (local alignment, affine gaps) vectorized with NumPy.
+# Scores are identical to Bio.Align.PairwiseAligner in local mode with the same parameters,
+# where a gap of length k scores open_gap_score + (k - 1) * extend_gap_score.
+
+
+def scoring_table(match, mismatch, substitution_matrix=None):
+    """Creates the 256 x 256 score lookup table used by the NumPy engine, indexed by byte values.
+
+    Args:
+        match (float): Score for match, used without a substitution matrix.
+        mismatch (float): Score for mismatch, used without a substitution matrix.
+        substitution_matrix (Bio.Align.substitution_matrices.Array, optional): Substitution matrix, e.g. BLOSUM62. Defaults to None.
+
+    Returns:
+        tuple: (table, valid), the float64 score table and a boolean array of the byte values allowed in sequences.
+    """
+    if substitution_matrix is None:
+        table = np.full((256, 256), float(mismatch))
+        np.fill_diagonal(table, float(match))
+        valid = np.ones(256, dtype=bool)
+        return table, valid
+
+    # Letters outside of the matrix alphabet are rejected, like PairwiseAligner does
+    codes = np.frombuffer(substitution_matrix.alphabet.encode(), dtype=np.uint8)
+    table = np.zeros((256, 256))
+    table[np.ix_(codes, codes)] = np.asarray(substitution_matrix)
+    valid = np.zeros(256, dtype=bool)
+    valid[codes] = True
+    return table, valid
+
+
+def encode(sequence):
+    """Encodes a sequence string as a uint8 array of its byte values, uint8 arrays are used as they are."""
+    if isinstance(sequence, np.ndarray):
+        return sequence
+    return np.frombuffer(sequence.encode(), dtype=np.uint8)
+
+
+def score_dtype(table, gap_open, gap_extend):
+    """Picks float32 for the DP when all scores are integers (exact in float32), float64 otherwise."""
+    values = np.concatenate([np.unique(table), [gap_open, gap_extend]])
+    if np.all(values == np.round(values)) and np.abs(values).max() < 2**16:
+        return np.float32
+    return np.float64
+
+
+def smith_waterman_scores_one_to_many(query, targets, table, gap_open, gap_extend, valid=None, block_size=64):
+    """Calculates the Smith-Waterman local alignment scores of one query against many target sequences.
+
+    The query profile (scores of every residue code against each query position) is built once. Targets
+    are sorted by length and processed in blocks of block_size, padded to the longest target of the block.
+    For each target position the DP of the whole block is updated at once on (block, query length) arrays,
+    with the same three-state recurrence as smith_waterman_score(): M and F depend on the previous target
+    position, E is a prefix maximum along the query. Padding scores -inf, so it never adds to a score.
+
+    Args:
+        query (str or numpy.ndarray): Query sequence, or its uint8 encoding.
+        targets (list): Target sequences, or their uint8 encodings.
+        table (numpy.ndarray): 256 x 256 score table from scoring_table().
+        gap_open (float): Score of the first position of a gap.
+        gap_extend (float): Score of each further position of a gap.
+        valid (numpy.ndarray, optional): Allowed byte values from scoring_table(). Defaults to None (all allowed).
+        block_size (int, optional): Number of targets aligned together. Defaults to 64.
+
+    Raises:
+        ValueError: The query contains letters not in the alphabet of the substitution matrix.
+
+    Returns:
+        numpy.ndarray: float64 scores in the order of targets. NaN for targets with letters not in the alphabet.
+    """
+    q = encode(query)
+    if valid is not None and not valid[q].all():
+        raise ValueError("sequence contains letters not in the alphabet")
+
+    scores = np.zeros(len(targets))
+    n = len(q)
+    if n == 0 or len(targets) == 0:
+        return scores
+
+    dtype = score_dtype(table, gap_open, gap_extend)
+    gap_open = dtype(gap_open)
+    gap_extend = dtype(gap_extend)
+
+    # Query profile, with an extra all -inf row (code 256) for target padding
+    profile = np.full((257, n), -np.inf, dtype=dtype)
+    profile[:256] = table[:, q]
+
+    encoded = [encode(target) for target in targets]
+    lengths = np.array([len(target) for target in encoded])
+    positions = np.arange(n + 1, dtype=dtype)
+
+    order = np.argsort(lengths, kind="stable")
+    for start in range(0, len(order), block_size):
+        block = order[start : start + block_size]
+        width = lengths[block].max()
+        if width == 0:
+            continue
+
+        # Padded target codes, one row per target
+        codes = np.full((len(block), width), 256, dtype=np.int16)
+        for row, index in enumerate(block):
+            codes[row, : lengths[index]] = encoded[index]
+
+        M = np.full((len(block), n + 1), -np.inf, dtype=dtype)
+        E = np.full_like(M, -np.inf)
+        F = np.full_like(M, -np.inf)
+        M_new = np.full_like(M, -np.inf)
+        best_alignment = np.empty_like(M)
+        opened = np.empty_like(M)
+        best = np.zeros(len(block), dtype=dtype)
+
+        # E[j] = max over k < j of G[k] + gap_open + (j - 1 - k) * gap_extend, computed in the loop as a prefix
+        # maximum of G[k] - k * gap_extend. Its shift by the query position is the same for every column
+        shift = positions[:-1] * gap_extend
+        E[:, 1:] = -np.inf
+
+        for column in range(width):
+            # Best alignment ending in each cell of the previous target position
+            np.maximum(M, E, out=opened)
+            np.maximum(opened, F, out=best_alignment)
+
+            # Gaps in the query direction continue from the previous target position
+            opened += gap_open
+            F += gap_extend
+            np.maximum(F, opened, out=F)
+
+            # Local alignments start fresh (0) or extend the best alignment of the diagonal cell
+            np.maximum(best_alignment[:, :-1], 0, out=M_new[:, 1:])
+            M_new[:, 1:] += profile[codes[:, column]]
+
+            # Gaps in the target direction are a prefix maximum along the query
+            np.maximum(M_new, F, out=opened)
+            np.subtract(opened[:, :-1], shift, out=E[:, 1:])
+            np.maximum.accumulate(E[:, 1:], axis=1, out=E[:, 1:])
+            E[:, 1:] += shift + gap_open
+
+            M, M_new = M_new, M
+            np.maximum(best, M.max(axis=1), out=best)
+
+        scores[block] = best
+
+    if valid is not None:
+        for index, target in enumerate(encoded):
+            if not valid[target].all():
+                scores[index] = np.nan
+
+    return scores
+
+
+def smith_waterman_scores_by_query(sequence_pairs, table, gap_open, gap_extend, valid=None, block_size=64):
+    """Scores a list of (seq1, seq2) pairs, running smith_waterman_scores_one_to_many() once per distinct seq1.
+
+    Args:
+        sequence_pairs (list): List of (seq1, seq2) tuples.
+        table (numpy.ndarray): 256 x 256 score table from scoring_table().
+        gap_open (float): Score of the first position of a gap.
+        gap_extend (float): Score of each further position of a gap.
+        valid (numpy.ndarray, optional): Allowed byte values from scoring_table(). Defaults to None (all allowed).
+        block_size (int, optional): Number of targets aligned together. Defaults to 64.
+
+    Returns:
+        numpy.ndarray: float64 scores in the order of sequence_pairs. NaN for pairs with letters not in the alphabet.
+    """
+    pairs_per_query = {}
+    for index, (seq1, _) in enumerate(sequence_pairs):
+        pairs_per_query.setdefault(seq1, []).append(index)
+
+    scores = np.full(len(sequence_pairs), np.nan)
+    for query, indices in pairs_per_query.items():
+        targets = [sequence_pairs[index][1] for index in indices]
+        try:
+            scores[indices] = smith_waterman_scores_one_to_many(query, targets, table, gap_open, gap_extend, valid, block_size)
+        except ValueError:
+            # Query with letters not in the alphabet, all of its pairs stay NaN
+            pass
+
+    return scores
+
+
+def smith_waterman_score(seq1, seq2, table, gap_open, gap_extend, valid=None):
+    """Calculates the Smith-Waterman local alignment score of two sequences.
+
+    Uses the three-state affine gap recurrence (alignment ending in an aligned pair M, a horizontal gap E,
+    or a vertical gap F), so that a gap is never "re-opened" right after itself. The DP is evaluated one
+    residue of seq2 at a time, vectorized along seq1: M and F only depend on the previous residue, and
+    E is a prefix maximum over M and F along seq1. This is smith_waterman_scores_one_to_many() with a
+    single target.
+
+    Args:
+        seq1 (str): First sequence.
+        seq2 (str): Second sequence.
+        table (numpy.ndarray): 256 x 256 score table from scoring_table().
+        gap_open (float): Score of the first position of a gap.
+        gap_extend (float): Score of each further position of a gap.
+        valid (numpy.ndarray, optional): Allowed byte values from scoring_table(). Defaults to None (all allowed).
+
+    Raises:
+        ValueError: A sequence contains letters not in the alphabet of the substitution matrix.
+
+    Returns:
+        float: Best local alignment score.
+    """
+    score = smith_waterman_scores_one_to_many(seq1, [seq2], table, gap_open, gap_extend, valid)[0]
+    if np.isnan(score):
+        raise ValueError("sequence contains letters not in the alphabet")
+    return float(score)
@@ -1,23 +1,44 @@
 import pandas as pd
 import logging
 
+from scripts.table_io import read_table
+from scripts.table_io import table_path
+from scripts.table_io import write_table
+
 logger = logging.getLogger(__name__)
 
-def csv_sorter(input_csv, genome, output, sort_value_metric, name_output, cut_off_value=False, greater_than=False, only_sort=False):
+def table_sorter(table, sort_value_metric, cut_off_value=False, greater_than=False, only_sort=False):
+    """Sorts a table on a column, and unless only_sort, filters it on a cut-off and sorts it ascending. Used by csv_sorter().
+
+    Args:
+        table (pandas.DataFrame or str): Table, or path of a result file.
+        sort_value_metric (str): Column to sort (and filter) on.
+        cut_off_value (float, optional): Cut-off, rows below it are kept (above it with greater_than). Defaults to False.
+        greater_than (bool, optional): Keep the rows above the cut-off. Defaults to False.
+        only_sort (bool, optional): Only sort descending, without filtering. Defaults to False.
+
+    Returns:
+        pandas.DataFrame: The sorted table, with a new index.
+    """
+    df = read_table(table)
+    df_sorted = df.sort_values(by=sort_value_metric, ascending=False, kind="stable")
+    if not only_sort:
+        if greater_than:
+            df_sorted = df_sorted[df_sorted[sort_value_metric] > cut_off_value]
+            df_sorted = df_sorted.sort_values(by=sort_value_metric, ascending=True, kind="stable")
+        else:
+            df_sorted = df_sorted[df_sorted[sort_value_metric] < cut_off_value]
+            df_sorted = df_sorted.sort_values(by=sort_value_metric, ascending=True, kind="stable")
+    return df_sorted.reset_index(drop=True)
+
+
+def csv_sorter(input_csv, genome, output, sort_value_metric, name_output, cut_off_value=False, greater_than=False, only_sort=False, table_format='csv'):
     try:
-        df = pd.read_csv(input_csv)
-        df_sorted = df.sort_values(by=sort_value_metric, ascending=False)
-        if not only_sort:
-            if greater_than:
-                df_sorted = df_sorted[df_sorted[sort_value_metric] > cut_off_value]
-                df_sorted = df_sorted.sort_values(by=sort_value_metric, ascending=True)
-            else:
-                df_sorted = df_sorted[df_sorted[sort_value_metric] < cut_off_value]
-                df_sorted = df_sorted.sort_values(by=sort_value_metric, ascending=True)
-        logger.info(f'Results from csv_sorter function are saved in file: output_{genome}_{name_output}.csv')
+        df_sorted = table_sorter(input_csv, sort_value_metric, cut_off_value, greater_than, only_sort)
+        logger.info(f'Results from csv_sorter function are saved in file: {table_path(f"output_{genome}_{name_output}", table_format)}')
     except Exception as ex:
         logger.error(f'Error in csv_sorter function: {ex}')
-    df_sorted.to_csv(f'{output}/output_{genome}_{name_output}.csv', index=False)
+    write_table(df_sorted, table_path(f'{output}/output_{genome}_{name_output}', table_format))
 
 
       
@@ -2,25 +2,34 @@ import os
 import logging
 import pandas as pd
 import numpy as np
-import matplotlib
-matplotlib.use('Agg')
-from matplotlib import pyplot as plt
-from matplotlib.lines import Line2D
-import seaborn as sns
 import scipy.stats as stats
 import statsmodels.stats.multitest as multitest
 
+logger = logging.getLogger(__name__)
 
-def statistics_calculation(
-    final_results_dataframe, save_loc, multiple_correction_method, plot_dpi=600
-):
+# The plots of the statistics are made by the separate plots stage, see statistics_plots.py
+
+# Methods of fit_gumbel(). "mle" fits all scores, "subsample" a stratified subsample of them, "binned" the
+# histogram of the scores, "scipy" uses stats.gumbel_r.fit(), and "auto" picks "mle" up to
+# GUMBEL_FIT_MAX_SCORES scores and "binned" above that.
+GUMBEL_FIT_METHODS = ["auto", "mle", "subsample", "binned", "scipy"]
+GUMBEL_FIT_MAX_SCORES = 100_000
+GUMBEL_FIT_BINS = 4096
+
+EULER_GAMMA = 0.5772156649015329
+
+
+def statistics_calculation(final_results_dataframe, multiple_correction_method, gumbel_fit="auto", null_calibration=None):
     """Performs the statistical analysis for the pipeline.
 
     Args:
-        final_results_file (str): File path for the final results .csv file
-        save_loc (str): Directory to save the results of the statistical analysis
-        plot_dpi (int, optional): Resolution of all resulting plots. Defaults to 600.
+        final_results_dataframe (pandas.DataFrame): Characterized hits, with a Normalized_score column.
         multiple_correction_method (str, optional): Multiple correction method for the calculation of final p-values. Defaults to 'fdr_by'.
+        gumbel_fit (str, optional): Method of the Gumbel fit, one of GUMBEL_FIT_METHODS. Defaults to "auto".
+        null_calibration (dict, optional): Calibration of the database, see null_calibration.py. The p-values then use its Gumbel parameters for the length of each protein, the fit to the scores is only reported and plotted. Defaults to None (p-values from the fit).
+
+    Returns:
+        tuple: (final results dataframe, Gumbel parameters (mu, beta)), the parameters for the plots.
     """
 
     # Load 'final' data and extract normalized scores
@@ -28,19 +37,32 @@ def statistics_calculation(
 
     scores = final_results_dataframe["Normalized_score"].to_numpy()
 
-    # Create and save a normalized histogram of the normalized scores
-    # With a KDE estimator line
-    save_normalized_histogram(scores, save_loc, plot_dpi)
-
     # Calculate and append robust Z-scores to new column
     final_results_dataframe["Robust_Zscores"] = calculate_robust_z_scores(scores)
 
     # Fit gumbel curve to final normalized scores
-    gumbel_params = fit_gumbel(scores, save_loc, plot_dpi)
+    gumbel_params = fit_gumbel(scores, gumbel_fit)
+
+    # Report how well the Gumbel distribution describes the scores
+    goodness_of_fit = gumbel_goodness_of_fit(scores, gumbel_params)
+    print(
+        f"Gumbel fit: mu = {gumbel_params[0]:.4g}, beta = {gumbel_params[1]:.4g}, "
+        f"Kolmogorov-Smirnov statistic = {goodness_of_fit['ks_statistic']:.4f} (p = {goodness_of_fit['ks_pvalue']:.3g})"
+    )
+    logger.info(f"Gumbel fit ({gumbel_fit}) {gumbel_params}, goodness of fit {goodness_of_fit}")
+
+    # Parameters of the p-values, from the calibration of the database or else from the fit
+    if null_calibration is not None:
+        print("Taking the Gumbel parameters of the p-values from the null calibration of the database")
+        p_value_params = calibrated_gumbel_parameters(
+            null_calibration, final_results_dataframe["Length"].to_numpy()
+        )
+    else:
+        p_value_params = gumbel_params
 
     # Calculate corrected p-values and save as results column
     final_results_dataframe["Corrected_pvalues"] = calculate_gumbel_p_values(
-        scores, gumbel_params, multiple_correction_method
+        scores, p_value_params, multiple_correction_method
     )
 
     # save the final dataframe
@@ -49,62 +71,7 @@ def statistics_calculation(
 
     print(f"Finished statistical analysis")
 
-    return final_results_dataframe
-
-
-def save_normalized_histogram(scores, save_path, plot_dpi=600):
-    """Create and save a normalized histogram of the normalized alignment scores, with a KDE estimator line.
-
-    Args:
-        scores (numpy.ndarray): A NumPy array of Normalized_score extracted from the final results dataframe.
-        save_path (str): Location to save the plot.
-        plot_dpi (int, optional): DPI quality of saved plots. Defaults to 600.
-
-    Returns:
-            Boolean: True for successfully creating and saving the histogram, False for any failure to do so.
-
-
-    """
-
-    print("Creating and saving histogram of normalized scores for final results...")
-    try:
-        hist_plot = sns.histplot(
-            scores, stat="density", kde=True, label="Kernel Density Estimator"
-        )
-
-        hist_plot.set_title("Histogram plot of Normalized scores")
-        hist_plot.set_xlabel("Normalized Alignment Scores")
-        hist_plot.legend()
-
-        # Create a custom legend for the KDE line
-        kde_line = hist_plot.lines[
-            0
-        ]  # Typically, the KDE line is the first line object in the plot
-
-        # Create a legend with a line style
-        legend_lines = [
-            Line2D(
-                [0],
-                [0],
-                color=kde_line.get_color(),
-                lw=2,
-                label="Kernel Density Estimator",
-            )
-        ]
-
-        hist_plot.legend(handles=legend_lines, loc="best")
-
-        plot_name = "Histogram_normalized_scores.png"
-        plt.savefig(save_path + plot_name, dpi=plot_dpi)
-
-        plt.close()
-
-        return True
-
-    except Exception as ee:
-        print(f"Saving histogram of Normalized scores failed with:{ee}")
-
-        return False
+    return final_results_dataframe, gumbel_params
 
 
 def calculate_robust_z_scores(scores):
@@ -140,130 +107,200 @@ def calculate_robust_z_scores(scores):
     return z_scores
 
 
-def fit_gumbel(scores, save_loc, plot_dpi=600):
+def fit_gumbel(scores, method="auto", max_scores=GUMBEL_FIT_MAX_SCORES, seed=0):
     """Fits the gumbel distribution to all of the Normalized scores.
-    Also creates and saves plots meant to check the success of the fit.
+    The plots meant to check the success of the fit are made by statistics_plots.plot_statistics().
 
     Args:
         scores (numpy.ndarray):  A NumPy array of Normalized_score extracted from the final results dataframe.
-        save_loc (str): Location to save the plot.
-        plot_dpi (int, optional): DPI quality of saved plots. Defaults to 600.
+        method (str, optional): One of GUMBEL_FIT_METHODS. Defaults to "auto".
+        max_scores (int, optional): Size of the subsample, and the largest number of scores "auto" fits without binning. Defaults to GUMBEL_FIT_MAX_SCORES.
+        seed (int, optional): Random seed of the subsample. Defaults to 0.
 
     Returns:
         tuple: Tuple of parameters from the Gumbel fit. Structure: (mu, beta)
     """
 
-    # Fit Gumbel distribution to the scores
-    params = stats.gumbel_r.fit(scores)
+    scores = np.asarray(scores, dtype=np.float64)
 
-    # Save plots for checking the assumptions of fit
-    plot_and_save_gumbel_fit(scores, params, save_loc, plot_dpi)
-    save_qq_plot_for_gumbel_fit(scores, params, save_loc, plot_dpi)
+    if method == "auto":
+        method = "mle" if len(scores) <= max_scores else "binned"
 
-    return params
+    # Fit Gumbel distribution to the scores
+    if method == "mle":
+        params = gumbel_mle(scores)
+    elif method == "subsample":
+        params = gumbel_mle(stratified_subsample(scores, max_scores, seed))
+    elif method == "binned":
+        params = gumbel_mle(*binned_scores(scores))
+    elif method == "scipy":
+        params = stats.gumbel_r.fit(scores)
+    else:
+        raise ValueError(f"Unknown Gumbel fit method {method}, expected one of {GUMBEL_FIT_METHODS}")
 
+    return tuple(float(param) for param in params)
 
-def calculate_gumbel_p_values(scores, params, multiple_correction_method):
-    """Calculates p-values based on the fitted Gumbel distribution
-      assuming a one-tailed test, ergo H1: normalized score is abnormally high.
-      Also performs multiple test correction of the resulting p-values.
+
+def gumbel_moments(scores, weights=None):
+    """Closed-form method of moments estimate of the Gumbel parameters, the starting point of gumbel_mle().
 
     Args:
-        scores (numpy.ndarray): A NumPy array of Normalized_score extracted from the final results dataframe.
-        params (tuple): Parameters from the gumbel_fit,  (mu, beta)
-        multiple_correction_method (str, optional): Method selected for multiple test correction, using the statsmodels.stats.multitest module. Defaults to 'fdr_by' == Storey's Q test.
+        scores (numpy.ndarray): Scores.
+        weights (numpy.ndarray, optional): Weight of each score, e.g. the counts of binned scores. Defaults to None.
 
     Returns:
-        numpy.ndarray: A NumPy array of p-values (or q-values) for the normalized scores, based on the Gumbel fit.
+        tuple: (mu, beta)
     """
+    mean = np.average(scores, weights=weights)
+    beta = np.sqrt(6 * np.average((scores - mean) ** 2, weights=weights)) / np.pi
+    return mean - EULER_GAMMA * beta, beta
 
-    mu, beta = params
-    cdf_values = stats.gumbel_r.cdf(scores, loc=mu, scale=beta)
 
-    # Calculate the p-values (1 - CDF)
-    # This assumes a one-tailed test, ergo we are only interested in high scores
-    p_values = 1 - cdf_values
+def gumbel_mle(scores, weights=None, tolerance=1e-10, max_iterations=50):
+    """Maximum likelihood fit of the Gumbel distribution, by Newton's method on the scale.
 
-    from statsmodels.stats.multitest import multipletests
+    For a scale beta the likelihood is highest at mu = -beta * log(mean(exp(-x / beta))), which leaves the
+    one equation beta = mean(x) - sum(x w) / sum(w), with w = exp(-x / beta). Its derivative in beta is
+    1 + var_w(x) / beta^2, so Newton's method from the method of moments estimate converges in a handful
+    of passes over the scores.
 
-    _, corrected_p_values, _, _ = multipletests(
-        p_values, method=multiple_correction_method
-    )
+    Args:
+        scores (numpy.ndarray): Scores.
+        weights (numpy.ndarray, optional): Weight of each score, e.g. the counts of binned scores. Defaults to None.
+        tolerance (float, optional): Relative change of beta at which to stop. Defaults to 1e-10.
+        max_iterations (int, optional): Most Newton steps. Defaults to 50.
 
-    return corrected_p_values
+    Returns:
+        tuple: (mu, beta)
+    """
+    weights = np.ones_like(scores) if weights is None else np.asarray(weights, dtype=np.float64)
+    mu, beta = gumbel_moments(scores, weights)
+    if not beta > 0:
+        # All scores equal, no spread to fit
+        return mu, beta
+
+    # Scores relative to the lowest one, so that exp(-x / beta) stays within range
+    shifted = scores - scores.min()
+    mean = np.average(shifted, weights=weights)
+
+    for _ in range(max_iterations):
+        w = weights * np.exp(-shifted / beta)
+        total = w.sum()
+        weighted_mean = (w * shifted).sum() / total
+        weighted_variance = (w * (shifted - weighted_mean) ** 2).sum() / total
+
+        step = (beta - mean + weighted_mean) / (1 + weighted_variance / beta**2)
+        beta = beta - step if step < beta else beta / 2
+        if abs(step) <= tolerance * beta:
+            break
+    else:
+        logger.warning(f"Gumbel fit did not converge in {max_iterations} iterations")
+
+    w = weights * np.exp(-shifted / beta)
+    mu = scores.min() - beta * np.log(w.sum() / weights.sum())
+    return mu, beta
+
+
+def stratified_subsample(scores, size, seed=0):
+    """Subsample of the scores stratified on their rank: one random score from each of size equally large
+    strata of the sorted scores, so that the tails are represented as in the full set.
+
+    Args:
+        scores (numpy.ndarray): Scores.
+        size (int): Size of the subsample.
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        numpy.ndarray: The subsample, or all scores when there are at most size.
+    """
+    if len(scores) <= size:
+        return scores
+    rng = np.random.default_rng(seed)
+    positions = ((np.arange(size) + rng.random(size)) * (len(scores) / size)).astype(np.int64)
+    return np.sort(scores)[positions]
 
 
-def plot_and_save_gumbel_fit(scores, params, save_loc, plot_dpi=600):
-    """Create and save a normalized histogram of the alignment scores, in comparison to the Gumbel fit. Good for an initial check.
+def binned_scores(scores, bins=GUMBEL_FIT_BINS):
+    """Histogram of the scores as (bin centers, counts) of the non-empty bins, for a binned likelihood fit.
 
     Args:
-        scores (numpy.ndarray):  A NumPy array of Normalized_score extracted from the final results dataframe.
-        params (tuple): Parameters from the gumbel_fit,  (mu, beta)
-        save_loc (str): Location to save the plot.
-        plot_dpi (int, optional): DPI quality of saved plots. Defaults to 600.
+        scores (numpy.ndarray): Scores.
+        bins (int, optional): Number of bins. Defaults to GUMBEL_FIT_BINS.
 
     Returns:
-        Boolean: True for successfully creating and saving the histogram, False for any failure to do so.
+        tuple: (numpy.ndarray of bin centers, numpy.ndarray of counts)
     """
+    counts, edges = np.histogram(scores, bins=bins)
+    centers = (edges[:-1] + edges[1:]) / 2
+    filled = counts > 0
+    return centers[filled], counts[filled]
 
-    try:
-        # Generate the distribution for gumbel
-        mu, beta = params
-        x = np.linspace(min(scores), max(scores), 10_000)
-        pdf_fitted = stats.gumbel_r.pdf(x, loc=mu, scale=beta)
 
-        # Plot the histogram of your scores
-        plt.hist(
-            scores, density=True, alpha=0.6, color="blue", label="Histogram of scores"
-        )
+def gumbel_goodness_of_fit(scores, params, max_scores=GUMBEL_FIT_MAX_SCORES, seed=0):
+    """Kolmogorov-Smirnov test of the scores against the fitted Gumbel distribution.
 
-        # Plot the fitted Gumbel PDF
-        plt.plot(x, pdf_fitted, "r-", lw=2, label="Fitted Gumbel PDF")
+    Large score sets are tested on a random subsample. The p-value is optimistic, since the
+    parameters were fitted on the same scores.
 
-        # Add labels and title
-        plt.title("Fitted Gumbel Distribution to Alignment Scores")
-        plt.xlabel("Normalized Alignment Score")
-        plt.ylabel("Density")
-        plt.legend()
+    Args:
+        scores (numpy.ndarray): Scores.
+        params (tuple): Parameters from the gumbel_fit,  (mu, beta)
+        max_scores (int, optional): Most scores to test. Defaults to GUMBEL_FIT_MAX_SCORES.
+        seed (int, optional): Random seed of the subsample. Defaults to 0.
 
-        plot_name = "Gumbel_fit_histogram.png"
-        plt.savefig(save_loc + plot_name, dpi=plot_dpi)
-        plt.close()
+    Returns:
+        dict: "ks_statistic", "ks_pvalue" and the number of scores tested, "n".
+    """
+    sample = np.asarray(scores, dtype=np.float64)
+    if len(sample) > max_scores:
+        sample = np.random.default_rng(seed).choice(sample, max_scores, replace=False)
+    result = stats.kstest(sample, "gumbel_r", args=params)
+    return {"ks_statistic": float(result.statistic), "ks_pvalue": float(result.pvalue), "n": len(sample)}
 
-        return True
 
-    except Exception as ee:
-        print(f"Saving histogram for Gumbel fit failed with:{ee}")
-        return False
+def calibrated_gumbel_parameters(null_calibration, lengths):
+    """Looks up the Gumbel parameters of proteins in a null calibration by the length bin they fall in.
 
+    Args:
+        null_calibration (dict): Calibration of the database, see null_calibration.py.
+        lengths (numpy.ndarray): Protein lengths.
+
+    Returns:
+        tuple: (mu, beta) arrays, one value per protein.
+    """
+    bins = null_calibration["bins"]
+    lower_bounds = np.array([length_bin["min_length"] for length_bin in bins])
+    # Proteins shorter than the first bin count as the first bin
+    positions = np.clip(np.searchsorted(lower_bounds, lengths, side="right") - 1, 0, len(bins) - 1)
+    mu = np.array([length_bin["mu"] for length_bin in bins])[positions]
+    beta = np.array([length_bin["beta"] for length_bin in bins])[positions]
+    return mu, beta
 
-def save_qq_plot_for_gumbel_fit(scores, params, save_loc, plot_dpi=600):
-    """Generates a Q-Q plot for the Gumbel fit. This is the main plot to
-      consult in order to determine if the fit is successful. Note that
-      if the pipeline actually produced a positive hit, that will show as a
-      deviation in the higher scores.
+
+def calculate_gumbel_p_values(scores, params, multiple_correction_method):
+    """Calculates p-values based on the fitted Gumbel distribution
+      assuming a one-tailed test, ergo H1: normalized score is abnormally high.
+      Also performs multiple test correction of the resulting p-values.
 
     Args:
-        scores (numpy.ndarray):  A NumPy array of Normalized_score extracted from the final results dataframe.
-        params (tuple): Parameters from the gumbel_fit,  (mu, beta)
-        save_loc (str): Location to save the plot.
-        plot_dpi (int, optional): DPI quality of saved plots. Defaults to 600.
+        scores (numpy.ndarray): A NumPy array of Normalized_score extracted from the final results dataframe.
+        params (tuple): Parameters from the gumbel_fit,  (mu, beta), or arrays of them per score, see calibrated_gumbel_parameters()
+        multiple_correction_method (str, optional): Method selected for multiple test correction, using the statsmodels.stats.multitest module. Defaults to 'fdr_by' == Storey's Q test.
 
     Returns:
-        Boolean: True for successfully creating and saving the histogram, False for any failure to do so.
+        numpy.ndarray: A NumPy array of p-values (or q-values) for the normalized scores, based on the Gumbel fit.
     """
 
-    try:
-        stats.probplot(scores, dist="gumbel_r", sparams=params, plot=plt)
-        plt.title("Q-Q Plot for Gumbel Fit against Normalized scores")
+    mu, beta = params
 
-        plot_name = "QQ_plot_gumbel_fit.png"
-        plt.savefig(save_loc + plot_name, dpi=plot_dpi)
-        plt.close()
+    # Calculate the p-values (1 - CDF = 1 - exp(-exp(-z))), with expm1 so that small p-values keep their precision
+    # This assumes a one-tailed test, ergo we are only interested in high scores
+    p_values = -np.expm1(-np.exp(-(np.asarray(scores) - mu) / beta))
 
-        return True
+    from statsmodels.stats.multitest import multipletests
 
-    except Exception as ee:
+    _, corrected_p_values, _, _ = multipletests(
+        p_values, method=multiple_correction_method
+    )
 
-        print(f"Saving histogram for Gumbel fit failed with:{ee}")
-        return False
+    return corrected_p_values
@@ -0,0 +1,205 @@
+import logging
+import threading
+import concurrent.futures as futures
+from functools import wraps
+import numpy as np
+import matplotlib
+matplotlib.use('Agg')
+from matplotlib import pyplot as plt
+from matplotlib.lines import Line2D
+import seaborn as sns
+import scipy.stats as stats
+
+logger = logging.getLogger(__name__)
+
+# Plots of the statistical analysis, made by their own stage after the final results are written. The three
+# plots are independent and are rendered in parallel in worker processes, each with its own pyplot state.
+
+# pyplot keeps global state, so plots drawn from several threads of one process are drawn one at a time
+_PLOT_LOCK = threading.Lock()
+
+
+def one_plot_at_a_time(plot_function):
+    """Decorator that serializes calls to pyplot based plotting functions between threads."""
+
+    @wraps(plot_function)
+    def wrapper(*args, **kwargs):
+        with _PLOT_LOCK:
+            return plot_function(*args, **kwargs)
+
+    return wrapper
+
+
+def plot_statistics(scores, params, save_loc, plot_format="png", plot_dpi=600, executor=None):
+    """Creates and saves the plots of the statistical analysis in parallel worker processes.
+
+    Args:
+        scores (numpy.ndarray): A NumPy array of Normalized_score extracted from the final results dataframe.
+        params (tuple): Parameters from the gumbel_fit, (mu, beta)
+        save_loc (str): Directory to save the plots in, ending with a separator.
+        plot_format (str, optional): File format of the plots, "png" or "svg". Defaults to "png".
+        plot_dpi (int, optional): DPI quality of saved plots. Defaults to 600.
+        executor (concurrent.futures.Executor, optional): Pool to render the plots in, e.g. one shared between genomes. Defaults to None (a new ProcessPoolExecutor).
+
+    Returns:
+        int: Number of plots saved.
+    """
+
+    print("Creating and saving plots of the statistical analysis...")
+
+    plots = [
+        (save_normalized_histogram, (scores, save_loc, plot_dpi, plot_format)),
+        (plot_and_save_gumbel_fit, (scores, params, save_loc, plot_dpi, plot_format)),
+        (save_qq_plot_for_gumbel_fit, (scores, params, save_loc, plot_dpi, plot_format)),
+    ]
+
+    def render(ex):
+        submitted = [ex.submit(plot, *arguments) for plot, arguments in plots]
+        return [future.result() for future in submitted]
+
+    if executor is not None:
+        saved = render(executor)
+    else:
+        with futures.ProcessPoolExecutor(max_workers=len(plots)) as ex:
+            saved = render(ex)
+
+    logger.info(f"Saved {sum(saved)} of {len(plots)} plots in {save_loc}")
+
+    return sum(saved)
+
+
+@one_plot_at_a_time
+def save_normalized_histogram(scores, save_path, plot_dpi=600, plot_format="png"):
+    """Create and save a normalized histogram of the normalized alignment scores, with a KDE estimator line.
+
+    Args:
+        scores (numpy.ndarray): A NumPy array of Normalized_score extracted from the final results dataframe.
+        save_path (str): Location to save the plot.
+        plot_dpi (int, optional): DPI quality of saved plots. Defaults to 600.
+        plot_format (str, optional): File format of the plot, "png" or "svg". Defaults to "png".
+
+    Returns:
+            Boolean: True for successfully creating and saving the histogram, False for any failure to do so.
+
+
+    """
+
+    print("Creating and saving histogram of normalized scores for final results...")
+    try:
+        hist_plot = sns.histplot(
+            scores, stat="density", kde=True, label="Kernel Density Estimator"
+        )
+
+        hist_plot.set_title("Histogram plot of Normalized scores")
+        hist_plot.set_xlabel("Normalized Alignment Scores")
+        hist_plot.legend()
+
+        # Create a custom legend for the KDE line
+        kde_line = hist_plot.lines[
+            0
+        ]  # Typically, the KDE line is the first line object in the plot
+
+        # Create a legend with a line style
+        legend_lines = [
+            Line2D(
+                [0],
+                [0],
+                color=kde_line.get_color(),
+                lw=2,
+                label="Kernel Density Estimator",
+            )
+        ]
+
+        hist_plot.legend(handles=legend_lines, loc="best")
+
+        plot_name = f"Histogram_normalized_scores.{plot_format}"
+        plt.savefig(save_path + plot_name, dpi=plot_dpi)
+
+        plt.close()
+
+        return True
+
+    except Exception as ee:
+        print(f"Saving histogram of Normalized scores failed with:{ee}")
+
+        return False
+
+
+@one_plot_at_a_time
+def plot_and_save_gumbel_fit(scores, params, save_loc, plot_dpi=600, plot_format="png"):
+    """Create and save a normalized histogram of the alignment scores, in comparison to the Gumbel fit. Good for an initial check.
+
+    Args:
+        scores (numpy.ndarray):  A NumPy array of Normalized_score extracted from the final results dataframe.
+        params (tuple): Parameters from the gumbel_fit,  (mu, beta)
+        save_loc (str): Location to save the plot.
+        plot_dpi (int, optional): DPI quality of saved plots. Defaults to 600.
+        plot_format (str, optional): File format of the plot, "png" or "svg". Defaults to "png".
+
+    Returns:
+        Boolean: True for successfully creating and saving the histogram, False for any failure to do so.
+    """
+
+    try:
+        # Generate the distribution for gumbel
+        mu, beta = params
+        x = np.linspace(min(scores), max(scores), 10_000)
+        pdf_fitted = stats.gumbel_r.pdf(x, loc=mu, scale=beta)
+
+        # Plot the histogram of your scores
+        plt.hist(
+            scores, density=True, alpha=0.6, color="blue", label="Histogram of scores"
+        )
+
+        # Plot the fitted Gumbel PDF
+        plt.plot(x, pdf_fitted, "r-", lw=2, label="Fitted Gumbel PDF")
+
+        # Add labels and title
+        plt.title("Fitted Gumbel Distribution to Alignment Scores")
+        plt.xlabel("Normalized Alignment Score")
+        plt.ylabel("Density")
+        plt.legend()
+
+        plot_name = f"Gumbel_fit_histogram.{plot_format}"
+        plt.savefig(save_loc + plot_name, dpi=plot_dpi)
+        plt.close()
+
+        return True
+
+    except Exception as ee:
+        print(f"Saving histogram for Gumbel fit failed with:{ee}")
+        return False
+
+
+@one_plot_at_a_time
+def save_qq_plot_for_gumbel_fit(scores, params, save_loc, plot_dpi=600, plot_format="png"):
+    """Generates a Q-Q plot for the Gumbel fit. This is the main plot to
+      consult in order to determine if the fit is successful. Note that
+      if the pipeline actually produced a positive hit, that will show as a
+      deviation in the higher scores.
+
+    Args:
+        scores (numpy.ndarray):  A NumPy array of Normalized_score extracted from the final results dataframe.
+        params (tuple): Parameters from the gumbel_fit,  (mu, beta)
+        save_loc (str): Location to save the plot.
+        plot_dpi (int, optional): DPI quality of saved plots. Defaults to 600.
+        plot_format (str, optional): File format of the plot, "png" or "svg". Defaults to "png".
+
+    Returns:
+        Boolean: True for successfully creating and saving the histogram, False for any failure to do so.
+    """
+
+    try:
+        stats.probplot(scores, dist="gumbel_r", sparams=params, plot=plt)
+        plt.title("Q-Q Plot for Gumbel Fit against Normalized scores")
+
+        plot_name = f"QQ_plot_gumbel_fit.{plot_format}"
+        plt.savefig(save_loc + plot_name, dpi=plot_dpi)
+        plt.close()
+
+        return True
+
+    except Exception as ee:
+
+        print(f"Saving histogram for Gumbel fit failed with:{ee}")
+        return False
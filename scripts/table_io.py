@@ -0,0 +1,182 @@
+import os
+import queue
+import logging
+import threading
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Tables are handed from stage to stage as pandas DataFrames. Files are only written as optional
+# intermediates, and stages still accept a file path where they used to, so they can run on their own.
+
+# Result file formats and their extensions. Parquet and Arrow IPC files are compressed with typed
+# columns, they need pyarrow, which is only imported when one of them is used.
+TABLE_FORMATS = {
+    "csv": ".csv",
+    "parquet": ".parquet",
+    "arrow": ".arrow",
+}
+
+# Compression of the Parquet and Arrow IPC files
+COMPRESSION = "zstd"
+
+
+def table_path(path, table_format="csv"):
+    """Returns path with the extension of table_format, path being given without extension."""
+    if table_format not in TABLE_FORMATS:
+        raise ValueError(f"Unknown table format '{table_format}', choose one of: {', '.join(TABLE_FORMATS)}")
+    return f"{path}{TABLE_FORMATS[table_format]}"
+
+
+def path_table_format(path):
+    """Format of a result file from its extension, files without a known extension being read as csv."""
+    extension = os.path.splitext(path)[1].lower()
+    for table_format, format_extension in TABLE_FORMATS.items():
+        if extension == format_extension:
+            return table_format
+    return "csv"
+
+
+def _pyarrow(table_format):
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError(f"The {table_format} table format requires pyarrow, install it or use the csv format")
+    return pyarrow
+
+
+def read_table(table):
+    """Returns table as a DataFrame, reading it when given the path of a result file.
+
+    Args:
+        table (pandas.DataFrame or str): Table, or path of a table written by write_table(), in the format of its extension.
+
+    Returns:
+        pandas.DataFrame: The table.
+    """
+    if isinstance(table, pd.DataFrame):
+        return table
+
+    table_format = path_table_format(table)
+    if table_format == "csv":
+        return pd.read_csv(table)
+
+    pyarrow = _pyarrow(table_format)
+    if table_format == "parquet":
+        return pyarrow.parquet.read_table(table).to_pandas()
+    return pyarrow.feather.read_table(table).to_pandas()
+
+
+def write_table(table, path, index=False):
+    """Writes a table in the format of the extension of path, see table_path().
+
+    Args:
+        table (pandas.DataFrame): Table to write.
+        path (str): Location of the file.
+        index (bool, optional): Also write the index. Defaults to False.
+    """
+    table_format = path_table_format(path)
+    if table_format == "csv":
+        table.to_csv(path, index=index)
+    else:
+        pyarrow = _pyarrow(table_format)
+        arrow_table = pyarrow.Table.from_pandas(table, preserve_index=index)
+        if table_format == "parquet":
+            pyarrow.parquet.write_table(arrow_table, path, compression=COMPRESSION)
+        else:
+            pyarrow.feather.write_feather(arrow_table, path, compression=COMPRESSION)
+    logger.info(f"Saved table of {len(table)} rows in file: {path}")
+
+
+def complete_lines_size(f, chunk_size=65536):
+    """Size of the part of a binary file up to and including its last newline, read backwards from the end."""
+    end = f.seek(0, os.SEEK_END)
+    while end > 0:
+        start = max(0, end - chunk_size)
+        f.seek(start)
+        newline = f.read(end - start).rfind(b"\n")
+        if newline >= 0:
+            return start + newline + 1
+        end = start
+    return 0
+
+
+class BackgroundTableWriter:
+    """Appends tables to a CSV file from a background thread, in the order they are given.
+
+    Used for results that arrive in pieces, so that they are on disk as soon as they arrive, and survive an
+    interrupted run. The file is always CSV, which can be appended to and read up to the last complete row.
+    Each piece is flushed once written. Close the writer (or use it as a context manager) to write the
+    remaining pieces, an error of the writer thread is raised by the next append() or by close().
+
+    Args:
+        path (str): Location of the file, truncated and given the header when the writer is made.
+        columns (list): Column names, the pieces have these columns in this order.
+        max_queued (int, optional): Number of pieces waiting to be written before append() blocks. Defaults to 64.
+        append (bool, optional): Append to an existing file instead, after its last complete line. Defaults to False.
+    """
+
+    def __init__(self, path, columns, max_queued=64, append=False):
+        self.path = path
+        self.columns = list(columns)
+        self.rows_written = 0
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._error = None
+
+        if append and os.path.exists(path):
+            # A line cut off by an interruption would run into the first appended row
+            with open(path, "rb+") as f:
+                f.truncate(complete_lines_size(f))
+        if append and os.path.exists(path) and os.path.getsize(path) > 0:
+            self._file = open(path, "a", newline="")
+        else:
+            self._file = open(path, "w", newline="")
+            pd.DataFrame(columns=self.columns).to_csv(self._file, index=False)
+            self._file.flush()
+
+        self._thread = threading.Thread(target=self._write, name="BackgroundTableWriter", daemon=True)
+        self._thread.start()
+
+    def _write(self):
+        while True:
+            table = self._queue.get()
+            if table is None:
+                break
+            if self._error is not None:
+                continue
+            try:
+                table[self.columns].to_csv(self._file, header=False, index=False)
+                self._file.flush()
+                self.rows_written += len(table)
+            except Exception as e:
+                self._error = e
+
+    def append(self, table):
+        """Queues a table to be appended to the file."""
+        if self._error is not None:
+            raise self._error
+        self._queue.put(table)
+
+    def close(self):
+        """Writes the queued tables and closes the file."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._file.close()
+        logger.info(f"Appended {self.rows_written} rows to file: {self.path}")
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            self.close()
+        except Exception as e:
+            # Do not hide the exception that ended the context
+            if exc_type is None:
+                raise
+            logger.error(f"Error writing {self.path}: {e}")